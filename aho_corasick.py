@@ -0,0 +1,95 @@
+from collections import deque
+from typing import Iterable, Iterator, Tuple, Any
+
+class AhoCorasick:
+    """多模式字符串匹配（Aho-Corasick 自动机）
+
+    一次线性扫描即可找出文本中出现的所有模式，扫描时间与模式数量无关。
+    """
+
+    def __init__(self, patterns: Iterable = None, ignore_case: bool = False):
+        """初始化匹配器
+
+        Args:
+            patterns: 模式列表，元素可以是字符串或 (模式, 值) 元组
+            ignore_case: 是否忽略大小写（对英文名字有用）
+        """
+        self.ignore_case = ignore_case
+        self._goto = [{}]       # 状态转移表
+        self._fail = [0]        # 失配指针
+        self._own = [[]]        # 每个状态自身对应的 (模式长度, 值)
+        self._outputs = [[]]    # 合并失配链后每个状态匹配到的 (模式长度, 值)
+        self._built = True
+        self._count = 0
+        for pattern in patterns or []:
+            if isinstance(pattern, tuple):
+                self.add(*pattern)
+            else:
+                self.add(pattern)
+
+    def __len__(self):
+        return self._count
+
+    def _normalize(self, text: str) -> str:
+        return text.lower() if self.ignore_case else text
+
+    def add(self, pattern: str, value: Any = None):
+        """添加模式，value 默认为模式本身"""
+        if not pattern:
+            return
+        value = pattern if value is None else value
+        state = 0
+        for char in self._normalize(pattern):
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._own.append([])
+                self._outputs.append([])
+            state = next_state
+        self._own[state].append((len(pattern), value))
+        self._count += 1
+        self._built = False
+
+    def build(self):
+        """构建失配指针（添加模式后首次匹配时自动调用）"""
+        queue = deque()
+        for next_state in self._goto[0].values():
+            self._fail[next_state] = 0
+            self._outputs[next_state] = list(self._own[next_state])
+            queue.append(next_state)
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                # 合并后缀状态的输出，匹配时无需再沿失配链查找
+                self._outputs[next_state] = self._own[next_state] + self._outputs[self._fail[next_state]]
+        self._built = True
+
+    def iter_matches(self, text: str) -> Iterator[Tuple[int, int, Any]]:
+        """遍历文本中所有匹配，返回 (起始位置, 结束位置, 值)"""
+        if not self._built:
+            self.build()
+        state = 0
+        for index, char in enumerate(self._normalize(text)):
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            for length, value in self._outputs[state]:
+                yield index + 1 - length, index + 1, value
+
+    def find_values(self, text: str) -> set:
+        """返回文本中出现的所有模式对应的值"""
+        return {value for _, _, value in self.iter_matches(text)}
+
+    def contains_any(self, text: str) -> bool:
+        """文本中是否出现任意一个模式"""
+        for _ in self.iter_matches(text):
+            return True
+        return False
@@ -0,0 +1,133 @@
+import wave
+from pathlib import Path
+from typing import List, Dict
+import numpy as np
+
+# 默认参数
+DEFAULT_TRIM_PAD = 0.08           # 裁剪后保留的首尾静音（秒）
+DEFAULT_SILENCE_THRESHOLD_DB = -45.0  # 低于该电平视为静音（dBFS）
+DEFAULT_TARGET_LOUDNESS_DB = -20.0    # 目标响度（有效语音部分的 RMS，dBFS）
+MAX_PEAK = 0.98                   # 归一化后的最大峰值，防止削波
+
+def _read_wav(path: Path):
+    """读取 16bit PCM WAV，返回 (样本数组[帧数, 声道数], 采样率)"""
+    with wave.open(str(path), 'rb') as wav_file:
+        if wav_file.getsampwidth() != 2:
+            raise ValueError(f"仅支持16bit PCM: {path}")
+        channels = wav_file.getnchannels()
+        rate = wav_file.getframerate()
+        frames = wav_file.readframes(wav_file.getnframes())
+    samples = np.frombuffer(frames, dtype='<i2').reshape(-1, channels)
+    return samples, rate
+
+def _write_wav(path: Path, samples: np.ndarray, rate: int):
+    """写入 16bit PCM WAV"""
+    with wave.open(str(path), 'wb') as wav_file:
+        wav_file.setnchannels(samples.shape[1])
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(rate)
+        wav_file.writeframes(samples.astype('<i2').tobytes())
+
+def _process_group(clips: List[np.ndarray], rate: int, pad: float, threshold_db: float, target_db: float):
+    """对同一格式的所有片段进行一次向量化处理
+
+    所有片段拼接为一个数组，静音检测、裁剪区间和响度计算都在整体数组上完成。
+
+    Returns:
+        list: 每个片段处理后的样本数组
+    """
+    lengths = np.array([len(clip) for clip in clips], dtype=np.int64)
+    offsets = np.concatenate(([0], np.cumsum(lengths)))
+    starts, ends = offsets[:-1], offsets[1:]
+    count = len(clips)
+
+    # 归一化到 [-1, 1]，取各声道的最大振幅用于静音检测
+    samples = np.concatenate(clips).astype(np.float32) / 32768.0
+    amplitude = np.abs(samples).max(axis=1)
+    clip_ids = np.repeat(np.arange(count), lengths)
+
+    # 找出每个片段第一个和最后一个非静音样本
+    threshold = 10 ** (threshold_db / 20)
+    voiced = np.flatnonzero(amplitude >= threshold)
+    first = np.full(count, -1, dtype=np.int64)
+    last = np.full(count, -1, dtype=np.int64)
+    if len(voiced):
+        voiced_ids = clip_ids[voiced]
+        # voiced 已排序，按片段分组后取首尾即可
+        boundaries = np.flatnonzero(np.diff(voiced_ids)) + 1
+        group_starts = np.concatenate(([0], boundaries))
+        group_ends = np.concatenate((boundaries, [len(voiced)])) - 1
+        first[voiced_ids[group_starts]] = voiced[group_starts]
+        last[voiced_ids[group_ends]] = voiced[group_ends]
+
+    # 计算裁剪区间（全静音的片段保持原样）
+    pad_frames = int(round(pad * rate))
+    has_voice = first >= 0
+    trim_starts = np.where(has_voice, np.maximum(starts, first - pad_frames), starts)
+    trim_ends = np.where(has_voice, np.minimum(ends, last + 1 + pad_frames), ends)
+
+    # 使用前缀和计算每个片段有效部分的 RMS
+    energy = np.concatenate(([0.0], np.cumsum((samples.astype(np.float64) ** 2).mean(axis=1))))
+    voiced_starts = np.where(has_voice, first, starts)
+    voiced_ends = np.where(has_voice, last + 1, ends)
+    voiced_lengths = np.maximum(voiced_ends - voiced_starts, 1)
+    rms = np.sqrt((energy[voiced_ends] - energy[voiced_starts]) / voiced_lengths)
+
+    # 计算增益，并限制峰值防止削波
+    peaks = np.zeros(count)
+    nonempty = lengths > 0
+    if nonempty.any():
+        peaks[nonempty] = np.maximum.reduceat(amplitude, starts[nonempty])
+    target_rms = 10 ** (target_db / 20)
+    gains = np.where(rms > 0, target_rms / np.maximum(rms, 1e-12), 1.0)
+    gains = np.where(peaks > 0, np.minimum(gains, MAX_PEAK / np.maximum(peaks, 1e-12)), gains)
+    gains = np.where(has_voice, gains, 1.0)
+
+    # 整体应用增益后再按片段切分
+    processed = np.clip(samples * gains[clip_ids][:, None] * 32768.0, -32768, 32767)
+    processed = np.round(processed).astype('<i2')
+    return [processed[trim_starts[i]:trim_ends[i]] for i in range(count)]
+
+def trim_and_normalize_clips(audio_info: List[Dict], audio_dir: str,
+                             pad: float = DEFAULT_TRIM_PAD,
+                             threshold_db: float = DEFAULT_SILENCE_THRESHOLD_DB,
+                             target_db: float = DEFAULT_TARGET_LOUDNESS_DB) -> List[Dict]:
+    """裁剪所有语音片段首尾的静音并统一响度，原地覆盖 WAV 文件并更新 duration
+
+    Args:
+        audio_info: process_voice_generation 生成的音频信息列表
+        audio_dir: 音频文件所在目录
+        pad: 裁剪后保留的首尾静音（秒）
+        threshold_db: 静音判定电平（dBFS）
+        target_db: 目标响度（dBFS）
+
+    Returns:
+        list: 更新后的音频信息列表
+    """
+    audio_dir = Path(audio_dir)
+
+    # 按格式（采样率、声道数）分组，同组片段一次性处理
+    groups = {}
+    for info in audio_info:
+        if "audio_file" not in info or "error" in info:
+            continue
+        audio_path = audio_dir / info["audio_file"]
+        try:
+            samples, rate = _read_wav(audio_path)
+        except Exception as e:
+            print(f"读取音频失败，跳过后处理 {audio_path}: {e}")
+            continue
+        groups.setdefault((rate, samples.shape[1]), []).append((info, audio_path, samples))
+
+    total_before = 0.0
+    total_after = 0.0
+    for (rate, _), items in groups.items():
+        processed = _process_group([samples for _, _, samples in items], rate, pad, threshold_db, target_db)
+        for (info, audio_path, samples), clip in zip(items, processed):
+            _write_wav(audio_path, clip, rate)
+            total_before += len(samples) / float(rate)
+            info["duration"] = len(clip) / float(rate)
+            total_after += info["duration"]
+
+    print(f"音频后处理完成: 总时长 {total_before:.2f}秒 -> {total_after:.2f}秒")
+    return audio_info
@@ -0,0 +1,197 @@
+import os
+import sys
+import json
+import time
+import argparse
+from pathlib import Path
+from dotenv import load_dotenv
+from text_processor import TextProcessor
+from story_analyzer import StoryAnalyzer, DEFAULT_SENTENCE_DURATION
+from llm_backend import LLMBackend, LLM_BACKENDS
+from llm_batch import BatchJobClient
+
+# 离线批处理：把多个故事的场景描述请求写入一个批处理任务，任务完成后写回各故事的 key_scenes.json
+#   python batch_process.py submit story1.txt story2.txt --scene_batch_size 5
+#   python batch_process.py collect
+
+BATCH_OUTPUT_DIR = "output/batch"
+DEFAULT_JOB_FILE = f"{BATCH_OUTPUT_DIR}/batch_job.json"
+
+def resolve_input_file(input_file: str) -> str:
+    """与 full_process 相同：只有文件名时在 input_texts 目录中查找"""
+    if not os.path.isabs(input_file) and not os.path.dirname(input_file):
+        return os.path.join("input_texts", input_file)
+    return input_file
+
+def analyze_story_file(input_file: str, backend: LLMBackend, scene_batch_size: int = None,
+                       use_llm_cache: bool = True):
+    """读取并分析故事，返回 (analyzer, sentences, text_processor)"""
+    with open(input_file, "r", encoding="utf-8") as f:
+        text = f.read()
+    text_processor = TextProcessor()
+    sentences = text_processor.process_japanese_text(text)
+    analyzer = StoryAnalyzer(use_cache=use_llm_cache, scene_batch_size=scene_batch_size, backend=backend)
+    analyzer.analyze_story(text, input_file)
+    return analyzer, sentences, text_processor
+
+def load_job(job_file: str) -> dict:
+    with open(job_file, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def save_job(job: dict, job_file: str):
+    Path(job_file).parent.mkdir(parents=True, exist_ok=True)
+    with open(job_file, "w", encoding="utf-8") as f:
+        json.dump(job, f, ensure_ascii=False, indent=2)
+
+def submit_stories(input_files: list, job_file: str = DEFAULT_JOB_FILE, backend: LLMBackend = None,
+                   scene_batch_size: int = None, use_llm_cache: bool = True) -> dict:
+    """分析所有故事并识别场景，将场景描述请求写入 JSONL 文件并提交批处理任务
+
+    故事分析和翻译仍然同步完成（请求量很小），只有场景描述请求进入批处理。
+
+    Returns:
+        dict: 任务信息（同时保存到 job_file）
+    """
+    backend = backend or LLMBackend.from_env()
+    requests = []
+    stories = {}
+
+    for story_index, input_file in enumerate(input_files):
+        input_file = resolve_input_file(input_file)
+        print(f"\n处理故事 {story_index + 1}/{len(input_files)}: {input_file}")
+        analyzer, sentences, text_processor = analyze_story_file(input_file, backend, scene_batch_size, use_llm_cache)
+
+        # 有音频信息时使用实际时长，否则按默认时长划分场景
+        audio_info_file = Path(f"output/audio/{Path(input_file).stem}_audio_info.json")
+        if audio_info_file.exists():
+            durations = analyzer.load_audio_timeline()
+        else:
+            durations = [DEFAULT_SENTENCE_DURATION] * len(sentences)
+        key_scenes = analyzer.identify_key_scenes(sentences, durations, generate_prompts=False,
+                                                  sentence_offsets=text_processor.sentence_offsets,
+                                                  source_length=text_processor.source_length)
+
+        story_dir = Path(BATCH_OUTPUT_DIR) / Path(input_file).stem
+        story_dir.mkdir(parents=True, exist_ok=True)
+        key_scenes_file = story_dir / "key_scenes.json"
+        with open(key_scenes_file, "w", encoding="utf-8") as f:
+            json.dump(key_scenes, f, ensure_ascii=False, indent=2)
+
+        story_requests = {}
+        for request_index, request in enumerate(analyzer.build_scene_prompt_requests(key_scenes)):
+            custom_id = f"story{story_index:03d}-req{request_index:04d}"
+            story_requests[custom_id] = request["scene_indexes"]
+            requests.append({"custom_id": custom_id, **request})
+
+        # 保存翻译后的背景、角色描述和分析结果，写回结果时不再重新分析故事
+        # （场景所属的段落已按句子位置计算并写入 key_scenes.json 的 segment_index，单独重试时直接使用）
+        stories[str(story_index)] = {
+            "input_file": input_file,
+            "key_scenes_file": str(key_scenes_file),
+            "requests": story_requests,
+            "prompt_context": analyzer.export_prompt_context(key_scenes)
+        }
+        print(f"场景数: {len(key_scenes)}，请求数: {len(story_requests)}")
+
+    batch_client = BatchJobClient(backend)
+    batch_file = str(Path(job_file).with_suffix(".jsonl"))
+    batch_client.write_requests(requests, batch_file)
+    print(f"\n已写入批处理文件: {batch_file} ({len(requests)} 个请求)")
+
+    job = batch_client.submit(batch_file, metadata={"stories": str(len(stories))})
+    job.update({
+        "status": "submitted",
+        "created_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "backend": backend.name,
+        "batch_file": batch_file,
+        "stories": stories
+    })
+    save_job(job, job_file)
+    print(f"任务信息已保存到: {job_file}")
+    return job
+
+def collect_results(job_file: str = DEFAULT_JOB_FILE, backend: LLMBackend = None, use_llm_cache: bool = True,
+                    wait: bool = True, timeout: float = None, poll_interval: float = 60.0) -> bool:
+    """等待批处理任务完成，并将结果写回各故事的 key_scenes.json
+
+    使用提交时保存的背景和角色描述组合提示词，不重新分析故事；缺失或失败的请求对应的场景会单独同步重试。
+
+    Returns:
+        bool: 结果是否已写回（任务未完成时返回 False）
+    """
+    job = load_job(job_file)
+    backend = backend or LLMBackend.from_env(job.get("backend"))
+    batch_client = BatchJobClient(backend, poll_interval=poll_interval)
+
+    batch = batch_client.wait(job["batch_id"], timeout if wait else 0)
+    if batch is None:
+        print("批处理任务尚未完成，请稍后再次运行 collect")
+        return False
+    if batch.status != "completed":
+        print(f"警告: 批处理任务状态为 {batch.status}，所有场景将同步重试")
+    results = batch_client.download_results(batch)
+
+    for story in job["stories"].values():
+        print(f"\n写回结果: {story['input_file']}")
+        with open(story["input_file"], "r", encoding="utf-8") as f:
+            story_text = f.read()
+        context = story["prompt_context"]
+        analyzer = StoryAnalyzer(use_cache=use_llm_cache, backend=backend)
+        analyzer.restore_prompt_context(context, story_text)
+        with open(story["key_scenes_file"], "r", encoding="utf-8") as f:
+            key_scenes = json.load(f)
+
+        for custom_id, scene_indexes in story["requests"].items():
+            result = results.get(custom_id)
+            if result:
+                usage = result["usage"]
+                analyzer.usage_tracker.record("describe_scene_batch_api", usage.get("prompt_tokens", 0),
+                                              usage.get("completion_tokens", 0))
+            analyzer.apply_scene_prompt_results(key_scenes, {"scene_indexes": scene_indexes},
+                                                result["content"] if result else None,
+                                                setting=context["setting"],
+                                                character_descriptions=context["character_descriptions"])
+
+        with open(story["key_scenes_file"], "w", encoding="utf-8") as f:
+            json.dump(key_scenes, f, ensure_ascii=False, indent=2)
+        print(f"场景信息已保存到: {story['key_scenes_file']}")
+        analyzer.usage_tracker.print_summary()
+
+    job["status"] = "collected"
+    job["collected_at"] = time.strftime("%Y-%m-%d %H:%M:%S")
+    save_job(job, job_file)
+    return True
+
+if __name__ == "__main__":
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="离线批量生成场景描述（批处理 API）")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    submit_parser = subparsers.add_parser("submit", help="分析故事并提交批处理任务")
+    submit_parser.add_argument("input_files", nargs="+", help="输入文本文件")
+    submit_parser.add_argument("--scene_batch_size", type=int, help="每个请求最多包含的场景数")
+    submit_parser.add_argument("--wait", action="store_true", help="提交后等待任务完成并写回结果")
+
+    collect_parser = subparsers.add_parser("collect", help="等待批处理任务完成并写回结果")
+    collect_parser.add_argument("--no_wait", action="store_true", help="只检查一次任务状态，未完成时直接退出")
+    collect_parser.add_argument("--timeout", type=float, help="最长等待时间（秒）")
+
+    for sub in (submit_parser, collect_parser):
+        sub.add_argument("--job_file", default=DEFAULT_JOB_FILE, help="任务信息文件")
+        sub.add_argument("--llm_backend", choices=list(LLM_BACKENDS.keys()), help="LLM后端（需支持批处理接口）")
+        sub.add_argument("--no_llm_cache", action="store_true", help="不使用本地LLM响应缓存")
+        sub.add_argument("--poll_interval", type=float, default=60.0, help="轮询任务状态的间隔（秒）")
+    args = parser.parse_args()
+
+    if args.command == "submit":
+        backend = LLMBackend.from_env(args.llm_backend)
+        submit_stories(args.input_files, args.job_file, backend, args.scene_batch_size, not args.no_llm_cache)
+        if args.wait:
+            collect_results(args.job_file, backend, not args.no_llm_cache, poll_interval=args.poll_interval)
+    else:
+        # 默认使用提交任务时的后端
+        backend = LLMBackend.from_env(args.llm_backend) if args.llm_backend else None
+        done = collect_results(args.job_file, backend, not args.no_llm_cache, wait=not args.no_wait,
+                               timeout=args.timeout, poll_interval=args.poll_interval)
+        if not done:
+            sys.exit(1)
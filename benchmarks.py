@@ -0,0 +1,239 @@
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+# 性能测试脚本，所有测试都使用本地模拟服务，不需要外部服务
+#   python benchmarks.py voicevox --sentences 200 --latency 0.02
+#   python benchmarks.py scene-prompts --scenes 20
+#   python benchmarks.py sentence-durations --sentences 5000
+#   python benchmarks.py comfyui --images 20 --render-time 0.2 --latency 0.05 --nodes 3
+
+SAMPLE_SENTENCES = [
+    "昔々、ある山の奥に小さな村がありました。",
+    "村の人々は毎朝、森へ薪を集めに出かけました。",
+    "「今日はいい天気だね」と太郎は言いました。",
+    "その日の夕方、空は真っ赤に染まっていました。",
+    "おばあさんは川へ洗濯に行きました。",
+]
+
+def make_sentences(count: int):
+    """生成指定数量的测试句子"""
+    return [f"{SAMPLE_SENTENCES[i % len(SAMPLE_SENTENCES)]}（{i}）" for i in range(count)]
+
+def bench_voicevox(args):
+    """测试 VOICEVOX 合成流程的吞吐量"""
+    from voicevox_stub import VoiceVoxStubServer
+    from voice_generator import VoiceVoxGenerator
+
+    sentences = make_sentences(args.sentences)
+    with VoiceVoxStubServer(latency=args.latency, failure_rate=args.failure_rate,
+                            fail_paths={"/synthesis"}) as server:
+        generator = VoiceVoxGenerator("127.0.0.1", str(server.port), audio_profile=args.audio_profile)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            start = time.perf_counter()
+            total_audio = 0.0
+            total_bytes = 0
+            failures = 0
+            for i, sentence in enumerate(sentences):
+                output_file = Path(temp_dir) / f"audio_{i:03d}.wav"
+                duration = generator.synthesize(sentence, output_file)
+                if duration is None:
+                    failures += 1
+                    continue
+                total_audio += duration
+                total_bytes += output_file.stat().st_size
+            elapsed = time.perf_counter() - start
+
+    print(f"句子数: {len(sentences)}, 失败: {failures}")
+    print(f"总耗时: {elapsed:.2f}秒, 吞吐量: {len(sentences) / elapsed:.1f} 句/秒")
+    print(f"音频总时长: {total_audio:.1f}秒, 音频总大小: {total_bytes / 1024 / 1024:.2f} MB")
+    print(f"请求统计: {server.request_counts}")
+
+def bench_scene_prompts(args):
+    """比较单次调用、两次调用和批量三种场景提示词生成方式的延迟和令牌消耗"""
+    from llm_stub import StubLLMClient
+    from story_analyzer import StoryAnalyzer, SCENE_PROMPT_MODES
+
+    sentences = make_sentences(args.scenes * 3)
+    story = "".join(sentences)
+    scenes = [sentences[i:i + 3] for i in range(0, len(sentences), 3)]
+
+    for mode in SCENE_PROMPT_MODES:
+        client = StubLLMClient(base_latency=args.latency, per_token_latency=args.token_latency)
+        analyzer = StoryAnalyzer(use_cache=False, tokens_per_minute=0, client=client, scene_prompt_mode=mode)
+        analyzer.analyze_story(story[:1500], "benchmark.txt")
+        # 只统计场景提示词阶段（背景和角色翻译第一次调用时完成，一并计入）
+        client.reset_stats()
+
+        start = time.perf_counter()
+        for scene_sentences in scenes:
+            analyzer.generate_scene_prompt(scene_sentences)
+        elapsed = time.perf_counter() - start
+
+        _print_scene_stats(mode, len(scenes), client, elapsed)
+
+    # 批量模式：多个场景合并到一个请求
+    client = StubLLMClient(base_latency=args.latency, per_token_latency=args.token_latency)
+    analyzer = StoryAnalyzer(use_cache=False, tokens_per_minute=0, client=client, scene_batch_size=args.batch_size)
+    analyzer.analyze_story(story[:1500], "benchmark.txt")
+    client.reset_stats()
+
+    key_scenes = [{"scene_id": i + 1, "sentences": scene_sentences} for i, scene_sentences in enumerate(scenes)]
+    start = time.perf_counter()
+    analyzer._generate_scene_prompts(key_scenes)
+    elapsed = time.perf_counter() - start
+    _print_scene_stats(f"batch (每请求最多 {args.batch_size} 个场景)", len(scenes), client, elapsed)
+
+def _print_scene_stats(name: str, scene_count: int, client, elapsed: float):
+    print(f"\n模式: {name}")
+    print(f"  场景数: {scene_count}, 请求数: {client.calls}")
+    print(f"  总耗时: {elapsed:.2f}秒, 每场景: {elapsed / scene_count * 1000:.0f}毫秒")
+    print(f"  输入令牌: {client.prompt_tokens}, 输出令牌: {client.completion_tokens}, "
+          f"每请求平均输入: {client.prompt_tokens / max(client.calls, 1):.0f}")
+
+def bench_sentence_durations(args):
+    """比较逐句重新读取音频信息文件和一次性加载时长索引两种方式的耗时"""
+    import json
+    import os
+    from llm_stub import StubLLMClient
+    from story_analyzer import StoryAnalyzer
+
+    sentences = make_sentences(args.sentences)
+    audio_files = [
+        {"id": i, "sentence": sentence, "audio_file": f"audio_{i:03d}.wav", "duration": 1.0 + (i % 7) * 0.3}
+        for i, sentence in enumerate(sentences)
+    ]
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        cwd = os.getcwd()
+        os.chdir(temp_dir)
+        try:
+            Path("output/audio").mkdir(parents=True)
+            info_file = Path("output/audio/benchmark_audio_info.json")
+            with open(info_file, "w", encoding="utf-8") as f:
+                json.dump({"audio_files": audio_files}, f, ensure_ascii=False, indent=2)
+
+            # 原来的方式：每个句子都重新读取并解析整个文件，再按文本线性查找
+            legacy_count = min(args.legacy_sentences, len(sentences))
+            start = time.perf_counter()
+            for sentence in sentences[:legacy_count]:
+                with open(info_file, "r", encoding="utf-8") as f:
+                    info = json.load(f)
+                next(audio["duration"] for audio in info["audio_files"] if audio["sentence"] == sentence)
+            legacy_elapsed = time.perf_counter() - start
+
+            analyzer = StoryAnalyzer(use_cache=False, tokens_per_minute=0, client=StubLLMClient())
+            analyzer.input_file = "benchmark.txt"
+            start = time.perf_counter()
+            durations = analyzer.load_audio_timeline()
+            for i, sentence in enumerate(sentences):
+                analyzer.get_sentence_duration(sentence, i, durations)
+            indexed_elapsed = time.perf_counter() - start
+        finally:
+            os.chdir(cwd)
+
+    legacy_total = legacy_elapsed / legacy_count * len(sentences)
+    print(f"句子数: {len(sentences)}")
+    print(f"逐句重新读取: {legacy_elapsed:.2f}秒 ({legacy_count} 句)，估算全部: {legacy_total:.2f}秒")
+    print(f"时长索引: {indexed_elapsed * 1000:.1f}毫秒，加速约 {legacy_total / max(indexed_elapsed, 1e-9):.0f} 倍")
+
+def bench_comfyui(args):
+    """比较逐张生成（每张图像一个连接，完成后才提交下一张）、预先排队的批量生成、WebSocket 接收图像、多节点调度和图像缓存"""
+    import contextlib
+    import io
+    from comfyui_stub import ComfyUIStubServer
+    from image_generator import ComfyUIGenerator
+    from comfyui_dispatcher import ComfyUIDispatcher
+    from image_cache import ImageCache
+
+    jobs = [(f"scene {i}, misty mountain village, evening", f"scene_{i + 1:03d}.png") for i in range(args.images)]
+    servers = [ComfyUIStubServer(render_time=args.render_time, latency=args.latency).start()
+               for _ in range(max(1, args.nodes))]
+    modes = [("逐张生成", None, 1, False), (f"预先排队 (窗口 {args.window})", args.window, 1, False),
+             (f"预先排队 + WebSocket 图像 (窗口 {args.window})", args.window, 1, True)]
+    if len(servers) > 1:
+        modes.append((f"多节点调度 ({len(servers)} 个节点，窗口 {args.window})", args.window, len(servers), False))
+    try:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            for index, (name, window, node_count, websocket_images) in enumerate(modes):
+                requests_before = sum(server.request_counts.get(path, 0) for server in servers
+                                      for path in ("/history", "/view"))
+                # 生成过程的逐张日志较多，测试时不输出
+                with contextlib.redirect_stdout(io.StringIO()):
+                    # 各模式都实际生成图像，不使用图像缓存
+                    if node_count > 1:
+                        generator = ComfyUIDispatcher([server.address for server in servers[:node_count]],
+                                                      use_cache=False, websocket_images=websocket_images)
+                    else:
+                        generator = ComfyUIGenerator(*servers[0].address.split(":"), use_cache=False,
+                                                     websocket_images=websocket_images)
+                    generator.output_dir = Path(temp_dir) / f"mode_{index}"
+                    generator.output_dir.mkdir()
+                    start = time.perf_counter()
+                    if window is None:
+                        succeeded = sum(1 for prompt, filename in jobs if generator.generate_image(prompt, filename))
+                    else:
+                        succeeded = sum(1 for path in generator.generate_batch(jobs, window).values() if path)
+                    elapsed = time.perf_counter() - start
+                busy = args.images * args.render_time / node_count
+                fetches = sum(server.request_counts.get(path, 0) for server in servers
+                              for path in ("/history", "/view")) - requests_before
+                print(f"\n模式: {name}")
+                print(f"  图像数: {args.images}, 成功: {succeeded}, 获取图像的HTTP请求: {fetches}")
+                print(f"  总耗时: {elapsed:.2f}秒, 每张: {elapsed / args.images * 1000:.0f}毫秒, "
+                      f"GPU利用率: {busy / elapsed * 100:.0f}%")
+
+            # 图像缓存：第一次生成后清空输出目录（相当于 clean_output_directories），再次生成同一个故事
+            with contextlib.redirect_stdout(io.StringIO()):
+                generator = ComfyUIGenerator(*servers[0].address.split(":"), use_cache=False, websocket_images=False)
+                generator.image_cache = ImageCache(Path(temp_dir) / "cache")
+                generator.output_dir = Path(temp_dir) / "mode_cache"
+                generator.output_dir.mkdir()
+                generator.generate_batch(jobs, args.window)
+                for image_file in generator.output_dir.glob("*.png"):
+                    image_file.unlink()
+                start = time.perf_counter()
+                succeeded = sum(1 for path in generator.generate_batch(jobs, args.window).values() if path)
+                elapsed = time.perf_counter() - start
+            print(f"\n模式: 图像缓存 (清空输出目录后重新生成)")
+            print(f"  图像数: {args.images}, 成功: {succeeded}, 缓存命中: {generator.image_cache.hits}")
+            print(f"  总耗时: {elapsed:.2f}秒, 每张: {elapsed / args.images * 1000:.0f}毫秒")
+    finally:
+        for server in servers:
+            server.stop()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="性能测试")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    voicevox_parser = subparsers.add_parser("voicevox", help="测试语音合成流程")
+    voicevox_parser.add_argument("--sentences", type=int, default=100, help="句子数量")
+    voicevox_parser.add_argument("--latency", type=float, default=0.0, help="模拟服务器每个请求的延迟（秒）")
+    voicevox_parser.add_argument("--failure-rate", type=float, default=0.0, help="合成请求的失败概率")
+    voicevox_parser.add_argument("--audio-profile", default="intermediate", help="音频输出配置")
+    voicevox_parser.set_defaults(func=bench_voicevox)
+
+    scene_parser = subparsers.add_parser("scene-prompts", help="比较场景提示词的单次调用、两次调用和批量模式")
+    scene_parser.add_argument("--scenes", type=int, default=20, help="场景数量")
+    scene_parser.add_argument("--latency", type=float, default=0.3, help="模拟LLM每次请求的固定延迟（秒）")
+    scene_parser.add_argument("--token-latency", type=float, default=0.005, help="模拟LLM每个输出令牌的延迟（秒）")
+    scene_parser.add_argument("--batch-size", type=int, default=5, help="批量模式下每个请求最多包含的场景数")
+    scene_parser.set_defaults(func=bench_scene_prompts)
+
+    duration_parser = subparsers.add_parser("sentence-durations", help="测试句子时长查找")
+    duration_parser.add_argument("--sentences", type=int, default=5000, help="句子数量")
+    duration_parser.add_argument("--legacy-sentences", type=int, default=500,
+                                 help="原方式实际测量的句子数（其余按比例估算）")
+    duration_parser.set_defaults(func=bench_sentence_durations)
+
+    comfyui_parser = subparsers.add_parser("comfyui", help="比较ComfyUI逐张生成、预先排队和多节点调度")
+    comfyui_parser.add_argument("--images", type=int, default=20, help="图像数量")
+    comfyui_parser.add_argument("--render-time", type=float, default=0.2, help="模拟服务器生成每张图像的耗时（秒）")
+    comfyui_parser.add_argument("--latency", type=float, default=0.05, help="模拟服务器每个HTTP请求的延迟（秒）")
+    comfyui_parser.add_argument("--window", type=int, default=4, help="预先提交到队列的提示词数")
+    comfyui_parser.add_argument("--nodes", type=int, default=3, help="多节点调度测试使用的模拟节点数")
+    comfyui_parser.set_defaults(func=bench_comfyui)
+
+    args = parser.parse_args()
+    args.func(args)
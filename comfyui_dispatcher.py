@@ -0,0 +1,251 @@
+import os
+import threading
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+from image_generator import ComfyUIGenerator, DEFAULT_QUEUE_WINDOW
+
+# 节点断开后，一个场景最多尝试的次数（每次换一个节点）
+DEFAULT_MAX_ATTEMPTS = 3
+# 节点线程等待完成消息的间隔（秒），期间检查是否有新分配的场景
+POLL_INTERVAL = 0.2
+
+def parse_endpoint(endpoint: str) -> Tuple[str, str]:
+    """解析 "host:port" 或 "http://host:port" 形式的地址"""
+    endpoint = endpoint.strip().rstrip("/")
+    for prefix in ("http://", "https://", "ws://"):
+        if endpoint.startswith(prefix):
+            endpoint = endpoint[len(prefix):]
+    host, _, port = endpoint.partition(":")
+    return host or "127.0.0.1", port or "8188"
+
+class _ComfyUINode:
+    """一个 ComfyUI 节点：独立的生成器（WebSocket 连接）和工作线程"""
+
+    def __init__(self, endpoint: str, style: str = None, workflow: str = None, use_cache: bool = True,
+                 websocket_images: bool = None):
+        host, port = parse_endpoint(endpoint)
+        self.endpoint = f"{host}:{port}"
+        self.generator = ComfyUIGenerator(host, port, style, workflow, use_cache, websocket_images)
+        self.inbox = deque()   # 已分配但尚未提交的场景
+        self.jobs = {}         # 已提交的场景: {prompt_id: job}
+        self.alive = True
+        self.completed = 0
+        self.thread = None
+
+    @property
+    def assigned(self) -> int:
+        return len(self.inbox) + len(self.jobs)
+
+    def queue_depth(self) -> Optional[int]:
+        """查询节点的队列长度（正在执行和等待的任务，包括其他客户端的任务），无法访问时返回 None"""
+        try:
+            queue = self.generator.get_queue()
+            return len(queue.get("queue_running", [])) + len(queue.get("queue_pending", []))
+        except Exception as e:
+            print(f"无法获取节点 {self.endpoint} 的队列: {e}")
+            return None
+
+class ComfyUIDispatcher:
+    """多个 ComfyUI 节点的调度器
+
+    每个场景分配给当前负载最小的节点（按 /queue 的队列长度，无法获取时按已分配的场景数），每个节点最多同时排队 window 个提示词。
+    节点断开时，其未完成的场景改由其他节点生成。图像吞吐量随节点数增加。
+    """
+
+    def __init__(self, endpoints: List[str], style: str = None, window: int = DEFAULT_QUEUE_WINDOW,
+                 max_attempts: int = DEFAULT_MAX_ATTEMPTS, workflow: str = None, use_cache: bool = True,
+                 websocket_images: bool = None):
+        """初始化调度器
+
+        Args:
+            endpoints: 节点地址列表，例如 ["192.168.1.10:8188", "192.168.1.11:8188"]
+            style: ComfyUI风格选项，所有节点相同
+            window: 每个节点同时在队列中的提示词数
+            max_attempts: 节点断开时一个场景最多尝试的次数
+            workflow: 工作流名称（workflows 目录中的文件名），所有节点相同
+            use_cache: 是否使用图像缓存（配方相同的图像不再生成）
+            websocket_images: 是否通过 WebSocket 接收图像，默认读取 COMFYUI_WEBSOCKET_IMAGES
+        """
+        if not endpoints:
+            raise ValueError("至少需要一个 ComfyUI 节点")
+        self.nodes = [_ComfyUINode(endpoint, style, workflow, use_cache, websocket_images) for endpoint in endpoints]
+        self.output_dir = self.nodes[0].generator.output_dir
+        for node in self.nodes:
+            node.generator.output_dir = self.output_dir
+        self.window = max(1, window)
+        self.max_attempts = max(1, max_attempts)
+        self._condition = threading.Condition()
+        self._pending = deque()
+        self._results = {}
+        self._done = False
+        print(f"ComfyUI 节点: {', '.join(node.endpoint for node in self.nodes)}")
+
+    @classmethod
+    def from_env(cls, style: str = None, window: int = DEFAULT_QUEUE_WINDOW, workflow: str = None,
+                 use_cache: bool = True, websocket_images: bool = None):
+        """根据 COMFYUI_ENDPOINTS（逗号分隔的节点地址）创建调度器，未设置时返回 None"""
+        endpoints = [endpoint for endpoint in os.getenv("COMFYUI_ENDPOINTS", "").split(",") if endpoint.strip()]
+        if not endpoints:
+            return None
+        return cls(endpoints, style, window, workflow=workflow, use_cache=use_cache,
+                   websocket_images=websocket_images)
+
+    def get_available_styles(self):
+        return self.nodes[0].generator.get_available_styles()
+
+    def generate_batch(self, jobs: List[Tuple[str, str]], window: int = None) -> Dict[str, Optional[str]]:
+        """在所有节点上生成图像
+
+        Args:
+            jobs: [(提示词, 输出文件名)]
+            window: 每个节点同时在队列中的提示词数，默认使用初始化时的值
+
+        Returns:
+            dict: {输出文件名: 图像文件路径，失败时为 None}
+        """
+        if window is not None:
+            self.window = max(1, window)
+        self._results = {}
+        self._pending = deque()
+        self._done = False
+        for prompt, output_filename in jobs:
+            if self.nodes[0].generator.load_cached(prompt, self.output_dir / output_filename):
+                self._results[output_filename] = str(self.output_dir / output_filename)
+            else:
+                self._pending.append({"prompt": prompt, "filename": output_filename, "attempts": 0})
+
+        for node in self.nodes:
+            node.alive = True
+            node.inbox.clear()
+            node.jobs = {}
+            node.completed = 0
+            node.thread = threading.Thread(target=self._run_node, args=(node,), daemon=True)
+            node.thread.start()
+
+        try:
+            self._dispatch(len(jobs))
+        finally:
+            with self._condition:
+                self._done = True
+                self._condition.notify_all()
+            for node in self.nodes:
+                node.thread.join()
+
+        print(f"各节点生成的图像数: {dict((node.endpoint, node.completed) for node in self.nodes)}")
+        return self._results
+
+    def _dispatch(self, total: int):
+        """将等待中的场景分配给负载最小的节点，直到所有场景完成"""
+        while True:
+            with self._condition:
+                if len(self._results) >= total:
+                    return
+                alive = [node for node in self.nodes if node.alive]
+                if not alive:
+                    # 所有节点都不可用，剩余场景视为失败
+                    for job in self._pending:
+                        self._results[job["filename"]] = None
+                    self._pending.clear()
+                    print("所有 ComfyUI 节点都不可用")
+                    return
+                candidates = [node for node in alive if node.assigned < self.window] if self._pending else []
+
+            if candidates:
+                # 每轮查询一次各节点的队列长度（不持有锁），加上已分配但尚未提交的场景数
+                loads = {}
+                for node in candidates:
+                    depth = node.queue_depth()
+                    # 无法获取队列长度时以已分配的场景数作为负载，节点真正断开时由其工作线程放回场景
+                    loads[node] = node.assigned if depth is None else depth + len(node.inbox)
+                assigned = 0
+                with self._condition:
+                    # 逐个分配给负载最小的节点，分配后该节点的负载加一
+                    while self._pending:
+                        available = [node for node in loads if node.alive and node.assigned < self.window]
+                        if not available:
+                            break
+                        node = min(available, key=lambda n: (loads[n], n.assigned))
+                        job = self._pending.popleft()
+                        node.inbox.append(job)
+                        print(f"{job['filename']} -> {node.endpoint} (队列长度 {loads[node]})")
+                        loads[node] += 1
+                        assigned += 1
+                    if assigned:
+                        self._condition.notify_all()
+                        continue
+            with self._condition:
+                self._condition.wait(POLL_INTERVAL)
+
+    def _requeue(self, node: _ComfyUINode, jobs: List[Dict]):
+        """节点断开，将其场景放回等待队列（需持有锁）"""
+        node.alive = False
+        for job in jobs:
+            job["attempts"] += 1
+            if job["attempts"] >= self.max_attempts:
+                print(f"{job['filename']} 已尝试 {job['attempts']} 次，放弃")
+                self._results[job["filename"]] = None
+            else:
+                self._pending.appendleft(job)
+        node.inbox.clear()
+        node.jobs = {}
+        self._condition.notify_all()
+
+    def _run_node(self, node: _ComfyUINode):
+        """节点工作线程：提交分配到的场景并接收完成消息（同一个线程内使用 WebSocket）"""
+        generator = node.generator
+        try:
+            generator.connect()
+        except Exception as e:
+            print(f"无法连接节点 {node.endpoint}: {e}")
+            with self._condition:
+                self._requeue(node, list(node.inbox))
+            return
+
+        try:
+            while True:
+                # 提交分配到的场景（提交成功前仍留在 inbox 中，计入节点的负载）
+                while True:
+                    with self._condition:
+                        if self._done:
+                            return
+                        if not node.inbox:
+                            break
+                        job = node.inbox[0]
+                    try:
+                        prompt_id = generator.submit(job["prompt"], self.output_dir / job["filename"])
+                    except Exception as e:
+                        print(f"节点 {node.endpoint} 提交失败: {e}")
+                        with self._condition:
+                            self._requeue(node, list(node.inbox) + list(node.jobs.values()))
+                        return
+                    with self._condition:
+                        node.inbox.popleft()
+                        node.jobs[prompt_id] = job
+
+                if not node.jobs:
+                    with self._condition:
+                        if not node.inbox and not self._done:
+                            self._condition.wait(POLL_INTERVAL)
+                    continue
+
+                try:
+                    finished = generator.wait_for_next(POLL_INTERVAL)
+                except Exception as e:
+                    print(f"节点 {node.endpoint} 连接中断: {e}")
+                    with self._condition:
+                        self._requeue(node, list(node.inbox) + list(node.jobs.values()))
+                    return
+                if finished is None:
+                    continue
+
+                prompt_id, output_file, success = finished
+                with self._condition:
+                    job = node.jobs.pop(prompt_id)
+                    self._results[job["filename"]] = str(output_file) if success else None
+                    node.completed += 1
+                    self._condition.notify_all()
+        finally:
+            generator.pending_prompts.clear()
+            generator.cache_keys.clear()
+            generator.received_images.clear()
+            generator.close()
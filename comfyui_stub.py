@@ -0,0 +1,403 @@
+import json
+import time
+import uuid
+import zlib
+import base64
+import struct
+import random
+import hashlib
+import threading
+import argparse
+from collections import deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+# WebSocket 握手使用的固定 GUID（RFC 6455）
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+# 二进制消息头：事件类型（1 = 图像）和图像格式（1 = JPEG, 2 = PNG）
+IMAGE_EVENT = 1
+IMAGE_FORMAT_JPEG = 1
+IMAGE_FORMAT_PNG = 2
+
+def make_png(width: int, height: int, color: tuple) -> bytes:
+    """生成单色 PNG 图像"""
+    def chunk(tag: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF)
+
+    row = b"\x00" + bytes(color) * width
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) +
+            chunk(b"IDAT", zlib.compress(row * height)) + chunk(b"IEND", b""))
+
+class _WebSocketConnection:
+    """服务器端的 WebSocket 连接（只实现发送和关闭检测）"""
+
+    def __init__(self, handler, client_id: str):
+        self.handler = handler
+        self.client_id = client_id
+        self.closed = False
+        self._lock = threading.Lock()
+
+    def send_frame(self, opcode: int, payload: bytes):
+        length = len(payload)
+        if length < 126:
+            header = struct.pack(">BB", 0x80 | opcode, length)
+        elif length < 65536:
+            header = struct.pack(">BBH", 0x80 | opcode, 126, length)
+        else:
+            header = struct.pack(">BBQ", 0x80 | opcode, 127, length)
+        with self._lock:
+            if self.closed:
+                return
+            try:
+                self.handler.wfile.write(header + payload)
+                self.handler.wfile.flush()
+            except OSError:
+                self.closed = True
+
+    def send_json(self, data: dict):
+        self.send_frame(0x1, json.dumps(data).encode("utf-8"))
+
+    def read_frame(self):
+        """读取客户端发来的一帧，返回 (opcode, payload)，连接断开时返回 (None, b"")"""
+        rfile = self.handler.rfile
+        header = rfile.read(2)
+        if len(header) < 2:
+            return None, b""
+        opcode = header[0] & 0x0F
+        length = header[1] & 0x7F
+        if length == 126:
+            length = struct.unpack(">H", rfile.read(2))[0]
+        elif length == 127:
+            length = struct.unpack(">Q", rfile.read(8))[0]
+        mask = rfile.read(4) if header[1] & 0x80 else b"\x00\x00\x00\x00"
+        payload = bytearray(rfile.read(length))
+        for i in range(len(payload)):
+            payload[i] ^= mask[i % 4]
+        return opcode, bytes(payload)
+
+    def close(self):
+        self.send_frame(0x8, b"")
+        self.closed = True
+
+class ComfyUIStubServer:
+    """进程内的 ComfyUI 模拟服务器，用于离线测试和性能测试
+
+    实现 /prompt、/queue、/history/{prompt_id}、/view 和 /ws 接口。提示词按提交顺序逐个“渲染”
+    （固定耗时，模拟单个 GPU），完成后通过 WebSocket 发送 executing 消息，输出为确定性的单色 PNG。
+    SaveImage 节点的图像保存在生成历史中，SaveImageWebsocket 节点的图像以二进制消息发送，
+    采样过程中还会发送一张预览图像。
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, render_time=0.5, latency=0.0, failure_rate=0.0, seed=0,
+                 image_size=(64, 36), websocket_output=True):
+        """初始化模拟服务器
+
+        Args:
+            host: 监听地址
+            port: 监听端口，0 表示自动分配
+            render_time: 每张图像的生成耗时（秒）
+            latency: 每个 HTTP 请求的额外延迟（秒）
+            failure_rate: 生成失败的概率（0-1），失败时发送 execution_error
+            seed: 失败注入使用的随机种子
+            image_size: 输出图像的 (宽, 高)
+            websocket_output: 是否支持 SaveImageWebsocket 节点，False 时模拟旧版本（提交时返回 400）
+        """
+        self.host = host
+        self.port = port
+        self.render_time = render_time
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.image_size = image_size
+        self.websocket_output = websocket_output
+
+        self.request_counts = {}
+        self.completed = 0
+        self._random = random.Random(seed)
+        self._queue = deque()
+        self._running = None
+        self._history = {}
+        self._images = {}
+        self._clients = {}
+        self._number = 0
+        self._lock = threading.Lock()
+        self._work_ready = threading.Condition(self._lock)
+        self._stopped = False
+        self._server = None
+        self._threads = []
+
+    @property
+    def address(self):
+        return f"{self.host}:{self.port}"
+
+    def start(self):
+        """在后台线程中启动服务器和渲染线程"""
+        stub = self
+
+        class Handler(_StubRequestHandler):
+            server_stub = stub
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._stopped = False
+        self._threads = [
+            threading.Thread(target=self._server.serve_forever, daemon=True),
+            threading.Thread(target=self._render_loop, daemon=True)
+        ]
+        for thread in self._threads:
+            thread.start()
+        print(f"ComfyUI 模拟服务器已启动: http://{self.address}")
+        return self
+
+    def stop(self):
+        """停止服务器并关闭所有 WebSocket 连接"""
+        with self._lock:
+            self._stopped = True
+            self._work_ready.notify_all()
+        self.drop_connections()
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def drop_connections(self):
+        """关闭所有 WebSocket 连接（模拟网络中断）"""
+        with self._lock:
+            connections = [connection for group in self._clients.values() for connection in group]
+        for connection in connections:
+            connection.close()
+
+    def queue_depth(self) -> int:
+        """排队和正在生成的提示词数"""
+        with self._lock:
+            return len(self._queue) + (1 if self._running else 0)
+
+    def _count(self, path: str):
+        with self._lock:
+            self.request_counts[path] = self.request_counts.get(path, 0) + 1
+
+    def _broadcast(self, client_id: str, data: dict = None, binary: bytes = None):
+        with self._lock:
+            connections = list(self._clients.get(client_id, []))
+        for connection in connections:
+            if binary is not None:
+                connection.send_frame(0x2, binary)
+            else:
+                connection.send_json(data)
+
+    def _status_message(self) -> dict:
+        return {"type": "status", "data": {"status": {"exec_info": {"queue_remaining": self.queue_depth()}}}}
+
+    def submit(self, prompt: dict, client_id: str) -> dict:
+        """将提示词加入队列"""
+        with self._lock:
+            prompt_id = str(uuid.uuid4())
+            self._number += 1
+            self._queue.append((self._number, prompt_id, prompt, client_id))
+            self._work_ready.notify()
+            return {"prompt_id": prompt_id, "number": self._number, "node_errors": {}}
+
+    def queue_info(self) -> dict:
+        with self._lock:
+            running = [list(self._running[:3]) + [{}, []]] if self._running else []
+            pending = [[number, prompt_id, prompt, {}, []] for number, prompt_id, prompt, _ in self._queue]
+        return {"queue_running": running, "queue_pending": pending}
+
+    def _render_loop(self):
+        while True:
+            with self._lock:
+                while not self._queue and not self._stopped:
+                    self._work_ready.wait()
+                if self._stopped:
+                    return
+                self._running = self._queue.popleft()
+            number, prompt_id, prompt, client_id = self._running
+            self._broadcast(client_id, self._status_message())
+            self._broadcast(client_id, {"type": "execution_start", "data": {"prompt_id": prompt_id}})
+            sampler_id = next((node_id for node_id, node in prompt.items()
+                               if node.get("class_type") in ("KSampler", "KSamplerAdvanced")), None)
+            if sampler_id is not None:
+                # 采样过程中的预览图像（客户端应忽略）
+                self._broadcast(client_id, {"type": "executing", "data": {"node": sampler_id, "prompt_id": prompt_id}})
+                self._broadcast(client_id, binary=struct.pack(">II", IMAGE_EVENT, IMAGE_FORMAT_JPEG) + b"preview")
+            time.sleep(self.render_time)
+
+            with self._lock:
+                failed = self.failure_rate > 0 and self._random.random() < self.failure_rate
+            if failed:
+                self._finish(prompt_id, prompt, {}, "error")
+                self._broadcast(client_id, {"type": "execution_error", "data": {
+                    "prompt_id": prompt_id, "node_id": "3", "exception_message": "injected failure"}})
+            else:
+                outputs = self._render_outputs(prompt_id, prompt, client_id)
+                self._finish(prompt_id, prompt, outputs, "success")
+                self._broadcast(client_id, {"type": "executing", "data": {"node": None, "prompt_id": prompt_id}})
+            self._broadcast(client_id, self._status_message())
+
+    def _render_outputs(self, prompt_id: str, prompt: dict, client_id: str) -> dict:
+        """为工作流中的保存节点生成图像（颜色由保存节点以外的工作流内容决定）"""
+        content = {node_id: node for node_id, node in prompt.items()
+                   if node.get("class_type") not in ("SaveImage", "SaveImageWebsocket")}
+        digest = hashlib.sha256(json.dumps(content, sort_keys=True).encode("utf-8")).digest()
+        data = make_png(self.image_size[0], self.image_size[1], tuple(digest[:3]))
+        outputs = {}
+        for node_id, node in prompt.items():
+            if node.get("class_type") == "SaveImageWebsocket":
+                # 图像不保存，直接发送给提交提示词的客户端，也不出现在生成历史中
+                self._broadcast(client_id, {"type": "executing", "data": {"node": node_id, "prompt_id": prompt_id}})
+                self._broadcast(client_id, binary=struct.pack(">II", IMAGE_EVENT, IMAGE_FORMAT_PNG) + data)
+            elif node.get("class_type") == "SaveImage":
+                filename = f"{node['inputs'].get('filename_prefix', 'ComfyUI')}_{prompt_id[:8]}_{node_id}.png"
+                with self._lock:
+                    self._images[filename] = data
+                outputs[node_id] = {"images": [{"filename": filename, "subfolder": "", "type": "output"}]}
+        return outputs
+
+    def _finish(self, prompt_id: str, prompt: dict, outputs: dict, status: str):
+        with self._lock:
+            self._history[prompt_id] = {
+                "prompt": [0, prompt_id, prompt, {}, list(outputs)],
+                "outputs": outputs,
+                "status": {"status_str": status, "completed": status == "success", "messages": []}
+            }
+            self._running = None
+            self.completed += 1
+
+class _StubRequestHandler(BaseHTTPRequestHandler):
+    """模拟服务器的请求处理器"""
+
+    protocol_version = "HTTP/1.1"
+    server_stub = None
+
+    def log_message(self, format, *args):
+        # 不输出访问日志
+        pass
+
+    def _send_bytes(self, body: bytes, content_type: str, status: int = 200):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, data, status=200):
+        self._send_bytes(json.dumps(data, ensure_ascii=False).encode("utf-8"), "application/json", status)
+
+    def _prepare(self):
+        """解析请求并处理延迟，返回 (路径, 参数)"""
+        stub = self.server_stub
+        parsed = urlparse(self.path)
+        path = parsed.path.rstrip("/") or "/"
+        params = {k: v[-1] for k, v in parse_qs(parsed.query).items()}
+        stub._count("/history" if path.startswith("/history/") else path)
+        if stub.latency and path != "/ws":
+            time.sleep(stub.latency)
+        return path, params
+
+    def do_GET(self):
+        path, params = self._prepare()
+        stub = self.server_stub
+        if path == "/ws":
+            self._handle_websocket(params.get("clientId") or str(uuid.uuid4()))
+        elif path == "/queue":
+            self._send_json(stub.queue_info())
+        elif path == "/prompt":
+            self._send_json({"exec_info": {"queue_remaining": stub.queue_depth()}})
+        elif path.startswith("/history/"):
+            prompt_id = path.split("/")[-1]
+            with stub._lock:
+                item = stub._history.get(prompt_id)
+            self._send_json({prompt_id: item} if item else {})
+        elif path == "/view":
+            with stub._lock:
+                data = stub._images.get(params.get("filename", ""))
+            if data is None:
+                self._send_json({"error": "not found"}, status=404)
+            else:
+                self._send_bytes(data, "image/png")
+        else:
+            self._send_json({"error": "not found"}, status=404)
+
+    def do_POST(self):
+        path, _ = self._prepare()
+        stub = self.server_stub
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        if path == "/prompt":
+            try:
+                request = json.loads(body.decode("utf-8"))
+                prompt = request["prompt"]
+                if not isinstance(prompt, dict) or not prompt:
+                    raise ValueError("prompt must be a non-empty workflow")
+                for node in prompt.values():
+                    if node.get("class_type") == "SaveImageWebsocket" and not stub.websocket_output:
+                        raise ValueError("Cannot execute because node SaveImageWebsocket does not exist.")
+            except Exception as e:
+                self._send_json({"error": {"type": "invalid_prompt", "message": str(e)}, "node_errors": {}},
+                                status=400)
+                return
+            self._send_json(stub.submit(prompt, request.get("client_id", "")))
+        else:
+            self._send_json({"error": "not found"}, status=404)
+
+    def _handle_websocket(self, client_id: str):
+        stub = self.server_stub
+        key = self.headers.get("Sec-WebSocket-Key")
+        if not key or self.headers.get("Upgrade", "").lower() != "websocket":
+            self._send_json({"error": "websocket upgrade required"}, status=400)
+            return
+        accept = base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode("ascii")).digest()).decode("ascii")
+        self.send_response(101)
+        self.send_header("Upgrade", "websocket")
+        self.send_header("Connection", "Upgrade")
+        self.send_header("Sec-WebSocket-Accept", accept)
+        self.end_headers()
+        self.wfile.flush()
+
+        connection = _WebSocketConnection(self, client_id)
+        with stub._lock:
+            stub._clients.setdefault(client_id, []).append(connection)
+        connection.send_json(stub._status_message())
+        try:
+            # 只处理 ping 和关闭，直到连接断开
+            while not connection.closed:
+                opcode, payload = connection.read_frame()
+                if opcode is None or opcode == 0x8:
+                    break
+                if opcode == 0x9:
+                    connection.send_frame(0xA, payload)
+        except OSError:
+            pass
+        finally:
+            connection.closed = True
+            with stub._lock:
+                group = stub._clients.get(client_id, [])
+                if connection in group:
+                    group.remove(connection)
+            self.close_connection = True
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ComfyUI 模拟服务器")
+    parser.add_argument("--host", default="127.0.0.1", help="监听地址")
+    parser.add_argument("--port", type=int, default=8188, help="监听端口")
+    parser.add_argument("--render-time", type=float, default=0.5, help="每张图像的生成耗时（秒）")
+    parser.add_argument("--latency", type=float, default=0.0, help="每个HTTP请求的额外延迟（秒）")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="生成失败的概率")
+    parser.add_argument("--no-websocket-output", action="store_true", help="不支持 SaveImageWebsocket 节点")
+    args = parser.parse_args()
+
+    server = ComfyUIStubServer(args.host, args.port, render_time=args.render_time, latency=args.latency,
+                               failure_rate=args.failure_rate, websocket_output=not args.no_websocket_output).start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
@@ -2,8 +2,12 @@ import os
 from pathlib import Path
 from text_processor import TextProcessor
 from voice_generator import VoiceVoxGenerator
-from story_analyzer import StoryAnalyzer
-from image_generator import ComfyUIGenerator
+from story_analyzer import StoryAnalyzer, SCENE_SEGMENTATIONS
+from llm_backend import LLMBackend, LLM_BACKENDS
+from scene_dedup import mark_duplicate_scenes, DEFAULT_THRESHOLD as DEFAULT_DEDUP_THRESHOLD
+from image_generator import ComfyUIGenerator, DEFAULT_QUEUE_WINDOW
+from comfyui_dispatcher import ComfyUIDispatcher
+from workflow_template import available_workflows
 from midjourney_generator import MidjourneyGenerator
 from video_maker import create_base_video
 from video_maker_moviepy import create_video_with_scenes_moviepy
@@ -24,6 +28,9 @@ if sys.stdout.encoding != 'utf-8':
         import io
         sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='backslashreplace')
 
+# 每次运行的清单保存在单独的目录中（不会被 clean_output_directories 删除），便于比较多次运行
+RUN_MANIFEST_DIR = "output/manifests"
+
 def clean_output_directories():
     """清理输出目录中的旧文件"""
     try:
@@ -47,10 +54,12 @@ def clean_output_directories():
                 except Exception as e:
                     print(f"无法删除 {file}: {e}")
         
-        # 清理音频目录
+        # 清理音频目录（保留各故事子目录中的音频和音频信息文件，故事修改后只重新合成变化的句子）
         audio_dir = Path("output/audio")
         if audio_dir.exists():
             for file in audio_dir.glob("*.*"):
+                if not file.is_file() or file.name.endswith("_audio_info.json"):
+                    continue
                 try:
                     file.unlink()
                     print(f"已删除: {file}")
@@ -96,7 +105,27 @@ def clean_output_directories():
     except Exception as e:
         print(f"清理输出目录时出错: {e}")
 
-def process_story(input_file: str, image_generator_type: str = "comfyui", aspect_ratio: str = None, image_style: str = None, comfyui_style: str = None):
+def run_manifest_path(input_file: str, run_start: float, manifest_dir: str = RUN_MANIFEST_DIR) -> Path:
+    """本次运行的清单文件路径: output/manifests/<故事名>_<开始时间>.json"""
+    timestamp = time.strftime("%Y%m%d_%H%M%S", time.localtime(run_start))
+    return Path(manifest_dir) / f"{Path(input_file).stem}_{timestamp}.json"
+
+def write_run_manifest(manifest: dict, manifest_file):
+    """保存本次运行的清单（输入、耗时、LLM令牌消耗等）"""
+    try:
+        Path(manifest_file).parent.mkdir(parents=True, exist_ok=True)
+        with open(manifest_file, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+    except Exception as e:
+        print(f"保存运行清单时出错: {e}")
+
+def process_story(input_file: str, image_generator_type: str = "comfyui", aspect_ratio: str = None, image_style: str = None, comfyui_style: str = None,
+                  use_llm_cache: bool = True, scene_prompt_mode: str = None, scene_batch_size: int = None,
+                  llm_backend: str = None, scene_segmentation: str = None, target_scene_count: int = None,
+                  min_scene_duration: float = None, max_scene_duration: float = None,
+                  scene_dedup_threshold: float = DEFAULT_DEDUP_THRESHOLD, comfyui_queue_window: int = DEFAULT_QUEUE_WINDOW,
+                  comfyui_endpoints: list = None, comfyui_workflow: str = None, use_image_cache: bool = True,
+                  comfyui_websocket_images: bool = None, reuse_audio: bool = True):
     """
     完整的故事处理流程
     
@@ -106,6 +135,21 @@ def process_story(input_file: str, image_generator_type: str = "comfyui", aspect
         aspect_ratio: 图像比例，可选值为 "16:9", "9:16" 或 None (默认方形)，仅对midjourney有效
         image_style: 图像风格，例如: 'cinematic lighting, movie quality' 或 'ancient Chinese ink painting style'
         comfyui_style: ComfyUI的风格选项，可选值为 "水墨", "手绘", "古风", "插画", "写实", "电影"
+        use_llm_cache: 是否使用本地LLM响应缓存
+        scene_prompt_mode: 场景提示词生成模式，"two_call" 或 "single_call"（一次请求完成翻译和描述）
+        scene_batch_size: 每个LLM请求最多生成的场景描述数，大于 1 时多个场景合并到一个请求
+        llm_backend: LLM后端，"openai"、"local"（OpenAI 兼容的本地服务）或 "stub"（离线模拟），默认读取 LLM_BACKEND
+        scene_segmentation: 场景划分方式，"greedy" 或 "optimal"（在段落和对话边界上求最优划分）
+        target_scene_count: optimal 划分的目标场景数（即生成的图像数）
+        min_scene_duration: optimal 划分的场景最短时长（秒）
+        max_scene_duration: 场景最长时长（秒）
+        scene_dedup_threshold: 相邻场景提示词的相似度超过该值时共用图像，None 表示不检测
+        comfyui_queue_window: 预先提交到ComfyUI队列的提示词数（多节点时为每个节点），1 表示逐张生成
+        comfyui_endpoints: ComfyUI节点地址列表（"host:port"），默认读取 COMFYUI_ENDPOINTS，未设置时使用本机的单个节点
+        comfyui_workflow: ComfyUI工作流名称（workflows 目录中的文件名，例如 "waterink" 或 "Base"），默认读取 COMFYUI_WORKFLOW
+        use_image_cache: 是否使用本地图像缓存（生成配方相同的场景直接复用之前生成的图像）
+        comfyui_websocket_images: 是否通过 WebSocket 接收ComfyUI生成的图像（SaveImageWebsocket 节点），默认读取 COMFYUI_WEBSOCKET_IMAGES
+        reuse_audio: 是否沿用上次为同一故事生成的音频（只重新合成内容或词典条目发生变化的句子）
     """
     # 检查输入文件是否存在
     full_input_path = input_file
@@ -137,6 +181,20 @@ def process_story(input_file: str, image_generator_type: str = "comfyui", aspect
     for dir_name in ["output", "output/audio", "output/images", "output/texts", "output/videos"]:
         Path(dir_name).mkdir(parents=True, exist_ok=True)
     
+    run_start = time.time()
+    manifest_file = run_manifest_path(full_input_path, run_start)
+    manifest = {
+        "input_file": full_input_path,
+        "started_at": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(run_start)),
+        "image_generator": image_generator_type,
+        "scene_prompt_mode": scene_prompt_mode,
+        "scene_batch_size": scene_batch_size,
+        "llm_backend": llm_backend or os.getenv("LLM_BACKEND", "openai"),
+        "scene_segmentation": scene_segmentation,
+        "target_scene_count": target_scene_count,
+        "status": "running"
+    }
+    
     try:
         # 1. 文本处理
         print("\n1. 处理文本...")
@@ -169,33 +227,66 @@ def process_story(input_file: str, image_generator_type: str = "comfyui", aspect
         print("\n2. 生成语音...")
         audio_info_file = f"output/audio/{Path(full_input_path).stem}_audio_info.json"
         from test_voice_generator import process_voice_generation
-        audio_info = process_voice_generation(output_text_file, "output/audio")
+        audio_info = process_voice_generation(output_text_file, "output/audio", incremental=reuse_audio)
         print(f"语音生成完成，信息已保存到: {audio_info_file}")
         
         # 3. 分析故事和生成场景
         print("\n3. 分析故事和生成场景...")
-        analyzer = StoryAnalyzer()
+        analyzer = StoryAnalyzer(use_cache=use_llm_cache, scene_prompt_mode=scene_prompt_mode,
+                                 scene_batch_size=scene_batch_size, backend=LLMBackend.from_env(llm_backend),
+                                 scene_segmentation=scene_segmentation, target_scene_count=target_scene_count,
+                                 min_scene_duration=min_scene_duration, max_scene_duration=max_scene_duration)
         story_analysis = analyzer.analyze_story(text, full_input_path)
-        key_scenes = analyzer.identify_key_scenes(sentences)
+        key_scenes = analyzer.identify_key_scenes(sentences, analyzer.load_audio_timeline(audio_info),
+                                                 sentence_offsets=text_processor.sentence_offsets,
+                                                 source_length=text_processor.source_length)
+        
+        # 相邻的近似重复场景共用图像，减少图像生成次数
+        if scene_dedup_threshold is not None:
+            reused = mark_duplicate_scenes(key_scenes, threshold=scene_dedup_threshold)
+            manifest["reused_scenes"] = reused
+            if key_scenes:
+                print(f"近似重复场景: {reused}/{len(key_scenes)} 个场景共用图像 ({reused / len(key_scenes):.0%})")
         
         # 保存场景信息
         with open("output/key_scenes.json", "w", encoding="utf-8") as f:
             json.dump(key_scenes, f, ensure_ascii=False, indent=2)
         print("场景分析完成，信息已保存")
         
+        # 记录LLM令牌消耗（图像生成失败时也能保留）
+        analyzer.usage_tracker.print_summary()
+        manifest["scene_count"] = len(key_scenes)
+        manifest["llm_usage"] = analyzer.usage_tracker.summary()
+        write_run_manifest(manifest, manifest_file)
+        
         # 4. 生成图像
         print("\n4. 生成图像...")
         image_files = []
         
         if image_generator_type.lower() == "comfyui":
-            # 使用ComfyUI生成图像
-            generator = ComfyUIGenerator(style=comfyui_style)
+            # 使用ComfyUI生成图像，配置了多个节点时按负载分配场景
+            if comfyui_endpoints:
+                generator = ComfyUIDispatcher(comfyui_endpoints, comfyui_style, comfyui_queue_window,
+                                              workflow=comfyui_workflow, use_cache=use_image_cache,
+                                              websocket_images=comfyui_websocket_images)
+            else:
+                generator = ComfyUIDispatcher.from_env(comfyui_style, comfyui_queue_window, comfyui_workflow,
+                                                       use_image_cache, comfyui_websocket_images) or \
+                    ComfyUIGenerator(style=comfyui_style, workflow=comfyui_workflow, use_cache=use_image_cache,
+                                     websocket_images=comfyui_websocket_images)
             
             # 打印可用的风格选项
             available_styles = generator.get_available_styles()
             print(f"可用的ComfyUI风格选项: {', '.join(available_styles)}")
             
+            # 先准备所有场景的提示词，再一次性排队生成
+            jobs = []
             for i, scene in enumerate(key_scenes):
+                # 与前面场景几乎相同的场景直接共用图像
+                if isinstance(scene, dict) and scene.get("reuse_of"):
+                    print(f"场景 {i+1} 与场景 {scene['reuse_of']} 相似，共用图像: {scene['image_file']}")
+                    continue
+                
                 # 确保提取正确的提示词
                 if isinstance(scene, dict) and 'prompt' in scene:
                     scene_prompt = scene['prompt']
@@ -219,13 +310,23 @@ def process_story(input_file: str, image_generator_type: str = "comfyui", aspect
                 # 使用与key_scenes.json中相同的文件名格式
                 image_filename = scene['image_file'] if isinstance(scene, dict) and 'image_file' in scene else f"scene_{i+1:03d}.png"
                 
-                image_file = generator.generate_image(scene_prompt, image_filename)
-                if image_file:
-                    image_files.append(image_file)
+                jobs.append((scene_prompt, image_filename))
+            
+            results = generator.generate_batch(jobs, comfyui_queue_window)
+            for scene_prompt, image_filename in jobs:
+                if results.get(image_filename):
+                    image_files.append(results[image_filename])
+                else:
+                    print(f"图片生成失败: {image_filename}")
         else:
             # 使用Midjourney生成图像
             generator = MidjourneyGenerator()
             for i, scene in enumerate(key_scenes):
+                # 与前面场景几乎相同的场景直接共用图像
+                if isinstance(scene, dict) and scene.get("reuse_of"):
+                    print(f"场景 {i+1} 与场景 {scene['reuse_of']} 相似，共用图像: {scene['image_file']}")
+                    continue
+                
                 # 确保提取正确的提示词
                 if isinstance(scene, dict) and 'prompt' in scene:
                     scene_prompt = scene['prompt']
@@ -275,10 +376,18 @@ def process_story(input_file: str, image_generator_type: str = "comfyui", aspect
         print(f"最终视频已生成: {output_video}")
         
         print("\n=== 处理完成 ===")
+        manifest["status"] = "completed"
+        manifest["output_video"] = output_video
+        manifest["elapsed_seconds"] = round(time.time() - run_start, 2)
+        write_run_manifest(manifest, manifest_file)
         return output_video
         
     except Exception as e:
         print(f"处理过程中发生错误: {e}")
+        manifest["status"] = "failed"
+        manifest["error"] = str(e)
+        manifest["elapsed_seconds"] = round(time.time() - run_start, 2)
+        write_run_manifest(manifest, manifest_file)
         import traceback
         traceback.print_exc()
         return None
@@ -297,6 +406,36 @@ if __name__ == "__main__":
                         help="设置图像风格，例如: 'cinematic lighting, movie quality' 或 'ancient Chinese ink painting style'")
     parser.add_argument("--comfyui_style", 
                         help="设置ComfyUI的风格选项，可选值为 '水墨', '手绘', '古风', '插画', '写实', '电影'")
+    parser.add_argument("--no_llm_cache", action="store_true",
+                        help="不使用本地LLM响应缓存，所有分析请求都重新发送")
+    parser.add_argument("--no_audio_reuse", action="store_true",
+                        help="不沿用上次生成的音频，所有句子都重新合成")
+    parser.add_argument("--no_image_cache", action="store_true",
+                        help="不使用本地图像缓存，所有场景的图像都重新生成")
+    parser.add_argument("--scene_prompt_mode", choices=["two_call", "single_call"],
+                        help="场景提示词生成模式: two_call (先翻译再描述) 或 single_call (一次请求完成)")
+    parser.add_argument("--scene_batch_size", type=int,
+                        help="每个LLM请求最多生成的场景描述数，默认 1（逐个场景请求）")
+    parser.add_argument("--llm_backend", choices=list(LLM_BACKENDS.keys()),
+                        help="LLM后端: openai (默认)、local (OpenAI兼容的本地服务，地址由 LLM_BASE_URL 指定) 或 stub (离线模拟)")
+    parser.add_argument("--scene_segmentation", choices=list(SCENE_SEGMENTATIONS),
+                        help="场景划分方式: greedy (默认，按顺序累加到最长时长) 或 optimal (在段落和对话边界上求最优划分)")
+    parser.add_argument("--target_scene_count", type=int,
+                        help="optimal 划分的目标场景数（即生成的图像数）")
+    parser.add_argument("--min_scene_duration", type=float, help="optimal 划分的场景最短时长（秒），默认 3")
+    parser.add_argument("--max_scene_duration", type=float, help="场景最长时长（秒），默认 10")
+    parser.add_argument("--no_scene_dedup", action="store_true",
+                        help="不检测近似重复的场景（默认相邻的相似场景共用图像）")
+    parser.add_argument("--scene_dedup_threshold", type=float, default=DEFAULT_DEDUP_THRESHOLD,
+                        help=f"场景共用图像的提示词相似度阈值 (0-1)，默认 {DEFAULT_DEDUP_THRESHOLD}")
+    parser.add_argument("--comfyui_queue_window", type=int, default=DEFAULT_QUEUE_WINDOW,
+                        help=f"预先提交到ComfyUI队列的提示词数，默认 {DEFAULT_QUEUE_WINDOW}，1 表示逐张生成")
+    parser.add_argument("--comfyui_workflow", choices=available_workflows(),
+                        help="ComfyUI工作流 (workflows 目录中的文件名)，默认 waterink")
+    parser.add_argument("--comfyui_websocket_images", action="store_true", default=None,
+                        help="通过 WebSocket 接收ComfyUI生成的图像 (SaveImageWebsocket 节点)，不再请求 /history 和 /view")
+    parser.add_argument("--comfyui_endpoints",
+                        help="多个ComfyUI节点的地址，用逗号分隔，例如 '192.168.1.10:8188,192.168.1.11:8188'")
     args = parser.parse_args()
 
     # 打印参数信息，便于调试
@@ -337,7 +476,18 @@ if __name__ == "__main__":
     print(f"使用输入文件: {input_file}")
     
     # 处理函数已经包含文件存在性检查，直接调用
-    result = process_story(input_file, image_generator, args.aspect_ratio, args.image_style, args.comfyui_style) 
+    result = process_story(input_file, image_generator, args.aspect_ratio, args.image_style, args.comfyui_style,
+                           use_llm_cache=not args.no_llm_cache, scene_prompt_mode=args.scene_prompt_mode,
+                           scene_batch_size=args.scene_batch_size, llm_backend=args.llm_backend,
+                           scene_segmentation=args.scene_segmentation, target_scene_count=args.target_scene_count,
+                           min_scene_duration=args.min_scene_duration, max_scene_duration=args.max_scene_duration,
+                           scene_dedup_threshold=None if args.no_scene_dedup else args.scene_dedup_threshold,
+                           comfyui_queue_window=args.comfyui_queue_window,
+                           comfyui_endpoints=args.comfyui_endpoints.split(",") if args.comfyui_endpoints else None,
+                           comfyui_workflow=args.comfyui_workflow,
+                           use_image_cache=not args.no_image_cache,
+                           comfyui_websocket_images=args.comfyui_websocket_images,
+                           reuse_audio=not args.no_audio_reuse)
     
     if result is None or isinstance(result, str) and result.startswith("错误:"):
         sys.exit(1) 
\ No newline at end of file
@@ -0,0 +1,121 @@
+import os
+import json
+import shutil
+import hashlib
+import threading
+from pathlib import Path
+from typing import Optional
+
+DEFAULT_CACHE_DIR = "cache/images"
+DEFAULT_MAX_SIZE_MB = 2000
+
+def derive_seed(text: str, max_seed: int = 9999999999) -> int:
+    """根据场景内容（提示词）生成确定的采样种子，相同内容每次得到相同的种子"""
+    digest = hashlib.sha256(text.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % max_seed + 1
+
+class ImageCache:
+    """基于文件的图像缓存
+
+    以完整的生成配方 (工作流哈希, 正面提示词, 负面提示词, LoRA, 种子, 尺寸) 为键保存生成的图像，
+    配方不变的场景重新生成故事时直接复制缓存的图像。总大小超过上限时按最近访问时间淘汰。
+    缓存目录与 output/images 分开，不受 clean_output_directories 影响。
+    """
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR, max_size_mb: float = DEFAULT_MAX_SIZE_MB):
+        """初始化缓存
+
+        Args:
+            cache_dir: 缓存目录
+            max_size_mb: 缓存的最大大小（MB）
+        """
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_size = int(max_size_mb * 1024 * 1024)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        """根据环境变量创建缓存（IMAGE_CACHE_DIR, IMAGE_CACHE_MAX_MB）"""
+        return cls(
+            cache_dir=os.getenv("IMAGE_CACHE_DIR", DEFAULT_CACHE_DIR),
+            max_size_mb=float(os.getenv("IMAGE_CACHE_MAX_MB", DEFAULT_MAX_SIZE_MB))
+        )
+
+    @staticmethod
+    def make_key(workflow_hash: str, prompt: str, negative_prompt: str, lora_name: Optional[str],
+                 seed: int, size: Optional[tuple]) -> str:
+        """根据生成配方生成缓存键"""
+        content = json.dumps({
+            "workflow": workflow_hash,
+            "prompt": prompt,
+            "negative_prompt": negative_prompt,
+            "lora": lora_name,
+            "seed": seed,
+            "size": list(size) if size else None
+        }, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.png"
+
+    def get(self, key: str, output_file) -> bool:
+        """缓存中有该配方的图像时复制到 output_file 并返回 True"""
+        path = self._path(key)
+        with self._lock:
+            if not path.exists():
+                self.misses += 1
+                return False
+            self.hits += 1
+        try:
+            shutil.copyfile(path, output_file)
+            # 更新访问时间，用于淘汰
+            os.utime(path)
+            return True
+        except Exception as e:
+            print(f"读取图像缓存时出错: {e}")
+            return False
+
+    def put(self, key: str, image_file):
+        """保存生成的图像，超过大小上限时淘汰最久未访问的图像"""
+        path = self._path(key)
+        temp_path = path.with_suffix(f".{threading.get_ident()}.tmp")
+        try:
+            shutil.copyfile(image_file, temp_path)
+            os.replace(temp_path, path)
+        except Exception as e:
+            print(f"保存图像缓存时出错: {e}")
+            temp_path.unlink(missing_ok=True)
+            return
+        with self._lock:
+            self._evict()
+
+    def _evict(self):
+        """淘汰最久未访问的图像，直到总大小不超过上限（调用方需持有锁）"""
+        files = []
+        total = 0
+        for path in self.cache_dir.glob("*.png"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+        if total <= self.max_size:
+            return
+        deleted = 0
+        for _, size, path in sorted(files):
+            path.unlink(missing_ok=True)
+            deleted += 1
+            total -= size
+            if total <= self.max_size:
+                break
+        print(f"图像缓存超过上限，已淘汰 {deleted} 张图像")
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            for path in self.cache_dir.glob("*.png"):
+                path.unlink(missing_ok=True)
@@ -3,15 +3,45 @@ import uuid
 import json
 import urllib.request
 import urllib.parse
+import urllib.error
 import os
 from pathlib import Path
 import time
-import random
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+from workflow_template import load_workflow_template, available_workflows
+from image_cache import ImageCache, derive_seed
+
+# 预先提交到 ComfyUI 队列的提示词数（队列中始终有等待的任务，GPU 不会空闲）
+DEFAULT_QUEUE_WINDOW = 4
+
+NEGATIVE_PROMPT = "text, watermark, bad quality, worst quality, low quality, illustration, 3d render, cartoon, anime, manga"
+
+# WebSocket 二进制消息的事件类型：图像（SaveImageWebsocket 的输出和采样过程中的预览图像）
+WEBSOCKET_IMAGE_EVENT = 1
+
+def decode_image_frame(frame: bytes) -> Optional[bytes]:
+    """解析 WebSocket 二进制消息（4 字节事件类型 + 4 字节图像格式 + 图像数据），不是图像时返回 None"""
+    if len(frame) <= 8 or int.from_bytes(frame[:4], "big") != WEBSOCKET_IMAGE_EVENT:
+        return None
+    return frame[8:]
 
 class ComfyUIGenerator:
-    def __init__(self, host="127.0.0.1", port="8188", style=None):
+    def __init__(self, host="127.0.0.1", port="8188", style=None, workflow=None, use_cache=True,
+                 websocket_images=None):
         self.server_address = f"{host}:{port}"
         self.client_id = str(uuid.uuid4())
+        self.ws = None
+        self.pending_prompts = {}  # 已提交但尚未完成的提示词: {prompt_id: 输出文件}
+        self.cache_keys = {}       # 已提交的提示词的缓存键: {prompt_id: 缓存键}
+        # 通过 WebSocket 接收图像（SaveImageWebsocket 节点），不再请求 /history 和 /view，默认读取 COMFYUI_WEBSOCKET_IMAGES
+        if websocket_images is None:
+            websocket_images = os.getenv("COMFYUI_WEBSOCKET_IMAGES", "").lower() in ("1", "true", "yes")
+        self.websocket_images = websocket_images
+        self.received_images = {}  # 通过 WebSocket 收到的图像: {prompt_id: 图像数据}
+        self.current_node = None   # 正在执行的 (prompt_id, 节点ID)，用于判断二进制消息属于哪个节点
+        # 按生成配方缓存图像，配方不变的场景不再重新生成
+        self.image_cache = ImageCache.from_env() if use_cache else None
         self.output_dir = Path("output/images")
         self.output_dir.mkdir(parents=True, exist_ok=True)
         
@@ -30,11 +60,11 @@ class ComfyUIGenerator:
         self.lora_name = self.available_styles[self.style]
         print(f"使用风格: {self.style} (Lora: {self.lora_name})")
         
-        # 加载工作流配置
+        # 加载工作流模板（workflows 目录中的文件名，默认读取 COMFYUI_WORKFLOW，否则为 waterink）
         try:
-            with open("workflows/waterink.json", "r", encoding="utf-8") as f:
-                self.workflow = json.load(f)
-                print("成功加载工作流配置")
+            self.template = load_workflow_template(workflow)
+            self.workflow = self.template.workflow
+            print(f"成功加载工作流配置: {self.template.name}")
         except Exception as e:
             print(f"加载工作流配置失败: {e}")
             raise
@@ -54,6 +84,10 @@ class ComfyUIGenerator:
         """获取所有可用的风格选项"""
         return list(self.available_styles.keys())
 
+    def get_available_workflows(self):
+        """获取所有可用的工作流"""
+        return available_workflows()
+
     def queue_prompt(self, prompt):
         """发送提示词到队列"""
         p = {"prompt": prompt, "client_id": self.client_id}
@@ -68,11 +102,180 @@ class ComfyUIGenerator:
         with urllib.request.urlopen(f"http://{self.server_address}/view?{url_values}") as response:
             return response.read()
 
+    def get_queue(self):
+        """获取队列状态（正在执行和等待执行的任务）"""
+        with urllib.request.urlopen(f"http://{self.server_address}/queue", timeout=10) as response:
+            return json.loads(response.read())
+
     def get_history(self, prompt_id):
         """获取生成历史"""
         with urllib.request.urlopen(f"http://{self.server_address}/history/{prompt_id}") as response:
             return json.loads(response.read())
 
+    def _recipe(self, prompt: str) -> Tuple[int, str]:
+        """返回提示词对应的 (种子, 正面提示词)
+
+        种子只由提示词确定：相同场景每次生成相同的图像，场景重新编号后仍能命中图像缓存
+        （提示词相同的场景由近似重复场景检测共用图像）。
+        """
+        return derive_seed(prompt), prompt + ", masterpiece, best quality"
+
+    def cache_key(self, prompt: str) -> str:
+        """根据完整的生成配方（工作流、提示词、LoRA、种子、尺寸）生成图像缓存键"""
+        seed, positive_prompt = self._recipe(prompt)
+        lora_name = self.lora_name if self.template.has_lora else None
+        return ImageCache.make_key(self.template.hash, positive_prompt, NEGATIVE_PROMPT, lora_name, seed,
+                                   self.template.size)
+
+    def load_cached(self, prompt: str, output_file) -> bool:
+        """缓存中有相同配方的图像时复制到 output_file 并返回 True"""
+        if self.image_cache is None or not self.image_cache.get(self.cache_key(prompt), output_file):
+            return False
+        print(f"使用缓存的图片: {output_file}")
+        return True
+
+    def store_cached(self, prompt: str, output_file):
+        """保存生成的图像到缓存"""
+        if self.image_cache is not None:
+            self.image_cache.put(self.cache_key(prompt), output_file)
+
+    def build_workflow(self, prompt: str) -> dict:
+        """根据提示词生成本次请求的工作流（只复制被修改的节点）"""
+        # 设置种子和更新提示词
+        seed, positive_prompt = self._recipe(prompt)
+        
+        workflow = self.template.render(seed, positive_prompt, NEGATIVE_PROMPT, lora_name=self.lora_name,
+                                        websocket_output=self.websocket_images)
+        if self.template.has_lora:
+            print(f"设置Lora模型: {self.lora_name}")
+        
+        print(f"设置种子: {seed}")
+        print(f"设置正面提示词: {positive_prompt}")
+        print(f"设置负面提示词: {NEGATIVE_PROMPT}")
+        return workflow
+
+    def connect(self):
+        """建立 WebSocket 连接（所有提示词共用一个连接）"""
+        if self.ws is None:
+            self.current_node = None
+            self.ws = websocket.WebSocket()
+            self.ws.connect(f"ws://{self.server_address}/ws?clientId={self.client_id}")
+        return self.ws
+
+    def close(self):
+        """关闭 WebSocket 连接"""
+        if self.ws is not None:
+            try:
+                self.ws.close()
+            finally:
+                self.ws = None
+
+    def submit(self, prompt: str, output_file) -> str:
+        """提交一个提示词，不等待完成，返回 prompt_id"""
+        try:
+            prompt_id = self.queue_prompt(self.build_workflow(prompt))['prompt_id']
+        except Exception as e:
+            if not self._fallback_to_http(e):
+                raise
+            prompt_id = self.queue_prompt(self.build_workflow(prompt))['prompt_id']
+        self.pending_prompts[prompt_id] = output_file
+        if self.image_cache is not None:
+            self.cache_keys[prompt_id] = self.cache_key(prompt)
+        return prompt_id
+
+    def _fallback_to_http(self, error: Exception) -> bool:
+        """提交被拒绝时，如果使用了 SaveImageWebsocket 节点则改用 HTTP 获取图像，返回是否需要重新提交"""
+        if not self.websocket_images or not isinstance(error, urllib.error.HTTPError):
+            return False
+        # 旧版本的 ComfyUI 没有 SaveImageWebsocket 节点
+        print(f"ComfyUI 不支持通过 WebSocket 发送图像 ({error})，改用 /history 和 /view 获取图像")
+        self.websocket_images = False
+        return True
+
+    def wait_for_next(self, timeout: float = None) -> Optional[Tuple[str, object, bool]]:
+        """等待任意一个已提交的提示词完成，并保存其图像
+        
+        WebSocket 消息按 prompt_id 分发，其他客户端或已处理的提示词的消息被忽略。
+        二进制消息按当前正在执行的节点归属，只保留输出节点发送的图像。
+        
+        Args:
+            timeout: 最长等待时间（秒），None 表示一直等待
+        
+        Returns:
+            tuple: (prompt_id, 输出文件, 是否成功)，超时返回 None
+        """
+        self.ws.settimeout(timeout)
+        while True:
+            try:
+                out = self.ws.recv()
+            except websocket.WebSocketTimeoutException:
+                return None
+            if not out:
+                # 服务器关闭连接时 recv 返回空数据
+                raise websocket.WebSocketConnectionClosedException("ComfyUI 关闭了 WebSocket 连接")
+            if not isinstance(out, str):
+                self._receive_image(out)
+                continue
+            message = json.loads(out)
+            data = message.get('data') or {}
+            prompt_id = data.get('prompt_id')
+            if prompt_id not in self.pending_prompts:
+                continue
+            
+            if message['type'] == 'executing':
+                if data.get('node') is not None:
+                    self.current_node = (prompt_id, data['node'])
+                    continue
+                output_file = self.pending_prompts.pop(prompt_id)
+                return prompt_id, output_file, self._save_result(prompt_id, output_file)
+            if message['type'] in ('execution_error', 'execution_interrupted'):
+                output_file = self.pending_prompts.pop(prompt_id)
+                self.cache_keys.pop(prompt_id, None)
+                self.received_images.pop(prompt_id, None)
+                print(f"提示词 {prompt_id} 生成失败: {data.get('exception_message', message['type'])}")
+                return prompt_id, output_file, False
+
+    def _receive_image(self, frame: bytes):
+        """保存输出节点通过 WebSocket 发送的图像（采样过程中的预览图像等其他二进制消息被忽略）"""
+        if self.current_node is None:
+            return
+        prompt_id, node_id = self.current_node
+        if prompt_id not in self.pending_prompts or prompt_id in self.received_images or \
+                node_id not in self.template.output_ids:
+            return
+        image_data = decode_image_frame(frame)
+        if image_data is not None:
+            self.received_images[prompt_id] = image_data
+
+    def _save_result(self, prompt_id: str, output_file) -> bool:
+        """保存完成的提示词的图像：优先使用通过 WebSocket 收到的图像，否则从生成历史中获取"""
+        image_data = self.received_images.pop(prompt_id, None)
+        if image_data is None:
+            return self.save_outputs(prompt_id, output_file)
+        self._write_image(image_data, output_file, self.cache_keys.pop(prompt_id, None))
+        return True
+
+    def _write_image(self, image_data: bytes, output_file, cache_key: str = None):
+        """保存图片（通过 submit 提交的提示词同时保存到缓存）"""
+        with open(output_file, 'wb') as f:
+            f.write(image_data)
+        print(f"图片已保存: {output_file}")
+        if cache_key is not None and self.image_cache is not None:
+            self.image_cache.put(cache_key, output_file)
+
+    def save_outputs(self, prompt_id: str, output_file) -> bool:
+        """从生成历史中获取图片并保存"""
+        cache_key = self.cache_keys.pop(prompt_id, None)
+        history = self.get_history(prompt_id)[prompt_id]
+        for node_id in history['outputs']:
+            node_output = history['outputs'][node_id]
+            if 'images' in node_output:
+                for image in node_output['images']:
+                    image_data = self.get_image(image['filename'], image['subfolder'], image['type'])
+                    self._write_image(image_data, output_file, cache_key)
+                    return True
+        return False
+
     def get_images(self, ws, workflow, output_file):
         """获取生成的图片并保存"""
         try:
@@ -87,94 +290,130 @@ class ComfyUIGenerator:
             print(f"提示词已发送，等待生成...")
 
             # 等待生成完成
+            current_node = None
+            image_data = None
             while True:
                 out = ws.recv()
                 if isinstance(out, str):
                     message = json.loads(out)
                     if message['type'] == 'executing':
                         data = message['data']
-                        if data['node'] is None and data['prompt_id'] == prompt_id:
-                            break
-                else:
-                    continue
+                        if data['prompt_id'] == prompt_id:
+                            if data['node'] is None:
+                                break
+                            current_node = data['node']
+                elif image_data is None and current_node in self.template.output_ids:
+                    # SaveImageWebsocket 节点发送的图像
+                    image_data = decode_image_frame(out)
 
             # 获取生成结果
-            history = self.get_history(prompt_id)[prompt_id]
-            for node_id in history['outputs']:
-                node_output = history['outputs'][node_id]
-                if 'images' in node_output:
-                    for image in node_output['images']:
-                        image_data = self.get_image(image['filename'], image['subfolder'], image['type'])
-                        # 保存图片
-                        with open(output_file, 'wb') as f:
-                            f.write(image_data)
-                        print(f"图片已保存: {output_file}")
-                        return True
-
-            return False
+            if image_data is not None:
+                self._write_image(image_data, output_file)
+                return True
+            return self.save_outputs(prompt_id, output_file)
         except Exception as e:
             print(f"生成图片时出错: {e}")
             print(f"工作流数据: {json.dumps(workflow, indent=2)}")
             raise
 
-    def generate_images(self, key_scenes_file: str):
-        """为所有场景生成图片"""
-        # 读取场景信息
-        with open(key_scenes_file, "r", encoding="utf-8") as f:
-            scenes = json.load(f)
+    def generate_batch(self, jobs: List[Tuple[str, str]], window: int = DEFAULT_QUEUE_WINDOW) -> Dict[str, Optional[str]]:
+        """批量生成图像：在一个 WebSocket 连接上预先提交最多 window 个提示词，完成一个补交一个
         
-        print(f"找到 {len(scenes)} 个场景需要生成图片")
+        Args:
+            jobs: [(提示词, 输出文件名)]
+            window: 同时在 ComfyUI 队列中的提示词数，1 表示逐个生成
         
-        # 连接 WebSocket
-        ws = websocket.WebSocket()
-        ws.connect(f"ws://{self.server_address}/ws?clientId={self.client_id}")
+        Returns:
+            dict: {输出文件名: 图像文件路径，失败时为 None}
+        """
+        window = max(1, window)
+        queue = deque(jobs)
+        filenames = {}  # prompt_id -> 输出文件名
+        prompts = {}    # prompt_id -> 提示词
+        results = {}
         
+        self.connect()
         try:
-            for scene in scenes:
-                print(f"\n生成场景 {scene['scene_id']} 的图片...")
-                print(f"提示词: {scene['prompt']}")
+            while queue or filenames:
+                # 补充队列，保证 ComfyUI 始终有等待执行的任务
+                while queue and len(filenames) < window:
+                    prompt, output_filename = queue.popleft()
+                    output_file = self.output_dir / output_filename
+                    if self.load_cached(prompt, output_file):
+                        results[output_filename] = str(output_file)
+                        continue
+                    try:
+                        prompt_id = self.submit(prompt, output_file)
+                        filenames[prompt_id] = output_filename
+                        prompts[prompt_id] = prompt
+                        print(f"已提交 {output_filename} (队列中 {len(filenames)} 个)")
+                    except Exception as e:
+                        print(f"提交提示词时出错 ({output_filename}): {e}")
+                        results[output_filename] = None
                 
-                # 准备输出文件名
-                output_file = self.output_dir / scene['image_file']
-                if output_file.exists():
-                    print(f"图片已存在: {output_file}")
+                if not filenames:
                     continue
-                
-                # 创建工作流的深拷贝
-                workflow = json.loads(json.dumps(self.workflow))
-                
-                # 设置随机种子和更新提示词
-                seed = random.randint(1, 9999999999)
-                positive_prompt = scene["prompt"] + ", masterpiece, best quality"
-                negative_prompt = "text, watermark, bad quality, worst quality, low quality, illustration, 3d render, cartoon, anime, manga"
-                
-                # 更新工作流配置
-                workflow["3"]["inputs"]["seed"] = seed  # KSampler 节点
-                workflow["6"]["inputs"]["text"] = positive_prompt  # 正面提示词节点
-                workflow["7"]["inputs"]["text"] = negative_prompt  # 负面提示词节点
-                
-                # 更新Lora模型
-                for node_id, node in workflow.items():
-                    if node["class_type"] == "LoraLoader":
-                        node["inputs"]["lora_name"] = self.lora_name
-                        print(f"设置Lora模型: {self.lora_name}")
-                
-                print(f"设置随机种子: {seed}")
-                print(f"设置正面提示词: {positive_prompt}")
-                print(f"设置负面提示词: {negative_prompt}")
-                
                 try:
-                    success = self.get_images(ws, workflow, output_file)
-                    if not success:
-                        print("图片生成失败")
+                    prompt_id, output_file, success = self.wait_for_next()
                 except Exception as e:
-                    print(f"生成图片时出错: {e}")
-                
-                # 等待一小段时间再生成下一张
-                time.sleep(1)
-        
+                    print(f"WebSocket 连接中断: {e}")
+                    if not self._recover_after_disconnect(filenames, results, prompts, queue):
+                        # 无法重新连接，剩余的场景都视为失败
+                        for output_filename in list(filenames.values()) + [job[1] for job in queue]:
+                            results[output_filename] = None
+                        break
+                    continue
+                results[filenames.pop(prompt_id)] = str(output_file) if success else None
+                prompts.pop(prompt_id, None)
         finally:
-            ws.close()
+            self.pending_prompts.clear()
+            self.cache_keys.clear()
+            self.received_images.clear()
+            self.close()
+        return results
+
+    def _recover_after_disconnect(self, filenames: Dict[str, str], results: Dict[str, Optional[str]],
+                                  prompts: Dict[str, str], queue: deque) -> bool:
+        """重新连接，并通过生成历史找回连接中断期间已完成的提示词，无法连接时返回 False
+        
+        使用 SaveImageWebsocket 节点时，连接中断期间发送的图像不会保存在服务器上，这些提示词重新提交。
+        """
+        self.close()
+        try:
+            self.connect()
+        except Exception as e:
+            print(f"重新连接 ComfyUI 失败: {e}")
+            return False
+        for prompt_id in list(filenames):
+            try:
+                item = self.get_history(prompt_id).get(prompt_id)
+                if item:
+                    output_file = self.pending_prompts.pop(prompt_id)
+                    completed = item.get('status', {}).get('status_str') != 'error'
+                    success = completed and self._save_result(prompt_id, output_file)
+                    prompt = prompts.pop(prompt_id, None)
+                    if completed and not success and self.websocket_images and prompt is not None:
+                        print(f"{filenames[prompt_id]} 的图像在连接中断期间发送，重新提交")
+                        queue.appendleft((prompt, filenames.pop(prompt_id)))
+                        continue
+                    results[filenames.pop(prompt_id)] = str(output_file) if success else None
+            except Exception as e:
+                print(f"查询生成历史时出错: {e}")
+        return True
+
+    def generate_images(self, key_scenes_file: str, window: int = DEFAULT_QUEUE_WINDOW):
+        """为所有场景生成图片"""
+        # 读取场景信息
+        with open(key_scenes_file, "r", encoding="utf-8") as f:
+            scenes = json.load(f)
+        
+        print(f"找到 {len(scenes)} 个场景需要生成图片")
+        jobs = [(scene['prompt'], scene['image_file']) for scene in scenes if not scene.get('reuse_of')]
+        results = self.generate_batch(jobs, window)
+        failed = [filename for filename, image_file in results.items() if image_file is None]
+        if failed:
+            print(f"图片生成失败: {', '.join(failed)}")
+        return results
 
     def generate_image(self, prompt: str, output_filename: str) -> str:
         """生成单个图像
@@ -188,42 +427,26 @@ class ComfyUIGenerator:
         """
         # 准备输出文件路径
         output_file = self.output_dir / output_filename
-        if output_file.exists():
-            print(f"图片已存在: {output_file}")
+        if self.load_cached(prompt, output_file):
             return str(output_file)
         
-        # 创建工作流的深拷贝
-        workflow = json.loads(json.dumps(self.workflow))
-        
-        # 设置随机种子和更新提示词
-        seed = random.randint(1, 9999999999)
-        positive_prompt = prompt + ", masterpiece, best quality"
-        negative_prompt = "text, watermark, bad quality, worst quality, low quality, illustration, 3d render, cartoon, anime, manga"
-        
-        # 更新工作流配置
-        workflow["3"]["inputs"]["seed"] = seed  # KSampler 节点
-        workflow["6"]["inputs"]["text"] = positive_prompt  # 正面提示词节点
-        workflow["7"]["inputs"]["text"] = negative_prompt  # 负面提示词节点
-        
-        # 更新Lora模型
-        for node_id, node in workflow.items():
-            if node["class_type"] == "LoraLoader":
-                node["inputs"]["lora_name"] = self.lora_name
-                print(f"设置Lora模型: {self.lora_name}")
-        
-        print(f"设置随机种子: {seed}")
-        print(f"设置正面提示词: {positive_prompt}")
-        print(f"设置负面提示词: {negative_prompt}")
+        workflow = self.build_workflow(prompt)
         
         try:
             # 连接 WebSocket
             ws = websocket.WebSocket()
             ws.connect(f"ws://{self.server_address}/ws?clientId={self.client_id}")
             
-            success = self.get_images(ws, workflow, output_file)
+            try:
+                success = self.get_images(ws, workflow, output_file)
+            except Exception as e:
+                if not self._fallback_to_http(e):
+                    raise
+                success = self.get_images(ws, self.build_workflow(prompt), output_file)
             ws.close()
             
             if success:
+                self.store_cached(prompt, output_file)
                 return str(output_file)
             else:
                 print("图片生成失败")
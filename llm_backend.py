@@ -0,0 +1,170 @@
+import json
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
+from openai import OpenAI
+
+# 各后端的默认配置，json_mode 为 None 表示首次使用时探测
+LLM_BACKENDS = {
+    # OpenAI 官方接口，默认使用 gpt-4o-mini 模型
+    "openai": {"base_url": None, "model": "gpt-4o-mini", "max_concurrency": 4, "json_mode": True},
+    # 本地 OpenAI 兼容服务（llama.cpp / vLLM 等），通常只能同时处理少量请求
+    "local": {"base_url": "http://127.0.0.1:8080/v1", "model": "local-model", "max_concurrency": 2, "json_mode": None},
+    # 进程内模拟客户端，不需要网络
+    "stub": {"base_url": None, "model": "stub-model", "max_concurrency": 8, "json_mode": True},
+}
+
+DEFAULT_BACKEND = "openai"
+
+# 不支持 JSON 模式时追加到系统消息中的说明
+JSON_FALLBACK_INSTRUCTION = "Respond with a single valid JSON object only, without markdown or any other text."
+
+def extract_json_object(text: str) -> str:
+    """从响应文本中提取第一个可以解析的 JSON 对象，找不到时原样返回"""
+    if not text:
+        return text
+    start = text.find("{")
+    while start != -1:
+        depth = 0
+        in_string = False
+        escaped = False
+        for end in range(start, len(text)):
+            char = text[end]
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif char == "\\":
+                    escaped = True
+                elif char == '"':
+                    in_string = False
+            elif char == '"':
+                in_string = True
+            elif char == "{":
+                depth += 1
+            elif char == "}":
+                depth -= 1
+                if depth == 0:
+                    candidate = text[start:end + 1]
+                    try:
+                        json.loads(candidate)
+                        return candidate
+                    except json.JSONDecodeError:
+                        break
+        start = text.find("{", start + 1)
+    return text
+
+class LLMBackend:
+    """LLM 后端配置：客户端、模型、并发上限和 JSON 模式支持情况"""
+
+    def __init__(self, name: str = DEFAULT_BACKEND, base_url: str = None, model: str = None, api_key: str = None,
+                 max_concurrency: int = None, json_mode: Optional[bool] = None, client=None):
+        """初始化后端
+
+        Args:
+            name: 后端名称，"openai"、"local" 或 "stub"
+            base_url: OpenAI 兼容接口的地址（例如 http://127.0.0.1:8080/v1），默认使用后端的默认值
+            model: 模型名称，默认使用后端的默认值
+            api_key: API 密钥，本地服务通常不需要
+            max_concurrency: 该后端允许的并发请求数
+            json_mode: 是否支持 response_format={"type": "json_object"}，None 表示使用默认值或自动探测
+            client: 自定义客户端（需提供 chat.completions.create），指定时不再创建客户端
+        """
+        if name not in LLM_BACKENDS:
+            raise ValueError(f"未知的LLM后端: {name}，可选值: {', '.join(LLM_BACKENDS)}")
+        defaults = LLM_BACKENDS[name]
+        self.name = name
+        self.base_url = base_url or defaults["base_url"]
+        self.model = model or defaults["model"]
+        self.max_concurrency = max_concurrency or defaults["max_concurrency"]
+        self.json_mode = defaults["json_mode"] if json_mode is None else json_mode
+        self._json_mode_lock = threading.Lock()
+        self.client = client or self._create_client(api_key)
+
+    @classmethod
+    def from_env(cls, name: str = None, client=None):
+        """根据环境变量创建后端（LLM_BACKEND, LLM_BASE_URL, LLM_MODEL, LLM_API_KEY, LLM_BACKEND_CONCURRENCY, LLM_JSON_MODE）"""
+        name = name or os.getenv("LLM_BACKEND", DEFAULT_BACKEND)
+        json_mode = os.getenv("LLM_JSON_MODE", "auto").lower()
+        concurrency = os.getenv("LLM_BACKEND_CONCURRENCY")
+        return cls(
+            name=name,
+            base_url=os.getenv("LLM_BASE_URL") if name == "local" else None,
+            # 只有本地后端可以通过 LLM_MODEL 指定模型：openai 后端固定使用 gpt-4o-mini，模拟后端只有一个模型
+            model=os.getenv("LLM_MODEL") if name == "local" else None,
+            api_key=os.getenv("LLM_API_KEY"),
+            max_concurrency=int(concurrency) if concurrency else None,
+            json_mode={"true": True, "false": False}.get(json_mode),
+            client=client
+        )
+
+    def _create_client(self, api_key: str = None):
+        if self.name == "stub":
+            from llm_stub import StubLLMClient
+            return StubLLMClient()
+        if self.name == "local":
+            # 本地服务一般不校验密钥，但 OpenAI 客户端要求提供
+            return OpenAI(api_key=api_key or "not-needed", base_url=self.base_url)
+        return OpenAI(api_key=api_key or os.getenv('OPENAI_API_KEY'), base_url=self.base_url)
+
+    def supports_json_mode(self) -> bool:
+        """后端是否支持 JSON 模式，未知时发送一个小请求探测（只探测一次）"""
+        with self._json_mode_lock:
+            if self.json_mode is None:
+                self.json_mode = self._probe_json_mode()
+                print(f"LLM后端 {self.name} JSON模式: {'支持' if self.json_mode else '不支持，改用提示词约束'}")
+            return self.json_mode
+
+    def _probe_json_mode(self) -> bool:
+        try:
+            response = self.client.chat.completions.create(
+                model=self.model,
+                messages=[
+                    {"role": "system", "content": "Always return valid JSON."},
+                    {"role": "user", "content": 'Return {"ok": true} as JSON.'}
+                ],
+                response_format={"type": "json_object"},
+                max_tokens=20
+            )
+            json.loads(response.choices[0].message.content)
+            return True
+        except Exception as e:
+            print(f"JSON模式探测失败: {e}")
+            return False
+
+    def build_request_body(self, messages: List[Dict], response_format: Dict = None, temperature: float = None,
+                           max_tokens: int = None) -> Dict:
+        """构建 chat.completions 请求参数
+
+        后端不支持 JSON 模式时，去掉 response_format，改为在系统消息中要求返回 JSON。
+        """
+        if response_format and response_format.get("type") == "json_object" and not self.supports_json_mode():
+            response_format = None
+            messages = self._with_json_instruction(messages)
+
+        params = {"model": self.model, "messages": messages}
+        if response_format is not None:
+            params["response_format"] = response_format
+        if temperature is not None:
+            params["temperature"] = temperature
+        if max_tokens is not None:
+            params["max_tokens"] = max_tokens
+        return params
+
+    def chat(self, messages: List[Dict], response_format: Dict = None, temperature: float = None,
+             max_tokens: int = None) -> Tuple[str, object]:
+        """发送对话请求，返回 (响应文本, usage)，未使用 JSON 模式时从响应中提取 JSON 对象"""
+        params = self.build_request_body(messages, response_format, temperature, max_tokens)
+        response = self.client.chat.completions.create(**params)
+        content = response.choices[0].message.content
+        if response_format and "response_format" not in params:
+            content = extract_json_object(content)
+        return content, getattr(response, "usage", None)
+
+    @staticmethod
+    def _with_json_instruction(messages: List[Dict]) -> List[Dict]:
+        messages = [dict(message) for message in messages]
+        if messages and messages[0].get("role") == "system":
+            messages[0]["content"] = f"{messages[0]['content']} {JSON_FALLBACK_INSTRUCTION}"
+        else:
+            messages.insert(0, {"role": "system", "content": JSON_FALLBACK_INSTRUCTION})
+        return messages
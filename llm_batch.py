@@ -0,0 +1,101 @@
+import json
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+from llm_backend import LLMBackend, extract_json_object
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+# 批处理任务的终止状态
+FINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+class BatchJobClient:
+    """OpenAI 批处理 API（/v1/files + /v1/batches）的简单封装
+
+    适合对延迟不敏感的大量请求（例如夜间批量生成场景描述），费用低于同步请求。
+    """
+
+    def __init__(self, backend: LLMBackend, completion_window: str = "24h", poll_interval: float = 60.0):
+        """初始化批处理客户端
+
+        Args:
+            backend: LLM后端，客户端需要支持 files 和 batches 接口（openai 或 local 后端）
+            completion_window: 批处理任务的完成时限
+            poll_interval: 轮询任务状态的间隔（秒）
+        """
+        self.backend = backend
+        self.client = backend.client
+        self.completion_window = completion_window
+        self.poll_interval = poll_interval
+
+    def write_requests(self, requests: List[Dict], batch_file: str) -> int:
+        """将请求写入 JSONL 批处理文件
+
+        Args:
+            requests: [{"custom_id": ..., "messages": ..., "response_format": ..., "temperature": ..., "max_tokens": ...}]
+            batch_file: 输出文件路径
+
+        Returns:
+            int: 写入的请求数
+        """
+        Path(batch_file).parent.mkdir(parents=True, exist_ok=True)
+        with open(batch_file, "w", encoding="utf-8") as f:
+            for request in requests:
+                body = self.backend.build_request_body(
+                    request["messages"], request.get("response_format"),
+                    request.get("temperature"), request.get("max_tokens")
+                )
+                line = {"custom_id": request["custom_id"], "method": "POST", "url": BATCH_ENDPOINT, "body": body}
+                f.write(json.dumps(line, ensure_ascii=False) + "\n")
+        return len(requests)
+
+    def submit(self, batch_file: str, metadata: Dict = None) -> Dict:
+        """上传批处理文件并创建任务，返回 {"batch_id": ..., "input_file_id": ...}"""
+        with open(batch_file, "rb") as f:
+            uploaded = self.client.files.create(file=f, purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=uploaded.id,
+            endpoint=BATCH_ENDPOINT,
+            completion_window=self.completion_window,
+            metadata=metadata
+        )
+        print(f"批处理任务已提交: {batch.id} (输入文件: {uploaded.id})")
+        return {"batch_id": batch.id, "input_file_id": uploaded.id}
+
+    def wait(self, batch_id: str, timeout: Optional[float] = None):
+        """轮询任务状态直到结束，超时返回 None"""
+        start = time.monotonic()
+        while True:
+            batch = self.client.batches.retrieve(batch_id)
+            counts = batch.request_counts
+            if counts is not None:
+                print(f"批处理任务 {batch_id}: {batch.status} ({counts.completed}/{counts.total}，失败 {counts.failed})")
+            else:
+                print(f"批处理任务 {batch_id}: {batch.status}")
+            if batch.status in FINAL_STATUSES:
+                return batch
+            if timeout is not None and time.monotonic() - start >= timeout:
+                return None
+            time.sleep(self.poll_interval)
+
+    def download_results(self, batch) -> Dict[str, Dict]:
+        """下载任务结果，返回 {custom_id: {"content": ..., "usage": ...}}，失败的请求不包含在内"""
+        results = {}
+        if not batch.output_file_id:
+            return results
+        text = self.client.files.content(batch.output_file_id).text
+        for line in text.splitlines():
+            if not line.strip():
+                continue
+            try:
+                item = json.loads(line)
+                response = item.get("response") or {}
+                if response.get("status_code") != 200:
+                    continue
+                body = response["body"]
+                results[item["custom_id"]] = {
+                    "content": extract_json_object(body["choices"][0]["message"]["content"]),
+                    "usage": body.get("usage") or {}
+                }
+            except Exception as e:
+                print(f"解析批处理结果时出错: {e}")
+        return results
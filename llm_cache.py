@@ -0,0 +1,124 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+import hashlib
+from pathlib import Path
+from typing import Dict, List, Optional
+
+DEFAULT_CACHE_PATH = "cache/llm_cache.sqlite3"
+DEFAULT_MAX_SIZE_MB = 200
+
+class LLMResponseCache:
+    """基于 SQLite 的 LLM 响应缓存
+
+    以 (backend, base_url, model, messages, response_format, temperature, max_tokens) 为键保存响应内容，
+    数据经过 zlib 压缩，总大小超过上限时按最近访问时间淘汰。
+    """
+
+    def __init__(self, db_path: str = DEFAULT_CACHE_PATH, max_size_mb: float = DEFAULT_MAX_SIZE_MB,
+                 bypass_nondeterministic: bool = False):
+        """初始化缓存
+
+        Args:
+            db_path: 缓存数据库路径
+            max_size_mb: 缓存的最大大小（MB，按压缩后的数据计算）
+            bypass_nondeterministic: 为 True 时，temperature 不为 0 的请求不使用缓存
+        """
+        self.db_path = db_path
+        self.max_size = int(max_size_mb * 1024 * 1024)
+        self.bypass_nondeterministic = bypass_nondeterministic
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON responses (last_access)")
+        self._conn.commit()
+
+    @classmethod
+    def from_env(cls):
+        """根据环境变量创建缓存（LLM_CACHE_PATH, LLM_CACHE_MAX_MB, LLM_CACHE_BYPASS_NONDETERMINISTIC）"""
+        return cls(
+            db_path=os.getenv("LLM_CACHE_PATH", DEFAULT_CACHE_PATH),
+            max_size_mb=float(os.getenv("LLM_CACHE_MAX_MB", DEFAULT_MAX_SIZE_MB)),
+            bypass_nondeterministic=os.getenv("LLM_CACHE_BYPASS_NONDETERMINISTIC", "").lower() in ("1", "true", "yes")
+        )
+
+    @staticmethod
+    def make_key(model: str, messages: List[Dict], response_format: Optional[Dict] = None,
+                 temperature: Optional[float] = None, max_tokens: Optional[int] = None,
+                 backend: Optional[str] = None, base_url: Optional[str] = None) -> str:
+        """根据请求参数生成缓存键（包含后端名称和接口地址，不同服务上的同名模型不共用缓存）"""
+        content = json.dumps({
+            "backend": backend,
+            "base_url": base_url,
+            "model": model,
+            "messages": messages,
+            "response_format": response_format,
+            "temperature": temperature,
+            "max_tokens": max_tokens
+        }, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    def should_bypass(self, temperature: Optional[float]) -> bool:
+        """判断请求是否应跳过缓存（未指定 temperature 时使用 API 默认值，同样视为非确定性）"""
+        return self.bypass_nondeterministic and temperature != 0
+
+    def get(self, key: str) -> Optional[Dict]:
+        """读取缓存，不存在时返回 None"""
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            self.hits += 1
+        try:
+            return json.loads(zlib.decompress(row[0]).decode("utf-8"))
+        except Exception as e:
+            print(f"读取LLM缓存时出错: {e}")
+            return None
+
+    def set(self, key: str, value: Dict):
+        """写入缓存，超过大小上限时淘汰最久未访问的条目"""
+        data = zlib.compress(json.dumps(value, ensure_ascii=False).encode("utf-8"))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, data, len(data), time.time())
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        """淘汰最久未访问的条目，直到总大小不超过上限（调用方需持有锁）"""
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_size:
+            return
+        to_delete = []
+        for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY last_access ASC"):
+            to_delete.append((key,))
+            total -= size
+            if total <= self.max_size:
+                break
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", to_delete)
+        print(f"LLM缓存超过上限，已淘汰 {len(to_delete)} 个条目")
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
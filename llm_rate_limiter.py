@@ -0,0 +1,48 @@
+import threading
+import time
+from typing import Dict, List, Union
+
+def estimate_tokens(content: Union[str, List[Dict]]) -> int:
+    """粗略估算文本或消息列表的令牌数
+
+    英文约 4 个字符一个令牌，中日文等非 ASCII 字符约一个字符一个令牌。
+    """
+    if isinstance(content, list):
+        return sum(estimate_tokens(message.get("content") or "") + 4 for message in content)
+    ascii_chars = sum(1 for char in content if ord(char) < 128)
+    return ascii_chars // 4 + (len(content) - ascii_chars) + 1
+
+class TokenRateLimiter:
+    """每分钟令牌数（TPM）限制器，令牌桶实现，可在多个线程间共享"""
+
+    def __init__(self, tokens_per_minute: int):
+        """初始化限制器
+
+        Args:
+            tokens_per_minute: 每分钟允许的令牌数，0 或 None 表示不限制
+        """
+        self.tokens_per_minute = tokens_per_minute or 0
+        self._available = float(self.tokens_per_minute)
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._last_refill
+        self._last_refill = now
+        self._available = min(self.tokens_per_minute, self._available + elapsed * self.tokens_per_minute / 60.0)
+
+    def acquire(self, tokens: int):
+        """获取指定数量的令牌，不足时阻塞等待"""
+        if not self.tokens_per_minute:
+            return
+        # 单个请求超过桶容量时按容量计算，避免永远等待
+        tokens = min(tokens, self.tokens_per_minute)
+        while True:
+            with self._lock:
+                self._refill()
+                if self._available >= tokens:
+                    self._available -= tokens
+                    return
+                wait = (tokens - self._available) * 60.0 / self.tokens_per_minute
+            time.sleep(wait)
@@ -0,0 +1,422 @@
+import json
+import hashlib
+import threading
+import time
+import argparse
+import re
+import uuid
+from email import policy as email_policy
+from email.parser import BytesParser
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse
+from types import SimpleNamespace
+from typing import Dict, List
+from llm_rate_limiter import estimate_tokens
+
+# 生成确定性英文文本时使用的词表
+STUB_WORDS = [
+    "ancient", "village", "misty", "mountain", "river", "lantern", "warrior", "quiet", "golden",
+    "forest", "temple", "market", "shadow", "gentle", "storm", "castle", "road", "evening",
+    "bright", "crowd", "stone", "bridge", "wind", "field", "moon", "smile", "worried", "child"
+]
+
+def _stub_text(seed: str, word_count: int) -> str:
+    """根据种子生成确定性的英文文本"""
+    digest = hashlib.sha256(seed.encode("utf-8")).digest()
+    words = [STUB_WORDS[digest[i % len(digest)] % len(STUB_WORDS)] for i in range(max(1, word_count))]
+    return " ".join(words)
+
+def _extract_json_template(text: str):
+    """提取提示词中的 JSON 模板（优先使用 "Format your response as JSON" 之后第一个完整的 {...} 块）"""
+    marker = text.find("Format your response as JSON")
+    start = text.find("{", max(marker, 0))
+    while start != -1:
+        depth = 0
+        for end in range(start, len(text)):
+            if text[end] == "{":
+                depth += 1
+            elif text[end] == "}":
+                depth -= 1
+                if depth == 0:
+                    try:
+                        return json.loads(text[start:end + 1])
+                    except json.JSONDecodeError:
+                        break
+        start = text.find("{", start + 1)
+    return None
+
+def _fill_template(template, seed: str):
+    """将模板中的字符串值替换为确定性的英文文本，保留结构"""
+    if isinstance(template, dict):
+        return {key: _fill_template(value, f"{seed}/{key}") for key, value in template.items()}
+    if isinstance(template, list):
+        return [_fill_template(value, f"{seed}/{i}") for i, value in enumerate(template)]
+    if isinstance(template, str):
+        return _stub_text(seed, 3 + len(template.split()))
+    return template
+
+def stub_response_content(messages: List[Dict], response_format: Dict = None, max_tokens: int = None) -> str:
+    """根据请求生成确定性的响应内容
+
+    JSON 模式下按提示词中的 JSON 模板返回相同结构的数据，否则返回一段英文描述。
+    未使用 JSON 模式但系统消息要求只返回 JSON 时，模拟本地模型的常见输出：用 markdown 代码块包裹的 JSON。
+    """
+    prompt = messages[-1].get("content", "") if messages else ""
+    seed = hashlib.sha256(json.dumps(messages, ensure_ascii=False).encode("utf-8")).hexdigest()
+    json_mode = bool(response_format and response_format.get("type") == "json_object")
+    json_requested = any(message.get("role") == "system" and "JSON object only" in (message.get("content") or "")
+                         for message in messages)
+    if json_mode or json_requested:
+        template = _extract_json_template(prompt)
+        if template is None:
+            template = {"result": "text"}
+        content = json.dumps(_fill_template(template, seed), ensure_ascii=False)
+        return content if json_mode else f"```json\n{content}\n```"
+    word_count = 40 if max_tokens is None else min(40, int(max_tokens * 0.75))
+    return _stub_text(seed, word_count)
+
+class StubLLMClient:
+    """模拟 OpenAI 客户端的 chat.completions.create 接口
+
+    返回确定性的内容和 usage 信息，并按输出令牌数模拟延迟，用于离线测试和性能测试。
+    """
+
+    def __init__(self, base_latency: float = 0.0, per_token_latency: float = 0.0):
+        """初始化模拟客户端
+
+        Args:
+            base_latency: 每次请求的固定延迟（秒）
+            per_token_latency: 每个输出令牌的额外延迟（秒）
+        """
+        self.base_latency = base_latency
+        self.per_token_latency = per_token_latency
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self._lock = threading.Lock()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, model: str = None, messages: List[Dict] = None, response_format: Dict = None,
+               max_tokens: int = None, **kwargs):
+        """模拟 chat.completions.create"""
+        content = stub_response_content(messages or [], response_format, max_tokens)
+        prompt_tokens = estimate_tokens(messages or [])
+        completion_tokens = estimate_tokens(content)
+
+        delay = self.base_latency + completion_tokens * self.per_token_latency
+        if delay:
+            time.sleep(delay)
+
+        with self._lock:
+            self.calls += 1
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+
+        return SimpleNamespace(
+            model=model,
+            choices=[SimpleNamespace(index=0, finish_reason="stop",
+                                     message=SimpleNamespace(role="assistant", content=content))],
+            usage=SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+                                  total_tokens=prompt_tokens + completion_tokens)
+        )
+
+    def reset_stats(self):
+        with self._lock:
+            self.calls = 0
+            self.prompt_tokens = 0
+            self.completion_tokens = 0
+
+class LLMStubServer:
+    """进程内的 OpenAI 兼容模拟服务器
+
+    实现 /v1/chat/completions、/v1/models 以及批处理使用的 /v1/files 和 /v1/batches 接口。
+    响应内容由 StubLLMClient 生成，可用于测试本地后端配置、批处理模式和离线运行。
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, base_latency: float = 0.0,
+                 per_token_latency: float = 0.0, json_mode: bool = True, model: str = "stub-model",
+                 batch_delay: float = 0.0):
+        """初始化模拟服务器
+
+        Args:
+            host: 监听地址
+            port: 监听端口，0 表示自动分配
+            base_latency: 每次请求的固定延迟（秒）
+            per_token_latency: 每个输出令牌的额外延迟（秒）
+            json_mode: 是否支持 response_format={"type": "json_object"}，为 False 时此类请求返回 400
+            model: /v1/models 返回的模型名称
+            batch_delay: 批处理任务开始执行前的等待时间（秒），用于测试轮询
+        """
+        self.host = host
+        self.port = port
+        self.json_mode = json_mode
+        self.model = model
+        self.batch_delay = batch_delay
+        self.client = StubLLMClient(base_latency, per_token_latency)
+        self.files = {}
+        self.batches = {}
+        self.request_counts = {}
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.port}/v1"
+
+    def start(self):
+        """在后台线程中启动服务器"""
+        stub = self
+
+        class Handler(_LLMStubRequestHandler):
+            server_stub = stub
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        print(f"LLM 模拟服务器已启动: {self.base_url}")
+        return self
+
+    def stop(self):
+        """停止服务器"""
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def _count(self, path):
+        with self._lock:
+            self.request_counts[path] = self.request_counts.get(path, 0) + 1
+
+    def chat_completion(self, request: Dict) -> Dict:
+        """生成 OpenAI 格式的 chat.completion 响应"""
+        response = self.client.create(
+            model=request.get("model"),
+            messages=request.get("messages", []),
+            response_format=request.get("response_format"),
+            max_tokens=request.get("max_tokens")
+        )
+        return {
+            "id": "chatcmpl-" + hashlib.sha256(response.choices[0].message.content.encode("utf-8")).hexdigest()[:24],
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model") or self.model,
+            "choices": [{
+                "index": 0,
+                "finish_reason": "stop",
+                "message": {"role": "assistant", "content": response.choices[0].message.content}
+            }],
+            "usage": {
+                "prompt_tokens": response.usage.prompt_tokens,
+                "completion_tokens": response.usage.completion_tokens,
+                "total_tokens": response.usage.total_tokens
+            }
+        }
+
+    def create_file(self, filename: str, purpose: str, data: bytes) -> Dict:
+        """保存上传的文件"""
+        file_id = f"file-{uuid.uuid4().hex[:24]}"
+        info = {"id": file_id, "object": "file", "bytes": len(data), "created_at": int(time.time()),
+                "filename": filename, "purpose": purpose}
+        with self._lock:
+            self.files[file_id] = {"info": info, "data": data}
+        return info
+
+    def create_batch(self, request: Dict) -> Dict:
+        """创建批处理任务，在后台线程中逐行执行"""
+        batch_id = f"batch_{uuid.uuid4().hex[:24]}"
+        batch = {
+            "id": batch_id,
+            "object": "batch",
+            "endpoint": request.get("endpoint"),
+            "input_file_id": request.get("input_file_id"),
+            "completion_window": request.get("completion_window", "24h"),
+            "status": "validating",
+            "output_file_id": None,
+            "error_file_id": None,
+            "created_at": int(time.time()),
+            "completed_at": None,
+            "request_counts": {"total": 0, "completed": 0, "failed": 0},
+            "metadata": request.get("metadata")
+        }
+        with self._lock:
+            self.batches[batch_id] = batch
+        threading.Thread(target=self._run_batch, args=(batch_id,), daemon=True).start()
+        return dict(batch)
+
+    def _run_batch(self, batch_id: str):
+        if self.batch_delay:
+            time.sleep(self.batch_delay)
+        with self._lock:
+            batch = self.batches[batch_id]
+            batch["status"] = "in_progress"
+            input_file = self.files.get(batch["input_file_id"])
+        if input_file is None:
+            with self._lock:
+                batch["status"] = "failed"
+            return
+
+        outputs = []
+        errors = []
+        for line in input_file["data"].decode("utf-8").splitlines():
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            try:
+                body = self.chat_completion(item["body"])
+                outputs.append({"id": f"batch_req_{uuid.uuid4().hex[:24]}", "custom_id": item.get("custom_id"),
+                                "response": {"status_code": 200, "request_id": body["id"], "body": body},
+                                "error": None})
+            except Exception as e:
+                errors.append({"id": f"batch_req_{uuid.uuid4().hex[:24]}", "custom_id": item.get("custom_id"),
+                               "response": None, "error": {"code": "server_error", "message": str(e)}})
+
+        output_file = self.create_file(f"{batch_id}_output.jsonl", "batch_output",
+                                       "".join(json.dumps(o, ensure_ascii=False) + "\n" for o in outputs).encode("utf-8"))
+        error_file = None
+        if errors:
+            error_file = self.create_file(f"{batch_id}_error.jsonl", "batch_output",
+                                          "".join(json.dumps(e, ensure_ascii=False) + "\n" for e in errors).encode("utf-8"))
+        with self._lock:
+            batch["output_file_id"] = output_file["id"]
+            batch["error_file_id"] = error_file["id"] if error_file else None
+            batch["request_counts"] = {"total": len(outputs) + len(errors), "completed": len(outputs),
+                                       "failed": len(errors)}
+            batch["status"] = "completed"
+            batch["completed_at"] = int(time.time())
+
+def _parse_multipart(content_type: str, body: bytes) -> Dict:
+    """解析 multipart/form-data 请求，返回 {字段名: (文件名, 数据)}"""
+    message = BytesParser(policy=email_policy.HTTP).parsebytes(
+        f"Content-Type: {content_type}\r\n\r\n".encode("utf-8") + body
+    )
+    fields = {}
+    for part in message.iter_parts():
+        name = part.get_param("name", header="content-disposition")
+        fields[name] = (part.get_filename(), part.get_payload(decode=True))
+    return fields
+
+class _LLMStubRequestHandler(BaseHTTPRequestHandler):
+    """LLM 模拟服务器的请求处理器"""
+    server_stub = None
+
+    def log_message(self, format, *args):
+        # 不输出访问日志
+        pass
+
+    def _send_json(self, data, status=200):
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, message, status):
+        self._send_json({"error": {"message": message, "type": "invalid_request_error"}}, status=status)
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _route(self):
+        path = urlparse(self.path).path.rstrip("/")
+        self.server_stub._count(re.sub(r"^/v1/(files|batches)/[^/]+", r"/v1/\1/{id}", path))
+        return path
+
+    def do_GET(self):
+        stub = self.server_stub
+        path = self._route()
+        if path == "/v1/models":
+            self._send_json({"object": "list", "data": [{"id": stub.model, "object": "model", "owned_by": "stub"}]})
+            return
+
+        match = re.match(r"^/v1/files/([^/]+)(/content)?$", path)
+        if match:
+            with stub._lock:
+                stored = stub.files.get(match.group(1))
+            if stored is None:
+                self._send_error("No such file", 404)
+            elif match.group(2):
+                self.send_response(200)
+                self.send_header("Content-Type", "application/octet-stream")
+                self.send_header("Content-Length", str(len(stored["data"])))
+                self.end_headers()
+                self.wfile.write(stored["data"])
+            else:
+                self._send_json(stored["info"])
+            return
+
+        match = re.match(r"^/v1/batches/([^/]+)$", path)
+        if match:
+            with stub._lock:
+                batch = stub.batches.get(match.group(1))
+                batch = dict(batch) if batch else None
+            if batch is None:
+                self._send_error("No such batch", 404)
+            else:
+                self._send_json(batch)
+            return
+
+        self._send_error("Not Found", 404)
+
+    def do_POST(self):
+        stub = self.server_stub
+        path = self._route()
+        body = self._read_body()
+
+        if path == "/v1/files":
+            fields = _parse_multipart(self.headers.get("Content-Type", ""), body)
+            if "file" not in fields:
+                self._send_error("file is required", 400)
+                return
+            filename, data = fields["file"]
+            purpose = (fields.get("purpose") or (None, b""))[1].decode("utf-8")
+            self._send_json(stub.create_file(filename or "upload.jsonl", purpose, data))
+            return
+
+        try:
+            request = json.loads(body.decode("utf-8")) if body else {}
+        except Exception:
+            self._send_error("invalid JSON body", 400)
+            return
+
+        if path == "/v1/batches":
+            if request.get("input_file_id") not in stub.files:
+                self._send_error("input_file_id not found", 400)
+                return
+            self._send_json(stub.create_batch(request))
+        elif path == "/v1/chat/completions":
+            response_format = request.get("response_format") or {}
+            if response_format.get("type") == "json_object" and not stub.json_mode:
+                self._send_error("response_format is not supported", 400)
+                return
+            self._send_json(stub.chat_completion(request))
+        else:
+            self._send_error("Not Found", 404)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="启动 OpenAI 兼容的 LLM 模拟服务器")
+    parser.add_argument("--host", default="127.0.0.1", help="监听地址")
+    parser.add_argument("--port", type=int, default=8080, help="监听端口")
+    parser.add_argument("--latency", type=float, default=0.0, help="每次请求的固定延迟（秒）")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="每个输出令牌的额外延迟（秒）")
+    parser.add_argument("--no-json-mode", action="store_true", help="模拟不支持 JSON 模式的服务器")
+    parser.add_argument("--batch-delay", type=float, default=0.0, help="批处理任务开始执行前的等待时间（秒）")
+    args = parser.parse_args()
+
+    server = LLMStubServer(args.host, args.port, base_latency=args.latency, per_token_latency=args.token_latency,
+                           json_mode=not args.no_json_mode, batch_delay=args.batch_delay).start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.stop()
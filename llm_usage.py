@@ -0,0 +1,107 @@
+import threading
+from typing import Dict
+
+# 每百万令牌的价格（美元）：(输入, 输出)
+MODEL_PRICES = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+}
+
+class LLMUsageTracker:
+    """LLM 调用的令牌、耗时和缓存命中统计，按阶段（提示词模板）汇总，可在多个线程间共享"""
+
+    def __init__(self, model: str = None):
+        """初始化统计
+
+        Args:
+            model: 模型名称，用于估算费用（不在 MODEL_PRICES 中时不计算费用）
+        """
+        self.model = model
+        self.stages = {}
+        self.calls = []  # 每次调用的提示词大小（系统消息和用户消息的令牌数）
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, prompt_tokens: int = 0, completion_tokens: int = 0, latency: float = 0.0,
+               cache_hit: bool = False, cached_prompt_tokens: int = 0, prompt_size: Dict[str, int] = None):
+        """记录一次调用，缓存命中时令牌数为节省的令牌数（不计入消耗）
+
+        Args:
+            cached_prompt_tokens: 输入令牌中命中服务端前缀缓存的部分（OpenAI 的 prompt_tokens_details.cached_tokens）
+            prompt_size: 本次调用的提示词大小 {"system": ..., "user": ..., "total": ...}（ScenePromptBuilder.prompt_size）
+        """
+        with self._lock:
+            if prompt_size is not None:
+                self.calls.append({"stage": stage, "cache_hit": cache_hit, **prompt_size})
+            stats = self.stages.setdefault(stage, {
+                "calls": 0,
+                "cache_hits": 0,
+                "prompt_tokens": 0,
+                "completion_tokens": 0,
+                "cached_prompt_tokens": 0,
+                "max_prompt_tokens": 0,
+                "saved_tokens": 0,
+                "latency": 0.0
+            })
+            stats["calls"] += 1
+            stats["latency"] += latency
+            if cache_hit:
+                stats["cache_hits"] += 1
+                stats["saved_tokens"] += prompt_tokens + completion_tokens
+            else:
+                stats["prompt_tokens"] += prompt_tokens
+                stats["completion_tokens"] += completion_tokens
+                stats["cached_prompt_tokens"] += cached_prompt_tokens
+                stats["max_prompt_tokens"] = max(stats["max_prompt_tokens"], prompt_tokens)
+
+    def _cost(self, prompt_tokens: int, completion_tokens: int):
+        prices = MODEL_PRICES.get(self.model)
+        if prices is None:
+            return None
+        return round((prompt_tokens * prices[0] + completion_tokens * prices[1]) / 1_000_000, 6)
+
+    @staticmethod
+    def _average_prompt_tokens(stats: Dict) -> int:
+        requests = stats["calls"] - stats["cache_hits"]
+        return round(stats["prompt_tokens"] / requests) if requests else 0
+
+    def summary(self) -> Dict:
+        """返回按阶段汇总的统计和总计，avg_prompt_tokens 为每次实际请求的平均输入令牌数（提示词大小）"""
+        with self._lock:
+            stages = {stage: dict(stats) for stage, stats in self.stages.items()}
+            calls = [dict(call) for call in self.calls]
+
+        total = {"calls": 0, "cache_hits": 0, "prompt_tokens": 0, "completion_tokens": 0, "cached_prompt_tokens": 0,
+                 "saved_tokens": 0, "latency": 0.0}
+        for stats in stages.values():
+            for key in total:
+                total[key] += stats[key]
+            stats["latency"] = round(stats["latency"], 3)
+            stats["avg_prompt_tokens"] = self._average_prompt_tokens(stats)
+            stats["cost_usd"] = self._cost(stats["prompt_tokens"], stats["completion_tokens"])
+        total["latency"] = round(total["latency"], 3)
+        total["avg_prompt_tokens"] = self._average_prompt_tokens(total)
+        total["max_prompt_tokens"] = max([stats["max_prompt_tokens"] for stats in stages.values()], default=0)
+        total["cost_usd"] = self._cost(total["prompt_tokens"], total["completion_tokens"])
+        return {"model": self.model, "stages": stages, "total": total, "calls": calls}
+
+    def print_summary(self):
+        """打印各阶段的统计，按令牌消耗从多到少排列"""
+        summary = self.summary()
+        stages = sorted(summary["stages"].items(),
+                        key=lambda item: item[1]["prompt_tokens"] + item[1]["completion_tokens"], reverse=True)
+        print(f"\nLLM调用统计 (模型: {summary['model']})")
+        print(f"  {'阶段':<28}{'调用':>6}{'缓存':>6}{'输入令牌':>10}{'输出令牌':>10}{'平均输入':>10}{'最大输入':>10}"
+              f"{'耗时(秒)':>10}")
+        for stage, stats in stages + [("total", summary["total"])]:
+            print(f"  {stage:<28}{stats['calls']:>6}{stats['cache_hits']:>6}{stats['prompt_tokens']:>10}"
+                  f"{stats['completion_tokens']:>10}{stats['avg_prompt_tokens']:>10}{stats['max_prompt_tokens']:>10}"
+                  f"{stats['latency']:>10.2f}")
+        if summary["total"]["cached_prompt_tokens"]:
+            print(f"  服务端前缀缓存命中的输入令牌: {summary['total']['cached_prompt_tokens']}")
+        if summary["total"]["cost_usd"] is not None:
+            print(f"  估算费用: ${summary['total']['cost_usd']:.4f} (缓存节省令牌: {summary['total']['saved_tokens']})")
+
+    def reset(self):
+        with self._lock:
+            self.stages = {}
+            self.calls = []
@@ -1,13 +1,22 @@
 import json
 import requests
 import os
+import uuid
+import hashlib
 from pathlib import Path
+from aho_corasick import AhoCorasick
+
+# 不单独计为音拍的小写假名
+SMALL_KANA = set("ァィゥェォャュョヮ")
 
 class PronunciationDictionary:
     def __init__(self, host="127.0.0.1", port="50021", dict_file="dictionaries/voicevox_dict.json"):
         """初始化发音词典管理器"""
         self.base_url = f"http://{host}:{port}"
         self.dict_file = dict_file
+        # 记录上次同步时两侧词典状态的指纹文件
+        self.fingerprint_file = f"{os.path.splitext(dict_file)[0]}.fingerprint.json"
+        self.engine_version = None
         
         # 确保字典文件目录存在
         Path(os.path.dirname(dict_file)).mkdir(parents=True, exist_ok=True)
@@ -27,16 +36,18 @@ class PronunciationDictionary:
             return {}
     
     def save_local_dictionary(self, dictionary):
-        """保存词典到本地文件"""
+        """保存词典到本地文件（先写入临时文件再替换，避免中断时损坏词典）"""
         try:
-            with open(self.dict_file, "w", encoding="utf-8") as f:
+            temp_file = f"{self.dict_file}.tmp"
+            with open(temp_file, "w", encoding="utf-8") as f:
                 json.dump(dictionary, f, ensure_ascii=False, indent=2)
+            os.replace(temp_file, self.dict_file)
             print(f"词典已保存到: {self.dict_file}")
         except Exception as e:
             print(f"保存词典时出错: {e}")
     
     def get_voicevox_dictionary(self):
-        """获取VOICEVOX当前的用户词典"""
+        """获取VOICEVOX当前的用户词典，无法获取时返回 None"""
         try:
             response = requests.get(f"{self.base_url}/user_dict")
             if response.status_code == 200:
@@ -44,14 +55,95 @@ class PronunciationDictionary:
                 return json.loads(response.text)
             else:
                 print(f"获取VOICEVOX词典失败: {response.text}")
-                return {}
+                return None
         except Exception as e:
             print(f"获取VOICEVOX词典时出错: {e}")
             import traceback
             traceback.print_exc()  # 打印详细错误信息
-            return {}
+            return None
+    
+    def get_engine_version(self):
+        """获取VOICEVOX引擎版本，失败时返回 None"""
+        try:
+            response = requests.get(f"{self.base_url}/version")
+            if response.status_code == 200:
+                return response.json()
+        except Exception as e:
+            print(f"获取VOICEVOX版本时出错: {e}")
+        return None
+    
+    @staticmethod
+    def _hash_data(data):
+        """计算数据的稳定哈希值"""
+        content = json.dumps(data, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()[:16]
+    
+    def _local_hash(self):
+        """本地词典条目（含UUID）的哈希值"""
+        return self._hash_data(self.local_dict)
+    
+    def _engine_hash(self, voicevox_dict):
+        """VOICEVOX词典条目的哈希值，只考虑影响发音的字段"""
+        return self._hash_data({
+            word_uuid: [word.get("surface"), word.get("pronunciation"), word.get("accent_type")]
+            for word_uuid, word in voicevox_dict.items()
+        })
+    
+    def load_fingerprint(self):
+        """读取上次同步时保存的指纹"""
+        try:
+            if os.path.exists(self.fingerprint_file):
+                with open(self.fingerprint_file, "r", encoding="utf-8") as f:
+                    return json.load(f)
+        except Exception as e:
+            print(f"读取词典指纹时出错: {e}")
+        return {}
     
-    def add_word(self, surface, pronunciation, accent_type=0):
+    def save_fingerprint(self, voicevox_dict):
+        """保存当前两侧词典状态的指纹"""
+        fingerprint = {
+            "local_hash": self._local_hash(),
+            "engine_hash": self._engine_hash(voicevox_dict),
+            "engine_version": self.engine_version
+        }
+        try:
+            with open(self.fingerprint_file, "w", encoding="utf-8") as f:
+                json.dump(fingerprint, f, ensure_ascii=False, indent=2)
+        except Exception as e:
+            print(f"保存词典指纹时出错: {e}")
+        return fingerprint
+    
+    def get_fingerprint(self):
+        """获取词典指纹，用于判断已生成的音频是否需要重新合成
+        
+        只包含影响发音的内容（词语、读音、重音）和引擎版本，与UUID无关。
+        """
+        if self.engine_version is None:
+            self.engine_version = self.get_engine_version()
+        return self._hash_data({
+            "entries": {
+                surface: [info.get("pronunciation"), info.get("accent_type", 0)]
+                for surface, info in self.local_dict.items()
+            },
+            "engine_version": self.engine_version
+        })
+    
+    def get_entries_in_texts(self, texts):
+        """找出在给定文本中出现的词典条目
+        
+        Returns:
+            dict: {surface: [pronunciation, accent_type]}
+        """
+        matcher = AhoCorasick(self.local_dict.keys())
+        surfaces = set()
+        for text in texts:
+            surfaces |= matcher.find_values(text)
+        return {
+            surface: [self.local_dict[surface].get("pronunciation"), self.local_dict[surface].get("accent_type", 0)]
+            for surface in surfaces
+        }
+    
+    def add_word(self, surface, pronunciation, accent_type=0, save=True):
         """添加单词到VOICEVOX词典"""
         try:
             # 使用查询参数而不是JSON请求体
@@ -90,7 +182,8 @@ class PronunciationDictionary:
                     "accent_type": accent_type,
                     "uuid": word_uuid
                 }
-                self.save_local_dictionary(self.local_dict)
+                if save:
+                    self.save_local_dictionary(self.local_dict)
                 
                 return word_uuid
             else:
@@ -102,6 +195,79 @@ class PronunciationDictionary:
             traceback.print_exc()  # 打印详细错误信息
             return None
     
+    def _build_user_dict_word(self, surface, pronunciation, accent_type=0, priority=5):
+        """构建 /import_user_dict 所需的完整词典条目"""
+        mora_count = len([c for c in pronunciation if c not in SMALL_KANA])
+        return {
+            "surface": surface,
+            "priority": priority,
+            "context_id": 1348,
+            "part_of_speech": "名詞",
+            "part_of_speech_detail_1": "固有名詞",
+            "part_of_speech_detail_2": "一般",
+            "part_of_speech_detail_3": "*",
+            "inflectional_type": "*",
+            "inflectional_form": "*",
+            "stem": "*",
+            "yomi": pronunciation,
+            "pronunciation": pronunciation,
+            "accent_type": accent_type,
+            "mora_count": mora_count,
+            "accent_associative_rule": "*"
+        }
+    
+    def add_words(self, entries):
+        """批量添加单词：一次 /import_user_dict 请求提交所有条目，本地词典只保存一次
+        
+        Args:
+            entries: {surface: (pronunciation, accent_type)} 形式的字典
+            
+        Returns:
+            int: 成功添加的条目数
+        """
+        if not entries:
+            return 0
+        
+        # 已存在的词语沿用原来的UUID，覆盖导入时不会产生重复条目
+        payload = {}
+        uuids = {}
+        for surface, (pronunciation, accent_type) in entries.items():
+            word_uuid = self.local_dict.get(surface, {}).get("uuid") or str(uuid.uuid4())
+            uuids[surface] = word_uuid
+            payload[word_uuid] = self._build_user_dict_word(surface, pronunciation, accent_type)
+        
+        try:
+            response = requests.post(
+                f"{self.base_url}/import_user_dict",
+                params={"override": "true"},
+                json=payload
+            )
+            imported = response.status_code in (200, 204)
+            if not imported:
+                print(f"批量导入词典失败: {response.text}，改为逐条添加")
+        except Exception as e:
+            print(f"批量导入词典时出错: {e}，改为逐条添加")
+            imported = False
+        
+        if imported:
+            for surface, (pronunciation, accent_type) in entries.items():
+                self.local_dict[surface] = {
+                    "pronunciation": pronunciation,
+                    "accent_type": accent_type,
+                    "uuid": uuids[surface]
+                }
+            success_count = len(entries)
+            print(f"已批量导入 {success_count} 个词典条目")
+        else:
+            # 旧版本引擎不支持导入时逐条添加，但只在最后保存一次
+            success_count = 0
+            for surface, (pronunciation, accent_type) in entries.items():
+                if self.add_word(surface, pronunciation, accent_type, save=False):
+                    success_count += 1
+        
+        self.save_local_dictionary(self.local_dict)
+        return success_count
+    
     def remove_word(self, surface):
         """从VOICEVOX词典中删除单词"""
         if surface in self.local_dict and "uuid" in self.local_dict[surface]:
@@ -125,9 +291,28 @@ class PronunciationDictionary:
             return False
     
     def sync_with_voicevox(self):
-        """同步本地词典和VOICEVOX词典"""
+        """同步本地词典和VOICEVOX词典
+        
+        两侧词典与上次同步时的指纹一致时直接跳过，不重写本地文件。
+        只有获取到引擎词典且缺失的条目全部添加成功后才保存指纹，否则下次运行会重新同步。
+        
+        Returns:
+            bool: 是否执行了实际的同步
+        """
         # 获取VOICEVOX当前词典
         voicevox_dict = self.get_voicevox_dictionary()
+        if voicevox_dict is None:
+            print("无法获取VOICEVOX词典，跳过同步")
+            return False
+        self.engine_version = self.get_engine_version()
+        
+        # 比较指纹，两侧都未变化时跳过同步
+        stored = self.load_fingerprint()
+        if (stored.get("local_hash") == self._local_hash() and
+                stored.get("engine_hash") == self._engine_hash(voicevox_dict) and
+                stored.get("engine_version") == self.engine_version):
+            print("词典未变化，跳过同步")
+            return False
         
         # 创建UUID到单词的映射
         uuid_to_word = {}
@@ -144,19 +329,25 @@ class PronunciationDictionary:
                 }
         
         # 检查本地词典中是否有VOICEVOX中不存在的条目
+        missing = {}
         for surface, word_info in list(self.local_dict.items()):
             if "uuid" in word_info and word_info["uuid"] not in uuid_to_word:
-                # 重新添加到VOICEVOX
                 print(f"重新添加词典条目: {surface}")
-                self.add_word(
-                    surface,
-                    word_info["pronunciation"],
-                    word_info["accent_type"]
-                )
+                missing[surface] = (word_info["pronunciation"], word_info.get("accent_type", 0))
         
-        # 保存更新后的本地词典
-        self.save_local_dictionary(self.local_dict)
+        # 重新添加到VOICEVOX（批量导入会保存本地词典）
+        if missing:
+            added = self.add_words(missing)
+            voicevox_dict = self.get_voicevox_dictionary()
+            if added < len(missing) or voicevox_dict is None:
+                print(f"词典同步未完成（{added}/{len(missing)} 个条目已添加），不保存指纹")
+                return True
+        else:
+            self.save_local_dictionary(self.local_dict)
+        
+        self.save_fingerprint(voicevox_dict)
         print("词典同步完成")
+        return True
     
     def import_from_file(self, file_path):
         """从JSON文件导入词典"""
@@ -164,7 +355,7 @@ class PronunciationDictionary:
             with open(file_path, "r", encoding="utf-8") as f:
                 import_dict = json.load(f)
             
-            success_count = 0
+            entries = {}
             for surface, word_info in import_dict.items():
                 if isinstance(word_info, dict) and "pronunciation" in word_info:
                     # 新格式: {"word": {"pronunciation": "...", "accent_type": 0}}
@@ -174,9 +365,9 @@ class PronunciationDictionary:
                     # 旧格式: {"word": "pronunciation"}
                     pronunciation = word_info
                     accent_type = 0
-                
-                if self.add_word(surface, pronunciation, accent_type):
-                    success_count += 1
+                entries[surface] = (pronunciation, accent_type)
+            
+            success_count = self.add_words(entries)
             
             print(f"成功导入 {success_count}/{len(import_dict)} 个词典条目")
             return success_count
@@ -211,10 +402,9 @@ class PronunciationDictionary:
        
         }
         
-        success_count = 0
-        for surface, pronunciation in corrections.items():
-            if self.add_word(surface, pronunciation):
-                success_count += 1
+        success_count = self.add_words({
+            surface: (pronunciation, 0) for surface, pronunciation in corrections.items()
+        })
         
         print(f"成功添加 {success_count}/{len(corrections)} 个常见发音纠正")
         return success_count
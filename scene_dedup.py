@@ -0,0 +1,80 @@
+import re
+import random
+import zlib
+from typing import Dict, List
+
+# 相似度超过阈值的场景共用图像
+DEFAULT_THRESHOLD = 0.6
+# 只与前面若干个场景比较（相邻场景才可能是同一画面）
+DEFAULT_WINDOW = 2
+# MinHash 签名长度
+NUM_PERM = 64
+# 出现在超过该比例场景中的词（例如统一的文化背景、画风）不参与比较
+COMMON_TOKEN_RATIO = 0.8
+
+_PRIME = (1 << 61) - 1
+_rng = random.Random(20240601)
+_PERMUTATIONS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_PERM)]
+
+STOPWORDS = {
+    "a", "an", "the", "and", "or", "of", "in", "on", "at", "to", "with", "by", "for", "from", "is", "are",
+    "his", "her", "their", "its", "as", "into", "while", "high", "quality", "detailed"
+}
+
+def prompt_tokens(prompt: str) -> set:
+    """将提示词转换为词和相邻词对的集合"""
+    words = [word for word in re.findall(r"[a-z]+", prompt.lower()) if word not in STOPWORDS]
+    return set(words) | {f"{a} {b}" for a, b in zip(words, words[1:])}
+
+def minhash_signature(tokens: set) -> List[int]:
+    """计算 MinHash 签名"""
+    if not tokens:
+        return [_PRIME] * NUM_PERM
+    hashes = [zlib.crc32(token.encode("utf-8")) for token in tokens]
+    return [min((a * h + b) % _PRIME for h in hashes) for a, b in _PERMUTATIONS]
+
+def estimate_similarity(signature1: List[int], signature2: List[int]) -> float:
+    """用签名估算两个集合的 Jaccard 相似度"""
+    return sum(1 for x, y in zip(signature1, signature2) if x == y) / len(signature1)
+
+def mark_duplicate_scenes(scenes: List[Dict], threshold: float = DEFAULT_THRESHOLD,
+                          window: int = DEFAULT_WINDOW) -> int:
+    """找出与前面相邻场景几乎相同的场景，让它们共用同一张图像
+
+    被判定为重复的场景会加上 "reuse_of"（原场景的 scene_id），并把 "image_file" 改为原场景的图像文件。
+
+    Args:
+        scenes: 已生成提示词的场景列表
+        threshold: 相似度阈值（0-1）
+        window: 与前面多少个场景比较
+
+    Returns:
+        int: 共用图像的场景数
+    """
+    token_sets = [prompt_tokens(scene.get("prompt", "")) for scene in scenes]
+
+    # 去掉几乎所有场景都有的词，否则统一的背景描述会让所有场景都很相似
+    if len(scenes) > 2:
+        counts = {}
+        for tokens in token_sets:
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+        common = {token for token, count in counts.items() if count > COMMON_TOKEN_RATIO * len(scenes)}
+        token_sets = [tokens - common for tokens in token_sets]
+
+    signatures = [minhash_signature(tokens) for tokens in token_sets]
+    reused = 0
+    for i, scene in enumerate(scenes):
+        scene.pop("reuse_of", None)
+        if not token_sets[i]:
+            continue
+        for j in range(i - 1, max(-1, i - 1 - window), -1):
+            if not token_sets[j] or estimate_similarity(signatures[i], signatures[j]) < threshold:
+                continue
+            # 指向最初生成图像的场景
+            original = scenes[j]
+            scene["reuse_of"] = original.get("reuse_of", original["scene_id"])
+            scene["image_file"] = original["image_file"]
+            reused += 1
+            break
+    return reused
@@ -0,0 +1,245 @@
+import re
+import json
+import threading
+from typing import Dict, List, Tuple
+from llm_rate_limiter import estimate_tokens
+
+# tiktoken 为可选依赖，未安装时使用 estimate_tokens 估算令牌数
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# 场景描述的生成要求（两次调用模式、单次调用模式和批量模式共用）
+SCENE_DESCRIPTION_GUIDELINES = """FOCUS ON THESE ELEMENTS BASED ON THE CONTEXT:
+            1. GRAND SCENES - For large-scale events, battles, or crowd scenes, focus on the overall atmosphere, scale, and environment (e.g., "vast battlefield with thousands of soldiers", "crowded marketplace bustling with activity")
+            2. LANDSCAPE & ENVIRONMENT - Describe natural or architectural elements that define the scene (e.g., "towering castle against stormy sky", "sunlight filtering through ancient forest")
+            3. ATMOSPHERIC ELEMENTS - Include lighting, weather, time of day that create mood (e.g., "golden sunset casting long shadows", "misty morning shrouding the mountains")
+            4. SPECIFIC CHARACTER EXPRESSIONS - When focusing on individuals, include detailed facial expressions (e.g., "determined gaze", "furrowed brow")
+            5. PRECISE BODY LANGUAGE - For character-focused scenes, describe exact poses and gestures (e.g., "hand firmly gripping sword")
+            6. DYNAMIC ACTIONS - Show movement and energy appropriate to the scene (e.g., "armies clashing on blood-soaked field", "dancers twirling across marble floor")
+
+            Format as: "[Setting/Environment], [Scale and Atmosphere], [Character elements or crowd dynamics if relevant]"
+
+            Use 40-50 words maximum. Focus on visually striking and emotionally resonant elements.
+            Your response must be in English only.
+            IMPORTANT: DO NOT include any character names in your description."""
+
+SCENE_DESCRIPTION_SYSTEM_PROMPT = "You are a scene description generator that balances grand scenes with character details. Adapt your focus based on the context - for battles, crowds, or landscapes, emphasize the environment and scale; for intimate moments, focus on character details. Always respond in English only."
+
+# 场景原文、前一场景和每个角色描述的默认令牌上限
+DEFAULT_CONTEXT_TOKENS = 300
+DEFAULT_PREVIOUS_TOKENS = 60
+DEFAULT_CHARACTER_TOKENS = 60
+
+# 截断时追加的标记
+TRUNCATION_MARK = "…"
+
+def _compact(text: str) -> str:
+    """去掉多行字符串中每行的缩进（缩进同样消耗令牌）"""
+    return re.sub(r"\n[ \t]+", "\n", text.strip())
+
+_SETTING_INSTRUCTIONS = """Every description should reflect the culture, location, time period and visual style given with the scene.
+Character information describes the characters appearing in the scene (DO NOT use character names, only describe their roles and appearances)."""
+
+# 固定说明只放在系统消息中：每次请求完全相同，便于服务端前缀缓存，用户消息只包含场景本身
+DESCRIBE_SCENE_SYSTEM_MESSAGE = "\n\n".join([
+    SCENE_DESCRIPTION_SYSTEM_PROMPT,
+    "Create a DETAILED visual scene description based on the given text.",
+    _SETTING_INSTRUCTIONS,
+    _compact(SCENE_DESCRIPTION_GUIDELINES)
+])
+
+SINGLE_CALL_SYSTEM_MESSAGE = "\n\n".join([
+    SCENE_DESCRIPTION_SYSTEM_PROMPT + " Always return valid JSON.",
+    "The story text may be in any language. Understand it in its original language and "
+    "create a DETAILED visual scene description IN ENGLISH based on it.",
+    _SETTING_INSTRUCTIONS,
+    _compact(SCENE_DESCRIPTION_GUIDELINES)
+])
+
+BATCH_SYSTEM_MESSAGE = "\n\n".join([
+    SCENE_DESCRIPTION_SYSTEM_PROMPT + " Always return valid JSON.",
+    _compact("""Create a DETAILED visual scene description IN ENGLISH for EACH of the given scenes.
+        The scene texts may be in any language; understand them in their original language.
+        "previous" is the end of the preceding scene, given only for continuity - do not describe it.
+        "characters" lists the ids of the characters appearing in that scene; their descriptions are given once under "Characters"."""),
+    _SETTING_INSTRUCTIONS,
+    "Requirements for each description:\n" + _compact(SCENE_DESCRIPTION_GUIDELINES)
+])
+
+_encodings = {}
+_encodings_lock = threading.Lock()
+
+def _get_encoding(model: str = None):
+    """获取模型对应的 tiktoken 编码，不可用时返回 None"""
+    if tiktoken is None:
+        return None
+    with _encodings_lock:
+        if model not in _encodings:
+            try:
+                try:
+                    _encodings[model] = tiktoken.encoding_for_model(model or "gpt-4o-mini")
+                except KeyError:
+                    # 本地模型等未知模型使用 gpt-4o 系列的编码近似
+                    _encodings[model] = tiktoken.get_encoding("o200k_base")
+            except Exception as e:
+                # 编码文件需要下载，离线时可能失败
+                print(f"加载 tiktoken 编码失败，改用估算: {e}")
+                _encodings[model] = None
+        return _encodings[model]
+
+def count_tokens(text: str, model: str = None) -> int:
+    """计算文本的令牌数，有 tiktoken 时精确计算，否则估算"""
+    if not text:
+        return 0
+    encoding = _get_encoding(model)
+    if encoding is None:
+        return estimate_tokens(text)
+    return len(encoding.encode(text))
+
+def truncate_tokens(text: str, max_tokens: int, model: str = None, keep_end: bool = False) -> str:
+    """将文本截断到令牌上限以内
+
+    Args:
+        text: 文本
+        max_tokens: 令牌上限，0 或 None 表示不截断
+        model: 模型名称，用于选择 tiktoken 编码
+        keep_end: 为 True 时保留末尾（例如前一场景的最后几句），否则保留开头
+    """
+    if not text or not max_tokens or count_tokens(text, model) <= max_tokens:
+        return text
+
+    encoding = _get_encoding(model)
+    if encoding is not None:
+        tokens = encoding.encode(text)
+        kept = tokens[-max_tokens:] if keep_end else tokens[:max_tokens]
+        text = encoding.decode(kept)
+    else:
+        # 二分查找不超过上限的最长字符数
+        low, high = 0, len(text)
+        while low < high:
+            middle = (low + high + 1) // 2
+            part = text[-middle:] if keep_end else text[:middle]
+            if estimate_tokens(part) <= max_tokens:
+                low = middle
+            else:
+                high = middle - 1
+        text = text[-low:] if keep_end else text[:low]
+    return TRUNCATION_MARK + text if keep_end else text + TRUNCATION_MARK
+
+class ScenePromptBuilder:
+    """构建场景描述请求的消息
+
+    固定的说明和生成要求放在每次相同的系统消息中，用户消息只包含场景文本、背景和角色信息，
+    并按令牌预算截断，批量请求中相同的角色描述只出现一次。
+    """
+
+    def __init__(self, model: str = None, context_tokens: int = DEFAULT_CONTEXT_TOKENS,
+                 previous_tokens: int = DEFAULT_PREVIOUS_TOKENS, character_tokens: int = DEFAULT_CHARACTER_TOKENS):
+        """初始化构建器
+
+        Args:
+            model: 模型名称，用于选择 tiktoken 编码
+            context_tokens: 场景原文的令牌上限
+            previous_tokens: 前一场景（连续性参考）的令牌上限
+            character_tokens: 每个角色描述的令牌上限
+        """
+        self.model = model
+        self.context_tokens = context_tokens
+        self.previous_tokens = previous_tokens
+        self.character_tokens = character_tokens
+
+    def count_tokens(self, text: str) -> int:
+        return count_tokens(text, self.model)
+
+    def prompt_size(self, messages: List[Dict]) -> Dict[str, int]:
+        """计算消息的令牌数：{"system": ..., "user": ..., "total": ...}"""
+        size = {"system": 0, "user": 0}
+        for message in messages:
+            role = "system" if message.get("role") == "system" else "user"
+            size[role] += self.count_tokens(message.get("content") or "")
+        size["total"] = size["system"] + size["user"]
+        return size
+
+    def compress_context(self, context: str) -> str:
+        return truncate_tokens(context, self.context_tokens, self.model)
+
+    def compress_previous(self, previous: str) -> str:
+        return truncate_tokens(previous, self.previous_tokens, self.model, keep_end=True)
+
+    def compress_characters(self, character_descriptions: List[str]) -> List[str]:
+        return [truncate_tokens(description, self.character_tokens, self.model)
+                for description in character_descriptions]
+
+    def _setting_lines(self, setting: Tuple[str, str, str, str]) -> str:
+        culture, location, era, style = setting
+        return f"Culture: {culture}\nLocation: {location}\nTime period: {era}\nVisual style: {style}"
+
+    def _scene_message(self, context: str, setting: Tuple[str, str, str, str],
+                       character_descriptions: List[str]) -> str:
+        parts = [f'Text:\n"{self.compress_context(context)}"', self._setting_lines(setting)]
+        characters = "; ".join(self.compress_characters(character_descriptions))
+        if characters:
+            parts.append(f"Characters: {characters}")
+        return "\n\n".join(parts)
+
+    def describe_scene(self, context: str, setting: Tuple[str, str, str, str],
+                       character_descriptions: List[str]) -> List[Dict]:
+        """两次调用模式：根据英语场景文本生成描述"""
+        return [
+            {"role": "system", "content": DESCRIBE_SCENE_SYSTEM_MESSAGE},
+            {"role": "user", "content": self._scene_message(context, setting, character_descriptions)}
+        ]
+
+    def describe_scene_single_call(self, context: str, setting: Tuple[str, str, str, str],
+                                   character_descriptions: List[str]) -> List[Dict]:
+        """单次调用模式：直接从原文生成英语描述（JSON）"""
+        content = self._scene_message(context, setting, character_descriptions)
+        content += '\n\nFormat your response as JSON:\n{"scene": "English scene description"}'
+        return [
+            {"role": "system", "content": SINGLE_CALL_SYSTEM_MESSAGE},
+            {"role": "user", "content": content}
+        ]
+
+    def describe_scene_batch(self, scenes: List[Dict], setting: Tuple[str, str, str, str]) -> List[Dict]:
+        """批量模式：一个请求描述多个场景（JSON）
+
+        Args:
+            scenes: [{"scene_id": ..., "text": ..., "previous": ..., "characters": [角色描述, ...]}]
+            setting: (文化, 地点, 时代, 风格)
+        """
+        character_ids = {}
+        scene_items = []
+        for scene in scenes:
+            item = {"scene_id": scene["scene_id"], "text": self.compress_context(scene["text"])}
+            if scene.get("previous"):
+                item["previous"] = self.compress_previous(scene["previous"])
+            ids = []
+            for description in scene.get("characters") or []:
+                ids.append(character_ids.setdefault(description, f"C{len(character_ids) + 1}"))
+            if ids:
+                item["characters"] = ids
+            scene_items.append(item)
+
+        characters = {character_id: description for description, character_id in
+                      zip(self.compress_characters(list(character_ids)), character_ids.values())}
+        response_template = json.dumps(
+            {"scenes": {str(scene["scene_id"]): "English scene description" for scene in scenes}},
+            ensure_ascii=False
+        )
+        parts = [self._setting_lines(setting)]
+        if characters:
+            parts.append(f"Characters:\n{json.dumps(characters, ensure_ascii=False)}")
+        parts.append(f"Scenes:\n{json.dumps(scene_items, ensure_ascii=False)}")
+        parts.append(f"Format your response as JSON:\n{response_template}")
+        return [
+            {"role": "system", "content": BATCH_SYSTEM_MESSAGE},
+            {"role": "user", "content": "\n\n".join(parts)}
+        ]
+
+    def estimate_scene_tokens(self, text: str, previous: str, character_descriptions: List[str]) -> int:
+        """估算一个场景在批量请求中占用的输入令牌数（截断后）"""
+        return (self.count_tokens(self.compress_context(text)) +
+                self.count_tokens(self.compress_previous(previous)) +
+                sum(self.count_tokens(description) for description in self.compress_characters(character_descriptions)))
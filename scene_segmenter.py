@@ -0,0 +1,132 @@
+from typing import List, Optional, Tuple
+
+# 在不同位置切分场景的代价
+BASE_CUT_COST = 0.5        # 普通句子之间
+PARAGRAPH_CUT_COST = 0.0   # 段落之间（最自然的切分点）
+DIALOG_CUT_COST = 1.5      # 连续的对话之间（尽量不打断对话）
+
+# 场景时长偏离理想时长的代价权重
+LENGTH_WEIGHT = 1.0
+# 场景短于最短时长时的额外代价权重
+SHORT_SCENE_WEIGHT = 4.0
+
+def _is_dialog(sentence: str) -> bool:
+    return sentence.lstrip().startswith(("「", "『", '"', "“"))
+
+def find_paragraph_breaks(sentences: List[str], text: str) -> List[bool]:
+    """判断每两句之间是否有段落分隔（原文中两句之间有换行）
+
+    句子经过文本处理后可能与原文不完全一致，找不到时视为没有分隔。
+
+    Returns:
+        list: 长度为 len(sentences) - 1，第 i 项表示第 i 句和第 i+1 句之间是否分段
+    """
+    breaks = [False] * max(0, len(sentences) - 1)
+    if not text:
+        return breaks
+    cursor = 0
+    previous_end = None
+    for i, sentence in enumerate(sentences):
+        probe = sentence.strip()[:10]
+        position = text.find(probe, cursor) if probe else -1
+        if position == -1:
+            previous_end = None
+            continue
+        if previous_end is not None and i > 0 and "\n" in text[previous_end:position]:
+            breaks[i - 1] = True
+        cursor = position + len(probe)
+        previous_end = position + len(sentence.strip())
+    return breaks
+
+def boundary_costs(sentences: List[str], text: str = None) -> List[float]:
+    """计算在每两句之间切分场景的代价，段落处最低，连续对话中间最高"""
+    paragraph_breaks = find_paragraph_breaks(sentences, text)
+    costs = []
+    for i in range(len(sentences) - 1):
+        if paragraph_breaks[i]:
+            cost = PARAGRAPH_CUT_COST
+        else:
+            cost = BASE_CUT_COST
+        if _is_dialog(sentences[i]) and _is_dialog(sentences[i + 1]):
+            cost += DIALOG_CUT_COST
+        costs.append(cost)
+    return costs
+
+def _segment(durations: List[float], costs: List[float], min_duration: float, max_duration: float,
+             ideal: float, scene_penalty: float) -> List[Tuple[int, int]]:
+    """动态规划求最小总代价的分割，返回 [(起始句, 结束句 + 1)]"""
+    n = len(durations)
+    prefix = [0.0]
+    for duration in durations:
+        prefix.append(prefix[-1] + duration)
+
+    best = [0.0] + [float("inf")] * n
+    previous = [0] * (n + 1)
+    for end in range(1, n + 1):
+        cut_cost = costs[end - 1] if end < n else 0.0
+        for start in range(end - 1, -1, -1):
+            length = prefix[end] - prefix[start]
+            # 超过最长时长的场景不允许（单句本身超长时除外）
+            if length > max_duration and end - start > 1:
+                break
+            cost = best[start] + scene_penalty + cut_cost + LENGTH_WEIGHT * ((length - ideal) / ideal) ** 2
+            if length < min_duration:
+                cost += SHORT_SCENE_WEIGHT * ((min_duration - length) / min_duration) ** 2
+            if cost < best[end]:
+                best[end] = cost
+                previous[end] = start
+
+    segments = []
+    end = n
+    while end > 0:
+        start = previous[end]
+        segments.append((start, end))
+        end = start
+    segments.reverse()
+    return segments
+
+def segment_scenes(durations: List[float], costs: List[float] = None, target_count: Optional[int] = None,
+                   min_duration: float = 3.0, max_duration: float = 10.0) -> List[Tuple[int, int]]:
+    """将句子划分为场景，最小化切分位置代价和场景时长偏差的总和
+
+    Args:
+        durations: 每个句子的时长（秒）
+        costs: 每两句之间切分的代价（长度 len(durations) - 1），默认都相同
+        target_count: 目标场景数（即图像数），指定时场景的理想时长为 总时长 / 目标场景数
+        min_duration: 场景的最短时长（秒），更短的场景会增加代价
+        max_duration: 场景的最长时长（秒），指定目标场景数时会放宽到理想时长的两倍
+
+    Returns:
+        list: [(起始句, 结束句 + 1)]
+    """
+    n = len(durations)
+    if n == 0:
+        return []
+    if costs is None:
+        costs = [BASE_CUT_COST] * (n - 1)
+    total = sum(durations)
+
+    if not target_count:
+        ideal = (min_duration + max_duration) / 2
+        return _segment(durations, costs, min_duration, max_duration, ideal, scene_penalty=1.0)
+
+    target_count = max(1, min(target_count, n))
+    ideal = total / target_count
+    max_duration = max(max_duration, ideal * 2)
+    min_duration = min(min_duration, ideal / 2)
+
+    # 用每个场景的固定代价控制场景数：二分查找使场景数最接近目标的代价
+    low, high = -16.0, 64.0
+    best_segments = _segment(durations, costs, min_duration, max_duration, ideal, scene_penalty=1.0)
+    for _ in range(24):
+        penalty = (low + high) / 2
+        segments = _segment(durations, costs, min_duration, max_duration, ideal, penalty)
+        if abs(len(segments) - target_count) < abs(len(best_segments) - target_count):
+            best_segments = segments
+        if len(segments) == target_count:
+            break
+        if len(segments) > target_count:
+            low = penalty
+        else:
+            high = penalty
+    return best_segments
@@ -1,5 +1,4 @@
-from typing import List, Dict
-from openai import OpenAI
+from typing import Callable, List, Dict
 from dotenv import load_dotenv
 import os
 import json
@@ -10,6 +9,15 @@ import time
 import random
 import string
 import locale
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from llm_cache import LLMResponseCache
+from llm_rate_limiter import TokenRateLimiter, estimate_tokens
+from llm_usage import LLMUsageTracker
+from llm_backend import LLMBackend
+from aho_corasick import AhoCorasick
+from scene_segmenter import segment_scenes, boundary_costs
+from scene_prompt_builder import ScenePromptBuilder, DEFAULT_CONTEXT_TOKENS
 
 # 设置系统编码为UTF-8，解决Windows命令行的编码问题
 if sys.stdout.encoding != 'utf-8':
@@ -19,24 +27,181 @@ if sys.stdout.encoding != 'utf-8':
         import io
         sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='backslashreplace')
 
+# 批量生成时每个场景预留的输出令牌数
+SCENE_BATCH_OUTPUT_TOKENS = 120
+
+# 找不到音频信息时使用的句子时长（秒）
+DEFAULT_SENTENCE_DURATION = 2.0
+
+# 场景划分方式：greedy 按顺序累加到最长时长，optimal 用动态规划在段落和对话边界上求最优划分
+SCENE_SEGMENTATIONS = ("greedy", "optimal")
+
+# 表示模型拒绝回答的词语，这样的响应不写入缓存，场景描述改用通用描述或单独重试
+REFUSAL_PHRASES = ["I'm sorry", "I cannot", "I apologize", "I'm unable", "I can only"]
+
+def is_cacheable_response(content: str, response_format: Dict = None) -> bool:
+    """判断响应是否可以写入缓存：非空、不是拒绝回答，JSON 模式下必须是可以解析的 JSON 对象"""
+    if not content or not content.strip() or any(phrase in content for phrase in REFUSAL_PHRASES):
+        return False
+    if response_format and response_format.get("type") == "json_object":
+        try:
+            return isinstance(json.loads(content), dict)
+        except json.JSONDecodeError:
+            return False
+    return True
+
+# 场景提示词生成模式：two_call 先翻译再描述，single_call 一次请求直接从原文生成英语描述
+SCENE_PROMPT_MODES = ("two_call", "single_call")
+
 class StoryAnalyzer:
-    def __init__(self):
-        """初始化故事分析器"""
+    def __init__(self, use_cache: bool = True, max_concurrency: int = None, tokens_per_minute: int = None,
+                 client=None, scene_prompt_mode: str = None, scene_batch_size: int = None,
+                 scene_batch_token_budget: int = None, scene_context_window: int = 2, backend: LLMBackend = None,
+                 scene_segmentation: str = None, target_scene_count: int = None, min_scene_duration: float = None,
+                 max_scene_duration: float = None, scene_context_tokens: int = None):
+        """初始化故事分析器
+        
+        Args:
+            use_cache: 是否使用本地LLM响应缓存（故事未变化时重新运行不再请求API）
+            max_concurrency: 同时进行的LLM请求数（默认读取 LLM_MAX_CONCURRENCY，否则使用后端的并发上限）
+            tokens_per_minute: 每分钟令牌数上限（默认读取 LLM_TOKENS_PER_MINUTE，否则为 200000，0 表示不限制）
+            client: 自定义的LLM客户端（例如 llm_stub.StubLLMClient），默认由后端创建
+            scene_prompt_mode: 场景提示词生成模式，"two_call"（默认）或 "single_call"（默认读取 SCENE_PROMPT_MODE）
+            scene_batch_size: 每个请求最多包含的场景数，1 表示逐个场景请求（默认读取 SCENE_BATCH_SIZE）
+            scene_batch_token_budget: 批量请求的输入令牌预算（默认读取 SCENE_BATCH_TOKEN_BUDGET，否则为 4000）
+            scene_context_window: 批量请求中为每个场景附带的前一场景句子数，用于保持连续性
+            backend: LLM后端（默认按 LLM_BACKEND 等环境变量创建，openai 后端使用 gpt-4o-mini，本地后端可用 LLM_MODEL 指定模型）
+            scene_segmentation: 场景划分方式，"greedy"（默认）或 "optimal"（默认读取 SCENE_SEGMENTATION）
+            target_scene_count: optimal 划分的目标场景数（即图像数），默认读取 TARGET_SCENE_COUNT，不指定时按时长划分
+            min_scene_duration: optimal 划分的场景最短时长（秒，默认读取 MIN_SCENE_DURATION，否则为 3）
+            max_scene_duration: 场景最长时长（秒，默认读取 MAX_SCENE_DURATION，否则为 10）
+            scene_context_tokens: 场景描述请求中场景原文的令牌上限（默认读取 SCENE_CONTEXT_TOKENS，否则为 300，0 表示不截断）
+        """
         load_dotenv()
-        self.client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
-        self.model = "gpt-4o-mini" # 必须使用 gpt-4o-mini 模型 不得擅自修改
+        self.backend = backend or LLMBackend.from_env(client=client)
+        self.client = self.backend.client
+        self.model = self.backend.model
+        self.llm_cache = LLMResponseCache.from_env() if use_cache else None
+        self.usage_tracker = LLMUsageTracker(self.model)
+        
+        # 并发和速率限制
+        if max_concurrency is None:
+            max_concurrency = int(os.getenv('LLM_MAX_CONCURRENCY', self.backend.max_concurrency))
+        if tokens_per_minute is None:
+            tokens_per_minute = int(os.getenv('LLM_TOKENS_PER_MINUTE', 200000))
+        self.max_concurrency = max(1, max_concurrency)
+        self.rate_limiter = TokenRateLimiter(tokens_per_minute)
+        
+        self.scene_prompt_mode = scene_prompt_mode or os.getenv('SCENE_PROMPT_MODE', 'two_call')
+        if self.scene_prompt_mode not in SCENE_PROMPT_MODES:
+            print(f"未知的场景提示词模式: {self.scene_prompt_mode}，使用 two_call")
+            self.scene_prompt_mode = "two_call"
+        
+        # 批量场景提示词生成
+        if scene_batch_size is None:
+            scene_batch_size = int(os.getenv('SCENE_BATCH_SIZE', 1))
+        if scene_batch_token_budget is None:
+            scene_batch_token_budget = int(os.getenv('SCENE_BATCH_TOKEN_BUDGET', 4000))
+        self.scene_batch_size = max(1, scene_batch_size)
+        self.scene_batch_token_budget = scene_batch_token_budget
+        self.scene_context_window = scene_context_window
+        
+        # 场景描述请求的构建（固定说明放在系统消息中，场景内容按令牌预算截断）
+        if scene_context_tokens is None:
+            scene_context_tokens = int(os.getenv('SCENE_CONTEXT_TOKENS', DEFAULT_CONTEXT_TOKENS))
+        self.prompt_builder = ScenePromptBuilder(self.model, context_tokens=scene_context_tokens)
+        
+        # 场景划分
+        self.scene_segmentation = scene_segmentation or os.getenv('SCENE_SEGMENTATION', 'greedy')
+        if self.scene_segmentation not in SCENE_SEGMENTATIONS:
+            print(f"警告：未知的场景划分方式 {self.scene_segmentation}，使用 greedy")
+            self.scene_segmentation = "greedy"
+        if target_scene_count is None and os.getenv('TARGET_SCENE_COUNT'):
+            target_scene_count = int(os.getenv('TARGET_SCENE_COUNT'))
+        self.target_scene_count = target_scene_count
+        self.min_scene_duration = min_scene_duration or float(os.getenv('MIN_SCENE_DURATION', 3.0))
+        self.max_scene_duration = max_scene_duration or float(os.getenv('MAX_SCENE_DURATION', 10.0))
+        self.story_text = None
         self.core_elements = {}
         self.input_file = None
         self.story_era = None  # 存储分析出的时代背景
         self.story_location = None  # 存储分析出的地点
         self.segment_analyses = []  # 存储分段分析结果
+        self.segment_offsets = []   # 各段落在原文中的起始字符位置（升序）
+        
+        # 音频时长索引（按句子位置和句子文本），首次使用时加载
+        self._audio_timeline = None
+        self._durations_by_sentence = None
+        
+        # 角色提及索引：{id(角色字典): (角色字典, 匹配器)}
+        self._mention_indexes = {}
+        
+        # 背景信息和角色信息的翻译结果（整个故事相同，只翻译一次）
+        self._setting_translations = {}
+        self._character_translations = {}
         
         # 添加一个列表，用于检测错误的文化背景
         self.incorrect_cultures = ["Japanese", "Chinese", "Korean", "Asian"]
     
+    def _chat_completion(self, messages: List[Dict], response_format: Dict = None,
+                         temperature: float = None, max_tokens: int = None, stage: str = "other",
+                         validate: Callable[[str], bool] = None) -> str:
+        """发送对话请求并返回响应文本，所有LLM调用都经过这里以使用缓存并统计令牌消耗
+        
+        Args:
+            stage: 调用所属的阶段（提示词模板），用于按阶段汇总令牌和耗时
+            validate: 额外的响应检查，返回 False 或抛出异常的响应不写入缓存（空响应、拒绝回答和无效 JSON 总是不缓存）
+        """
+        start = time.perf_counter()
+        prompt_size = self.prompt_builder.prompt_size(messages)
+        
+        cache_key = None
+        if self.llm_cache and not self.llm_cache.should_bypass(temperature):
+            cache_key = LLMResponseCache.make_key(self.model, messages, response_format, temperature, max_tokens,
+                                                  backend=self.backend.name, base_url=self.backend.base_url)
+            cached = self.llm_cache.get(cache_key)
+            if cached is not None:
+                usage = cached.get("usage", {})
+                self.usage_tracker.record(stage, usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0),
+                                          time.perf_counter() - start, cache_hit=True, prompt_size=prompt_size)
+                return cached["content"]
+        
+        # 按估算的令牌数（输入 + 最大输出）进行速率限制
+        self.rate_limiter.acquire(prompt_size["total"] + (max_tokens or 500))
+        content, usage = self.backend.chat(messages, response_format, temperature, max_tokens)
+        
+        # 部分兼容接口不返回 usage，此时使用估算值
+        cached_tokens = getattr(getattr(usage, "prompt_tokens_details", None), "cached_tokens", None) or 0
+        usage = {
+            "prompt_tokens": getattr(usage, "prompt_tokens", None) or prompt_size["total"],
+            "completion_tokens": getattr(usage, "completion_tokens", None) or estimate_tokens(content or "")
+        }
+        self.usage_tracker.record(stage, usage["prompt_tokens"], usage["completion_tokens"],
+                                  time.perf_counter() - start, cached_prompt_tokens=cached_tokens,
+                                  prompt_size=prompt_size)
+        
+        if cache_key and self._is_valid_response(content, response_format, validate):
+            self.llm_cache.set(cache_key, {"content": content, "usage": usage})
+        return content
+    
+    @staticmethod
+    def _is_valid_response(content: str, response_format: Dict = None, validate: Callable[[str], bool] = None) -> bool:
+        """响应是否可以写入缓存"""
+        if not is_cacheable_response(content, response_format):
+            return False
+        try:
+            return validate is None or bool(validate(content))
+        except Exception:
+            return False
+    
     def analyze_story(self, story_text: str, input_file: str) -> Dict:
         """分析故事文本，提取关键信息"""
         self.input_file = input_file
+        self.story_text = story_text
+        self._audio_timeline = None
+        self._durations_by_sentence = None
+        self.segment_analyses = []
+        self.segment_offsets = []
         
         # 检查文本长度，决定是否使用分段处理
         if len(story_text) > 2000:
@@ -58,16 +223,25 @@ class StoryAnalyzer:
             print(f"全局时代: {self.global_era}")
             print(f"全局风格: {self.global_style}")
         
+        # 预先构建角色提及索引（全局和各段落）
+        self._mention_indexes = {}
+        self._get_mention_index(self.core_elements.get("characters", {}))
+        for segment_analysis in self.segment_analyses:
+            self._get_mention_index(segment_analysis.get("characters", {}))
+        
         return analysis_result
     
     def analyze_story_in_segments(self, story_text: str, max_segment_length: int = 800) -> Dict:
         """分段分析故事，处理长文本"""
         print("故事较长，执行分段分析...")
         
-        # 将故事分成段落
+        # 将故事分成段落，同时记录每个段落在原文中的起始位置
         paragraphs = story_text.split('\n\n')
         segments = []
+        segment_offsets = []
         current_segment = ""
+        current_start = 0
+        offset = 0
         
         for paragraph in paragraphs:
             if len(current_segment) + len(paragraph) < max_segment_length:
@@ -75,21 +249,29 @@ class StoryAnalyzer:
             else:
                 if current_segment:
                     segments.append(current_segment.strip())
+                    segment_offsets.append(current_start)
                 current_segment = paragraph + "\n\n"
+                current_start = offset
+            offset += len(paragraph) + 2
         
         if current_segment:
             segments.append(current_segment.strip())
+            segment_offsets.append(current_start)
         
         print(f"故事被分为 {len(segments)} 个段落进行分析")
         
-        # 分析每个段落
+        # 并发分析所有段落，结果按原顺序返回
+        workers = max(1, min(self.max_concurrency, len(segments)))
+        print(f"并发分析段落 (并发数: {workers})...")
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(lambda segment: self._analyze_single_segment(segment, is_segment=True), segments))
+        
         self.segment_analyses = []
+        self.segment_offsets = segment_offsets
         segment_settings = []
         all_characters = {}
         
-        for i, segment in enumerate(segments):
-            print(f"分析段落 {i+1}/{len(segments)}...")
-            segment_result = self._analyze_single_segment(segment, is_segment=True)
+        for segment_result in results:
             self.segment_analyses.append(segment_result)
             
             # 收集设置信息
@@ -100,7 +282,14 @@ class StoryAnalyzer:
             if "characters" in segment_result:
                 for char_name, char_info in segment_result["characters"].items():
                     if char_name not in all_characters:
-                        all_characters[char_name] = char_info
+                        all_characters[char_name] = dict(char_info)
+                    else:
+                        # 合并各段落中出现的别名
+                        aliases = all_characters[char_name].get("aliases") or []
+                        for alias in char_info.get("aliases") or []:
+                            if alias not in aliases:
+                                aliases.append(alias)
+                        all_characters[char_name]["aliases"] = aliases
         
         # 整合分析结果
         return self._consolidate_segment_analyses(segment_settings, all_characters)
@@ -120,6 +309,7 @@ class StoryAnalyzer:
             },
             "characters": {
                 "character_name": {
+                    "aliases": ["the name exactly as written in the story text", "other names, nicknames or kana readings used in the text"],
                     "appearance": "brief visual description",
                     "role": "character's role in the story",
                     "gender": "male/female"
@@ -140,8 +330,8 @@ class StoryAnalyzer:
         """
         
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
+            response_content = self._chat_completion(
+                stage="analyze_segment" if is_segment else "analyze_story",
                 messages=[
                     {"role": "system", "content": "You are a precise cultural and historical analyzer that can identify elements from any culture or time period. Always return valid JSON."},
                     {"role": "user", "content": analysis_prompt + "\n\nSTORY TEXT:\n" + text}
@@ -149,15 +339,6 @@ class StoryAnalyzer:
                 response_format={"type": "json_object"}  # 强制返回JSON格式
             )
             
-            # 解析响应
-            response_content = response.choices[0].message.content
-            
-            # 修改print语句，确保能够处理所有Unicode字符
-            try:
-                print(f"GPT Response: {response_content}")
-            except UnicodeEncodeError:
-                print("GPT Response: [包含无法显示的Unicode字符]")
-            
             try:
                 analysis_result = json.loads(response_content)
             except json.JSONDecodeError as e:
@@ -277,250 +458,176 @@ class StoryAnalyzer:
         
         print(f"分析结果 - 地点: {self.story_location}, 时代: {self.story_era}")
     
-    def generate_scene_prompt(self, sentences: List[str]) -> str:
-        """生成场景提示词，使用统一的时代背景和风格，确保所有提示词都是英语，并且简洁有效"""
-        if not self.story_era or not hasattr(self, 'core_elements'):
-            print("警告：需要先分析故事背景")
-            return "error: story not analyzed"
-
-        # 优先使用全局文化背景信息
+    def _get_story_setting(self):
+        """获取全局的文化、地点、时代和风格信息"""
         culture = getattr(self, 'global_culture', self.core_elements.get("setting", {}).get("culture", "Universal"))
         location = getattr(self, 'global_location', self.story_location or "Story World")
         era = getattr(self, 'global_era', self.story_era or "Story Time")
         style = getattr(self, 'global_style', self.core_elements.get("setting", {}).get("style", "Realistic"))
+        return culture, location, era, style
+    
+    def _translate_setting(self, culture: str, location: str, era: str, style: str):
+        """将文化、地点、时代和风格翻译为英语，整个故事只翻译一次"""
+        key = (culture, location, era, style)
+        if key in self._setting_translations:
+            return self._setting_translations[key]
         
-        print(f"使用全局文化背景生成提示词: {culture}, {location}, {era}")
-        
-        # 获取人物特征信息
-        characters = self.core_elements.get("characters", {})
-        character_descriptions = []
-        
-        # 从句子中尝试识别出现的角色
-        context = "\n".join(sentences)
-        mentioned_characters = []
-        
-        for char_name in characters.keys():
-            if char_name.lower() in context.lower():
-                mentioned_characters.append(char_name)
-        
-        # 为提到的角色添加描述
-        for char_name in mentioned_characters:
-            char_info = characters.get(char_name, {})
-            appearance = char_info.get("appearance", "")
-            role = char_info.get("role", "")
-            gender = char_info.get("gender", "")
-            
-            # 构建更结构化的角色描述
-            char_desc_parts = []
-            if role:
-                char_desc_parts.append(f"role: {role}")
-            if appearance:
-                char_desc_parts.append(f"appearance: {appearance}")
-            if gender:
-                char_desc_parts.append(f"gender: {gender}")
-                
-            if char_desc_parts:
-                char_desc = f"{char_name}: {', '.join(char_desc_parts)}"
-                character_descriptions.append(char_desc)
-        
-        # 将角色描述合并为一个字符串
-        character_info = "; ".join(character_descriptions)
-        
-        context = "\n".join(sentences)
-        
-        try:
-            # 首先确保所有内容都是英语
-            translation_prompt = f"""
-            Translate the following text to English if it's not already in English.
+        translation_prompt = f"""
+            Translate the following story setting terms to English if they are not already in English.
             For culture, location, era, and style terms, provide the most appropriate English equivalent.
             
             Culture: {culture}
             Location: {location}
             Era: {era}
             Style: {style}
-            Context: {context}
-            Character Info: {character_info}
             
             Format your response as JSON:
             {{
                 "culture": "English translation of culture",
                 "location": "English translation of location",
                 "era": "English translation of era",
-                "style": "English translation of style",
-                "context": "English translation of context",
-                "character_info": "English translation of character_info"
+                "style": "English translation of style"
             }}
             """
-            
-            translation_response = self.client.chat.completions.create(
-                model=self.model,
+        
+        translated = key
+        try:
+            translated_data = json.loads(self._chat_completion(
+                stage="translate_setting",
                 messages=[
                     {"role": "system", "content": "You are a precise translator that converts non-English text to English while preserving meaning."},
                     {"role": "user", "content": translation_prompt}
                 ],
                 response_format={"type": "json_object"}
+            ))
+            translated = (
+                translated_data.get("culture", culture),
+                translated_data.get("location", location),
+                translated_data.get("era", era),
+                translated_data.get("style", style)
             )
+            print(f"翻译后的背景信息 - 文化: {translated[0]}, 地点: {translated[1]}, 时代: {translated[2]}, 风格: {translated[3]}")
+        except Exception as e:
+            print(f"翻译背景信息时出错: {e}")
+            # 继续使用原始值
+        
+        self._setting_translations[key] = translated
+        return translated
+    
+    def _translate_characters(self, characters: Dict) -> Dict:
+        """将角色信息翻译为英语，每个角色只翻译一次
+        
+        Returns:
+            dict: {角色名: {"role": ..., "appearance": ..., "gender": ...}}
+        """
+        def memo_key(name, info):
+            return name, json.dumps(info, ensure_ascii=False, sort_keys=True)
+        
+        pending = {
+            name: {field: info.get(field, "") for field in ("role", "appearance", "gender")}
+            for name, info in characters.items()
+            if memo_key(name, info) not in self._character_translations
+        }
+        
+        if pending:
+            translation_prompt = f"""
+            Translate the role, appearance and gender of each character below to English if they are not already in English.
+            Keep the character names (JSON keys) exactly as they are.
+            
+            Characters: {json.dumps(pending, ensure_ascii=False)}
             
+            Format your response as JSON:
+            {{
+                "characters": {{
+                    "character_name": {{"role": "...", "appearance": "...", "gender": "..."}}
+                }}
+            }}
+            """
+            translated_characters = {}
             try:
-                translated_data = json.loads(translation_response.choices[0].message.content)
-                culture = translated_data.get("culture", culture)
-                location = translated_data.get("location", location)
-                era = translated_data.get("era", era)
-                style = translated_data.get("style", style)
-                context = translated_data.get("context", context)
-                character_info = translated_data.get("character_info", character_info)
-                
-                print(f"翻译后的背景信息 - 文化: {culture}, 地点: {location}, 时代: {era}, 风格: {style}")
-                if character_info:
-                    print(f"翻译后的角色信息: {character_info}")
+                translated_data = json.loads(self._chat_completion(
+                    stage="translate_characters",
+                    messages=[
+                        {"role": "system", "content": "You are a precise translator that converts non-English text to English while preserving meaning."},
+                        {"role": "user", "content": translation_prompt}
+                    ],
+                    response_format={"type": "json_object"}
+                ))
+                translated_characters = translated_data.get("characters", {})
             except Exception as e:
-                print(f"翻译JSON解析错误: {e}")
-                # 继续使用原始值
-            
-            # 使用翻译后的英语内容生成场景描述 - 修改为更具体的提示词
-            prompt = f"""
-            Create a DETAILED visual scene description based on this text:
-            
-            "{context}"
+                print(f"翻译角色信息时出错: {e}")
             
-            Your description should reflect:
-            - Culture: {culture}
-            - Location: {location}
-            - Time period: {era}
-            - Visual style: {style}
-            
-            Character information to include (DO NOT use character names, only describe their roles and appearances):
-            {character_info}
-            
-            FOCUS ON THESE ELEMENTS BASED ON THE CONTEXT:
-            1. GRAND SCENES - For large-scale events, battles, or crowd scenes, focus on the overall atmosphere, scale, and environment (e.g., "vast battlefield with thousands of soldiers", "crowded marketplace bustling with activity")
-            2. LANDSCAPE & ENVIRONMENT - Describe natural or architectural elements that define the scene (e.g., "towering castle against stormy sky", "sunlight filtering through ancient forest")
-            3. ATMOSPHERIC ELEMENTS - Include lighting, weather, time of day that create mood (e.g., "golden sunset casting long shadows", "misty morning shrouding the mountains")
-            4. SPECIFIC CHARACTER EXPRESSIONS - When focusing on individuals, include detailed facial expressions (e.g., "determined gaze", "furrowed brow")
-            5. PRECISE BODY LANGUAGE - For character-focused scenes, describe exact poses and gestures (e.g., "hand firmly gripping sword")
-            6. DYNAMIC ACTIONS - Show movement and energy appropriate to the scene (e.g., "armies clashing on blood-soaked field", "dancers twirling across marble floor")
+            for name, info in pending.items():
+                translated = translated_characters.get(name)
+                if not isinstance(translated, dict):
+                    translated = info  # 翻译失败时使用原始值
+                self._character_translations[memo_key(name, characters[name])] = translated
+        
+        return {name: self._character_translations[memo_key(name, info)] for name, info in characters.items()}
+    
+    def _translate_context(self, context: str) -> str:
+        """将场景文本翻译为英语（每个场景一次，只包含场景内容）"""
+        translation_prompt = f"""
+            Translate the following text to English if it's not already in English.
             
-            Format as: "[Setting/Environment], [Scale and Atmosphere], [Character elements or crowd dynamics if relevant]"
+            Context: {context}
             
-            Use 40-50 words maximum. Focus on visually striking and emotionally resonant elements.
-            Your response must be in English only.
-            IMPORTANT: DO NOT include any character names in your description.
+            Format your response as JSON:
+            {{
+                "context": "English translation of context"
+            }}
             """
-            
-            response = self.client.chat.completions.create(
-                model=self.model,
+        try:
+            translated_data = json.loads(self._chat_completion(
+                stage="translate_context",
                 messages=[
-                    {"role": "system", "content": "You are a scene description generator that balances grand scenes with character details. Adapt your focus based on the context - for battles, crowds, or landscapes, emphasize the environment and scale; for intimate moments, focus on character details. Always respond in English only."},
-                    {"role": "user", "content": prompt}
+                    {"role": "system", "content": "You are a precise translator that converts non-English text to English while preserving meaning."},
+                    {"role": "user", "content": translation_prompt}
                 ],
-                temperature=0.7,
-                max_tokens=100
-            )
-            
-            scene = response.choices[0].message.content.strip()
-            
-            # 检查是否包含拒绝或道歉的词语
-            refusal_phrases = ["I'm sorry", "I cannot", "I apologize", "I'm unable", "I can only"]
-            if any(phrase in scene for phrase in refusal_phrases):
-                print(f"检测到拒绝回应: {scene}")
-                # 创建一个简洁的通用场景描述
-                scene = f"{location} during {era}, {culture} style"
-            
-            # 构建最终提示词，明确包含背景信息和人物特征，确保全部是英语，但保留更多细节
-            # 移除可能导致AI模型混淆的不必要词汇
-            scene = re.sub(r'\[|\]|\(|\)', '', scene)  # 移除括号
-            scene = re.sub(r',\s*,', ',', scene)  # 移除连续逗号
-            scene = re.sub(r'\s+', ' ', scene).strip()  # 规范化空格
-            
-            # 提取人物特征关键词，用于增强提示词
-            character_keywords = ""
-            if character_info:
-                # 从角色描述中提取关键词
-                char_keywords = []
-                for desc in character_descriptions:
-                    parts = desc.split(":")
-                    if len(parts) > 1:
-                        # 提取角色特征，不包含角色名
-                        char_details = parts[1].strip()
-                        # 提取角色的角色类型（如将军、士兵等）
-                        role_match = re.search(r'role:\s*([^,]+)', char_details, re.IGNORECASE)
-                        role_type = ""
-                        if role_match:
-                            role_type = role_match.group(1).strip()
-                        
-                        # 提取最重要的外貌特征词
-                        appearance_details = re.sub(r'role:[^,]+,?', '', char_details, flags=re.IGNORECASE).strip()
-                        if appearance_details:
-                            if role_type:
-                                char_keywords.append(f"{role_type} with {appearance_details}")
-                            else:
-                                char_keywords.append(appearance_details)
-                
-                if char_keywords:
-                    character_keywords = ", ".join(char_keywords)
-            
-            # 生成详细的最终提示词，包含人物特征但不包含人名
-            if character_keywords:
-                # 移除风格词汇，让full_process.py控制风格
-                final_prompt = f"{culture}, {location}, {era}, {scene}, {character_keywords}"
-            else:
-                # 移除风格词汇，让full_process.py控制风格
-                final_prompt = f"{culture}, {location}, {era}, {scene}"
-            
-            # 最终检查，确保不会出现错误的文化背景
-            final_prompt = self._ensure_correct_culture_background(final_prompt)
-            
-            return final_prompt
+                response_format={"type": "json_object"}
+            ))
+            return translated_data.get("context", context)
         except Exception as e:
-            print(f"生成场景描述时出错: {e}")
-            # 返回一个简洁的通用场景描述
-            return f"{culture}, {location}, {era}, {style} style, high quality"
+            print(f"翻译JSON解析错误: {e}")
+            # 继续使用原始值
+            return context
     
-    def generate_segment_specific_prompt(self, sentences: List[str], segment_index: int = None) -> str:
-        """生成基于特定段落分析的场景提示词，为长文本故事的不同段落提供更准确、简洁的场景描述"""
-        if not self.segment_analyses:
-            # 如果没有分段分析结果，回退到标准方法
-            return self.generate_scene_prompt(sentences)
+    def _get_mention_index(self, characters: Dict) -> AhoCorasick:
+        """获取角色提及索引：角色名和别名（原文写法、读音等）编译为一个多模式匹配器"""
+        cached = self._mention_indexes.get(id(characters))
+        if cached is not None and cached[0] is characters:
+            return cached[1]
         
-        # 尝试确定句子属于哪个段落
-        if segment_index is None:
-            segment_index = self._find_segment_for_sentences(sentences)
-        
-        # 如果无法确定或超出范围，使用整合的结果
-        if segment_index is None or segment_index >= len(self.segment_analyses):
-            return self.generate_scene_prompt(sentences)
-        
-        # 使用特定段落的分析结果，但文化背景使用全局信息
-        segment_analysis = self.segment_analyses[segment_index]
-        
-        # 强制使用全局文化背景信息
-        culture = getattr(self, 'global_culture', self.core_elements.get("setting", {}).get("culture", "Universal"))
-        location = getattr(self, 'global_location', self.story_location or "Story World")
-        era = getattr(self, 'global_era', self.story_era or "Story Time")
-        style = getattr(self, 'global_style', self.core_elements.get("setting", {}).get("style", "Realistic"))
-        
-        print(f"段落 {segment_index} 使用全局文化背景: {culture}, {location}, {era}")
-        
-        # 获取人物特征信息
-        characters = segment_analysis.get("characters", {})
+        matcher = AhoCorasick(ignore_case=True)
+        for char_name, char_info in characters.items():
+            aliases = [char_name]
+            if isinstance(char_info, dict) and isinstance(char_info.get("aliases"), list):
+                aliases += char_info["aliases"]
+            for alias in aliases:
+                if not isinstance(alias, str) or not alias.strip():
+                    continue
+                alias = alias.strip()
+                # 单个英文字母容易误匹配，忽略（单个汉字如「鬼」仍然有效）
+                if len(alias) == 1 and alias.isascii():
+                    continue
+                matcher.add(alias, char_name)
+        matcher.build()
+        self._mention_indexes[id(characters)] = (characters, matcher)
+        return matcher
+    
+    def _find_mentioned_characters(self, context: str, characters: Dict) -> List[str]:
+        """从场景文本中识别出现的角色（一次线性扫描），按角色信息中的顺序返回"""
+        found = self._get_mention_index(characters).find_values(context)
+        return [char_name for char_name in characters if char_name in found]
+    
+    def _format_character_descriptions(self, characters: Dict) -> List[str]:
+        """构建结构化的角色描述"""
         character_descriptions = []
-        
-        # 从句子中尝试识别出现的角色
-        context = "\n".join(sentences)
-        mentioned_characters = []
-        
-        for char_name in characters.keys():
-            if char_name.lower() in context.lower():
-                mentioned_characters.append(char_name)
-        
-        # 为提到的角色添加描述
-        for char_name in mentioned_characters:
-            char_info = characters.get(char_name, {})
+        for char_name, char_info in characters.items():
             appearance = char_info.get("appearance", "")
             role = char_info.get("role", "")
             gender = char_info.get("gender", "")
             
-            # 构建更结构化的角色描述
             char_desc_parts = []
             if role:
                 char_desc_parts.append(f"role: {role}")
@@ -532,199 +639,251 @@ class StoryAnalyzer:
             if char_desc_parts:
                 char_desc = f"{char_name}: {', '.join(char_desc_parts)}"
                 character_descriptions.append(char_desc)
+        return character_descriptions
+    
+    def _describe_scene(self, context: str, setting, character_descriptions: List[str]) -> str:
+        """根据英语场景文本生成场景描述"""
+        return self._chat_completion(
+            stage="describe_scene",
+            messages=self.prompt_builder.describe_scene(context, setting, character_descriptions),
+            temperature=0.7,
+            max_tokens=100
+        ).strip()
+    
+    def _describe_scene_single_call(self, context: str, setting, character_descriptions: List[str]) -> str:
+        """一次结构化请求：直接从原文生成英语场景描述，省去单独的翻译请求"""
+        content = self._chat_completion(
+            stage="describe_scene_single_call",
+            messages=self.prompt_builder.describe_scene_single_call(context, setting, character_descriptions),
+            response_format={"type": "json_object"},
+            temperature=0.7,
+            max_tokens=150,
+            validate=lambda text: str(json.loads(text).get("scene", "")).strip()
+        )
+        try:
+            return str(json.loads(content).get("scene", "")).strip()
+        except json.JSONDecodeError:
+            # 解析失败时直接使用原始文本
+            return content.strip()
+    
+    @staticmethod
+    def _parse_character_fields(char_details: str) -> Dict[str, str]:
+        """解析 "role: ..., appearance: ..., gender: ..." 形式的角色描述，返回 {字段: 值}（外貌中可以包含逗号）"""
+        fields = {}
+        for match in re.finditer(r'(role|appearance|gender):\s*(.*?)\s*(?=,\s*(?:role|appearance|gender):|$)',
+                                 char_details.strip(), re.IGNORECASE | re.DOTALL):
+            fields[match.group(1).lower()] = match.group(2).strip().rstrip(",")
+        return fields
+    
+    def _compose_final_prompt(self, scene: str, culture: str, location: str, era: str, character_descriptions: List[str]) -> str:
+        """清理场景描述并与背景信息、人物特征组合为最终提示词"""
+        # 检查是否包含拒绝或道歉的词语
+        if any(phrase in scene for phrase in REFUSAL_PHRASES):
+            print(f"检测到拒绝回应: {scene}")
+            # 创建一个简洁的通用场景描述
+            scene = f"{location} during {era}, {culture} style"
+        
+        # 移除可能导致AI模型混淆的不必要词汇
+        scene = re.sub(r'\[|\]|\(|\)', '', scene)  # 移除括号
+        scene = re.sub(r',\s*,', ',', scene)  # 移除连续逗号
+        scene = re.sub(r'\s+', ' ', scene).strip()  # 规范化空格
+        
+        # 提取人物特征关键词，用于增强提示词
+        character_keywords = ""
+        char_keywords = []
+        for desc in character_descriptions:
+            parts = desc.split(":")
+            if len(parts) > 1:
+                # 提取角色特征，不包含角色名，并去掉 role/appearance/gender 标签
+                fields = self._parse_character_fields(desc.split(":", 1)[1])
+                role_type = fields.get("role", "")
+                appearance_details = ", ".join(fields[field] for field in ("appearance", "gender") if fields.get(field))
+                if appearance_details:
+                    if role_type:
+                        char_keywords.append(f"{role_type} with {appearance_details}")
+                    else:
+                        char_keywords.append(appearance_details)
+        
+        if char_keywords:
+            character_keywords = ", ".join(char_keywords)
+        
+        # 生成详细的最终提示词，包含人物特征但不包含人名（风格由full_process.py控制）
+        if character_keywords:
+            final_prompt = f"{culture}, {location}, {era}, {scene}, {character_keywords}"
+        else:
+            final_prompt = f"{culture}, {location}, {era}, {scene}"
         
-        # 将角色描述合并为一个字符串
-        character_info = "; ".join(character_descriptions)
+        # 最终检查，确保不会出现错误的文化背景
+        return self._ensure_correct_culture_background(final_prompt)
+    
+    def _generate_prompt(self, sentences: List[str], characters: Dict, segment_index: int = None) -> str:
+        """生成场景提示词
         
+        背景信息和角色信息的翻译按故事缓存，每个场景只翻译场景文本本身。
+        """
+        culture, location, era, style = self._get_story_setting()
         context = "\n".join(sentences)
         
         try:
-            # 翻译和生成场景描述的逻辑与standard方法相同，但生成更简洁的提示词
-            translation_prompt = f"""
-            Translate the following text to English if it's not already in English.
-            For culture, location, era, and style terms, provide the most appropriate English equivalent.
-            
-            Culture: {culture}
-            Location: {location}
-            Era: {era}
-            Style: {style}
-            Context: {context}
-            Character Info: {character_info}
-            
-            Format your response as JSON:
-            {{
-                "culture": "English translation of culture",
-                "location": "English translation of location",
-                "era": "English translation of era",
-                "style": "English translation of style",
-                "context": "English translation of context",
-                "character_info": "English translation of character_info"
-            }}
-            """
+            culture, location, era, style = self._translate_setting(culture, location, era, style)
             
-            translation_response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": "You are a precise translator that converts non-English text to English while preserving meaning."},
-                    {"role": "user", "content": translation_prompt}
-                ],
-                response_format={"type": "json_object"}
+            # 为提到的角色添加描述（使用已翻译的角色信息）
+            mentioned_characters = self._find_mentioned_characters(context, characters)
+            translated_characters = self._translate_characters(characters)
+            character_descriptions = self._format_character_descriptions(
+                {name: translated_characters[name] for name in mentioned_characters}
             )
-            
-            try:
-                translated_data = json.loads(translation_response.choices[0].message.content)
-                culture = translated_data.get("culture", culture)
-                location = translated_data.get("location", location)
-                era = translated_data.get("era", era)
-                style = translated_data.get("style", style)
-                context = translated_data.get("context", context)
-                character_info = translated_data.get("character_info", character_info)
-                
-                print(f"段落 {segment_index+1} 翻译后的背景信息 - 文化: {culture}, 地点: {location}, 时代: {era}, 风格: {style}")
-                if character_info:
-                    print(f"翻译后的角色信息: {character_info}")
-            except Exception as e:
-                print(f"翻译JSON解析错误: {e}")
-                # 继续使用原始值
-            
-            prompt = f"""
-            Create a DETAILED visual scene description based on this text:
-            
-            "{context}"
-            
-            Your description should reflect:
-            - Culture: {culture}
-            - Location: {location}
-            - Time period: {era}
-            - Visual style: {style}
-            
-            Character information to include (DO NOT use character names, only describe their roles and appearances):
-            {character_info}
-            
-            FOCUS ON THESE ELEMENTS BASED ON THE CONTEXT:
-            1. GRAND SCENES - For large-scale events, battles, or crowd scenes, focus on the overall atmosphere, scale, and environment (e.g., "vast battlefield with thousands of soldiers", "crowded marketplace bustling with activity")
-            2. LANDSCAPE & ENVIRONMENT - Describe natural or architectural elements that define the scene (e.g., "towering castle against stormy sky", "sunlight filtering through ancient forest")
-            3. ATMOSPHERIC ELEMENTS - Include lighting, weather, time of day that create mood (e.g., "golden sunset casting long shadows", "misty morning shrouding the mountains")
-            4. SPECIFIC CHARACTER EXPRESSIONS - When focusing on individuals, include detailed facial expressions (e.g., "determined gaze", "furrowed brow")
-            5. PRECISE BODY LANGUAGE - For character-focused scenes, describe exact poses and gestures (e.g., "hand firmly gripping sword")
-            6. DYNAMIC ACTIONS - Show movement and energy appropriate to the scene (e.g., "armies clashing on blood-soaked field", "dancers twirling across marble floor")
-            
-            Format as: "[Setting/Environment], [Scale and Atmosphere], [Character elements or crowd dynamics if relevant]"
-            
-            Use 40-50 words maximum. Focus on visually striking and emotionally resonant elements.
-            Your response must be in English only.
-            IMPORTANT: DO NOT include any character names in your description.
-            """
-            
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": "You are a scene description generator that balances grand scenes with character details. Adapt your focus based on the context - for battles, crowds, or landscapes, emphasize the environment and scale; for intimate moments, focus on character details. Always respond in English only."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.7,
-                max_tokens=100
-            )
-            
-            scene = response.choices[0].message.content.strip()
-            
-            if any(phrase in scene for phrase in ["I'm sorry", "I cannot", "I apologize", "I'm unable", "I can only"]):
-                print(f"检测到拒绝回应: {scene}")
-                scene = f"{location} during {era}, {culture} style"
-            
-            # 清理和简化场景描述，但保留表情、动作和人物特征的细节
-            scene = re.sub(r'\[|\]|\(|\)', '', scene)  # 移除括号
-            scene = re.sub(r',\s*,', ',', scene)  # 移除连续逗号
-            scene = re.sub(r'\s+', ' ', scene).strip()  # 规范化空格
-            
-            # 提取人物特征关键词，用于增强提示词
-            character_keywords = ""
+            character_info = "; ".join(character_descriptions)
             if character_info:
-                # 从角色描述中提取关键词
-                char_keywords = []
-                for desc in character_descriptions:
-                    parts = desc.split(":")
-                    if len(parts) > 1:
-                        # 提取角色特征，不包含角色名
-                        char_details = parts[1].strip()
-                        # 提取角色的角色类型（如将军、士兵等）
-                        role_match = re.search(r'role:\s*([^,]+)', char_details, re.IGNORECASE)
-                        role_type = ""
-                        if role_match:
-                            role_type = role_match.group(1).strip()
-                        
-                        # 提取最重要的外貌特征词
-                        appearance_details = re.sub(r'role:[^,]+,?', '', char_details, flags=re.IGNORECASE).strip()
-                        if appearance_details:
-                            if role_type:
-                                char_keywords.append(f"{role_type} with {appearance_details}")
-                            else:
-                                char_keywords.append(appearance_details)
-                
-                if char_keywords:
-                    character_keywords = ", ".join(char_keywords)
+                print(f"角色信息: {character_info}")
             
-            # 生成详细的最终提示词，包含人物特征但不包含人名
-            if character_keywords:
-                # 移除风格词汇，让full_process.py控制风格
-                final_prompt = f"{culture}, {location}, {era}, {scene}, {character_keywords}"
+            setting = (culture, location, era, style)
+            if self.scene_prompt_mode == "single_call":
+                scene = self._describe_scene_single_call(context, setting, character_descriptions)
             else:
-                # 移除风格词汇，让full_process.py控制风格
-                final_prompt = f"{culture}, {location}, {era}, {scene}"
-            
-            # 最终检查，确保不会出现错误的文化背景
-            final_prompt = self._ensure_correct_culture_background(final_prompt)
-            
-            return final_prompt
+                context = self._translate_context(self.prompt_builder.compress_context(context))
+                scene = self._describe_scene(context, setting, character_descriptions)
+            return self._compose_final_prompt(scene, culture, location, era, character_descriptions)
         except Exception as e:
-            print(f"生成段落特定场景描述时出错: {e}")
+            if segment_index is None:
+                print(f"生成场景描述时出错: {e}")
+            else:
+                print(f"生成段落特定场景描述时出错: {e}")
+            # 返回一个简洁的通用场景描述
             return f"{culture}, {location}, {era}, {style} style, high quality"
     
-    def _find_segment_for_sentences(self, sentences: List[str]) -> int:
-        """尝试确定给定句子属于哪个段落"""
+    def generate_scene_prompt(self, sentences: List[str]) -> str:
+        """生成场景提示词，使用统一的时代背景和风格，确保所有提示词都是英语，并且简洁有效"""
+        if not self.story_era or not hasattr(self, 'core_elements'):
+            print("警告：需要先分析故事背景")
+            return "error: story not analyzed"
+        
+        culture, location, era, style = self._get_story_setting()
+        print(f"使用全局文化背景生成提示词: {culture}, {location}, {era}")
+        
+        return self._generate_prompt(sentences, self.core_elements.get("characters", {}))
+    
+    def generate_segment_specific_prompt(self, sentences: List[str], segment_index: int = None) -> str:
+        """生成基于特定段落分析的场景提示词，为长文本故事的不同段落提供更准确、简洁的场景描述"""
         if not self.segment_analyses:
+            # 如果没有分段分析结果，回退到标准方法
+            return self.generate_scene_prompt(sentences)
+        
+        # 尝试确定句子属于哪个段落
+        if segment_index is None:
+            segment_index = self._find_segment_for_sentences(sentences)
+        
+        # 如果无法确定或超出范围，使用整合的结果
+        if segment_index is None or segment_index >= len(self.segment_analyses):
+            return self.generate_scene_prompt(sentences)
+        
+        # 使用特定段落的分析结果，但文化背景使用全局信息
+        segment_analysis = self.segment_analyses[segment_index]
+        culture, location, era, style = self._get_story_setting()
+        print(f"段落 {segment_index} 使用全局文化背景: {culture}, {location}, {era}")
+        
+        return self._generate_prompt(sentences, segment_analysis.get("characters", {}), segment_index)
+    
+    def _find_segment_for_sentences(self, sentences: List[str], start: int = 0) -> int:
+        """根据第一句在原文中的位置确定句子属于哪个段落，找不到时返回 None
+        
+        Args:
+            sentences: 句子列表
+            start: 从原文的此位置开始查找（通常为上一句的位置），避免重复的开头匹配到前面的段落
+        """
+        if not self.segment_analyses or not sentences:
             return None
+        if not self.segment_offsets or not self.story_text:
+            return 0
         
-        # 简单实现：返回第一个段落
-        # 在实际应用中，可以实现更复杂的匹配逻辑
-        return 0
+        position = self._locate_sentence(sentences[0], start)
+        if position == -1:
+            return None
+        return self._find_segment_for_offset(position)
     
-    def identify_key_scenes(self, sentences: List[str]) -> List[Dict]:
-        """识别需要生成图像的关键场景，支持分段处理"""
+    def _locate_sentence(self, sentence: str, start: int = 0) -> int:
+        """在原文中从 start 开始查找句子的开头，找不到时返回 -1"""
+        probe = sentence.strip()[:10]
+        return self.story_text.find(probe, start) if probe else -1
+    
+    def _find_segment_for_offset(self, offset: int) -> int:
+        """二分查找原文字符位置所在的段落"""
+        return min(max(bisect_right(self.segment_offsets, offset) - 1, 0), len(self.segment_analyses) - 1)
+    
+    def _map_sentences_to_segments(self, sentences: List[str], sentence_offsets: List[tuple] = None,
+                                   source_length: int = None) -> List[int]:
+        """计算每个句子所属的段落，没有分段分析结果时返回 None
+        
+        Args:
+            sentences: 句子列表
+            sentence_offsets: 每个句子在原文中的 (起始, 结束) 字符位置（TextProcessor.sentence_offsets）
+            source_length: sentence_offsets 对应的原文长度（TextProcessor.source_length），
+                与 analyze_story 的文本长度不一致时说明不是同一文本，不使用位置信息
+        """
+        if not self.segment_analyses:
+            return None
+        if not self.segment_offsets or not self.story_text:
+            # 没有原文时按句子数平均分配
+            sentences_per_segment = max(1, len(sentences) // len(self.segment_analyses))
+            return [min(i // sentences_per_segment, len(self.segment_analyses) - 1) for i in range(len(sentences))]
+        
+        if sentence_offsets and len(sentence_offsets) == len(sentences):
+            if source_length is None or source_length == len(self.story_text):
+                return [self._find_segment_for_offset(start) for start, _ in sentence_offsets]
+            print(f"警告: 句子位置对应的文本长度 ({source_length}) 与故事原文 ({len(self.story_text)}) 不一致，按句子内容查找段落")
+        
+        # 没有可用的位置信息时按顺序在原文中查找句子，从上一句的位置继续，找不到的句子沿用上一句的段落
+        segments = []
+        cursor = 0
+        for sentence in sentences:
+            position = self._locate_sentence(sentence, cursor)
+            if position == -1:
+                segments.append(segments[-1] if segments else 0)
+                continue
+            cursor = position
+            segments.append(self._find_segment_for_offset(position))
+        return segments
+    
+    def identify_key_scenes(self, sentences: List[str], durations: List[float] = None,
+                            generate_prompts: bool = True, sentence_offsets: List[tuple] = None,
+                            source_length: int = None) -> List[Dict]:
+        """识别需要生成图像的关键场景，支持分段处理
+        
+        Args:
+            sentences: 句子列表
+            durations: 与句子按位置对应的音频时长，默认从音频信息文件加载
+            generate_prompts: 是否立即生成提示词（离线批处理时为 False，之后用 build_scene_prompt_requests 构建请求）
+            sentence_offsets: 每个句子在原文中的位置，用于确定场景所属的段落（不提供时在原文中查找句子）
+            source_length: sentence_offsets 对应的原文长度，用于确认与 analyze_story 使用的是同一文本
+        """
         try:
+            if durations is None:
+                durations = self.load_audio_timeline()
+            
             key_scenes = []
             current_scene = None
             current_start_time = 0.0
             
-            # 为长文本启用分段处理
-            use_segments = len(self.segment_analyses) > 0
-            current_segment = 0
-            segment_boundaries = []
+            # 为长文本启用分段处理：场景属于其第一句所在的段落
+            sentence_segments = self._map_sentences_to_segments(sentences, sentence_offsets, source_length)
             
-            # 如果使用分段，确定大致的段落边界（用于后续场景生成）
-            if use_segments:
-                total_sentences = len(sentences)
-                sentences_per_segment = total_sentences // len(self.segment_analyses)
-                for i in range(len(self.segment_analyses)):
-                    start_idx = i * sentences_per_segment
-                    segment_boundaries.append(start_idx)
-                segment_boundaries.append(total_sentences)  # 添加结尾边界
+            if self.scene_segmentation == "optimal":
+                key_scenes = self._segment_key_scenes(sentences, durations, sentence_segments)
+                if generate_prompts:
+                    self._generate_scene_prompts(key_scenes)
+                return key_scenes
             
             for i in range(0, len(sentences)):
                 sentence = sentences[i]
-                duration = self.get_sentence_duration(sentence)
-                
-                # 如果使用分段，检查是否到达新段落
-                if use_segments and i >= segment_boundaries[min(current_segment + 1, len(segment_boundaries) - 1)]:
-                    current_segment = min(current_segment + 1, len(self.segment_analyses) - 1)
+                duration = self.get_sentence_duration(sentence, i, durations)
                 
                 if current_scene is None:
                     current_scene = self._create_new_scene(i, sentence, duration, current_start_time)
-                elif current_scene["duration"] + duration <= 10:
+                elif current_scene["duration"] + duration <= self.max_scene_duration:
                     self._extend_current_scene(current_scene, sentence, duration)
                 else:
                     # 结束当前场景
-                    self._finalize_scene(current_scene, i - 1, current_segment if use_segments else None)
+                    self._finalize_scene(current_scene, i - 1, sentence_segments)
                     key_scenes.append(current_scene)
                     
                     # 开始新场景
@@ -733,15 +892,44 @@ class StoryAnalyzer:
             
             # 处理最后一个场景
             if current_scene:
-                self._finalize_scene(current_scene, len(sentences) - 1, current_segment if use_segments else None)
+                self._finalize_scene(current_scene, len(sentences) - 1, sentence_segments)
                 key_scenes.append(current_scene)
             
+            # 为所有场景生成提示词
+            if generate_prompts:
+                self._generate_scene_prompts(key_scenes)
+            
             return key_scenes
             
         except Exception as e:
             print(f"识别关键场景时出错: {e}")
             return []
     
+    def _segment_key_scenes(self, sentences: List[str], durations: List[float],
+                            sentence_segments: List[int] = None) -> List[Dict]:
+        """按最优划分生成场景（场景数或时长范围由配置决定，尽量在段落处切分、不打断对话）"""
+        sentence_durations = [self.get_sentence_duration(sentence, i, durations) for i, sentence in enumerate(sentences)]
+        ranges = segment_scenes(
+            sentence_durations,
+            boundary_costs(sentences, self.story_text),
+            target_count=self.target_scene_count,
+            min_duration=self.min_scene_duration,
+            max_duration=self.max_scene_duration
+        )
+        
+        key_scenes = []
+        start_time = 0.0
+        for start, end in ranges:
+            scene = self._create_new_scene(start, sentences[start], sentence_durations[start], start_time)
+            for i in range(start + 1, end):
+                self._extend_current_scene(scene, sentences[i], sentence_durations[i])
+            self._finalize_scene(scene, end - 1, sentence_segments)
+            key_scenes.append(scene)
+            start_time = scene["end_time"]
+        
+        print(f"最优场景划分: {len(sentences)} 句，{len(key_scenes)} 个场景")
+        return key_scenes
+    
     def _create_new_scene(self, index: int, sentence: str, duration: float, start_time: float) -> Dict:
         """创建新场景"""
         return {
@@ -760,32 +948,250 @@ class StoryAnalyzer:
         scene["duration"] += duration
         scene["end_time"] = scene["start_time"] + scene["duration"]
     
-    def _finalize_scene(self, scene: Dict, end_index: int, segment_index: int = None):
-        """完成场景处理，可选择基于段落生成提示词"""
+    def _finalize_scene(self, scene: Dict, end_index: int, sentence_segments: List[int] = None):
+        """完成场景处理，记录所属段落（即第一句所在的段落，提示词在所有场景确定后统一生成）"""
         scene["end_index"] = end_index
+        if sentence_segments:
+            scene["segment_index"] = sentence_segments[scene["start_index"]]
+    
+    def _generate_prompt_for_scene(self, scene: Dict) -> str:
+        """为单个场景生成提示词，有段落索引时使用段落特定的分析结果"""
+        if scene.get("segment_index") is not None:
+            return self.generate_segment_specific_prompt(scene["sentences"], scene["segment_index"])
+        return self.generate_scene_prompt(scene["sentences"])
+    
+    def _generate_scene_prompts(self, scenes: List[Dict]):
+        """为所有场景生成提示词，scene_batch_size 大于 1 时将多个场景合并到一个请求中"""
+        if self.scene_batch_size <= 1 or len(scenes) <= 1:
+            for scene in scenes:
+                scene["prompt"] = self._generate_prompt_for_scene(scene)
+            return
         
-        # 如果有段落索引，使用段落特定的提示词生成
-        if segment_index is not None:
-            scene["prompt"] = self.generate_segment_specific_prompt(scene["sentences"], segment_index)
-        else:
-            scene["prompt"] = self.generate_scene_prompt(scene["sentences"])
+        if not self.story_era:
+            print("警告：需要先分析故事背景")
+            for scene in scenes:
+                scene["prompt"] = "error: story not analyzed"
+            return
+        
+        requests = self.build_scene_prompt_requests(scenes)
+        print(f"批量生成场景提示词: {len(scenes)} 个场景，{len(requests)} 个请求")
+        workers = max(1, min(self.max_concurrency, len(requests)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(lambda request: self._run_scene_prompt_request(scenes, request), requests))
     
-    def get_sentence_duration(self, sentence: str) -> float:
-        """获取句子的音频时长"""
-        audio_info_file = f"output/audio/{Path(self.input_file).stem}_audio_info.json"
+    def build_scene_prompt_requests(self, scenes: List[Dict]) -> List[Dict]:
+        """构建批量场景描述请求但不发送（也用于离线批处理 API）
+        
+        Returns:
+            list: [{"scene_indexes": [...], "messages": [...], "response_format": ..., "temperature": ..., "max_tokens": ...}]
+        """
+        # 预先完成背景和角色的翻译，避免并发请求重复翻译
+        setting = self._translate_setting(*self._get_story_setting())
+        for scene in scenes:
+            self._translate_characters(self._get_scene_characters(scene))
+        return [self._build_batch_request(scenes, batch, setting) for batch in self._plan_scene_batches(scenes)]
+    
+    def _run_scene_prompt_request(self, scenes: List[Dict], request: Dict):
+        """发送一个批量场景描述请求并写回结果"""
+        content = None
         try:
-            with open(audio_info_file, 'r', encoding='utf-8') as f:
-                info = json.load(f)
-            
-            for audio in info['audio_files']:
-                if audio['sentence'] == sentence:
-                    return audio['duration']
-            
-            print(f"未找到句子的时长信息: {sentence}")
-            return 2.0
+            content = self._chat_completion(
+                stage="describe_scene_batch",
+                messages=request["messages"],
+                response_format=request["response_format"],
+                temperature=request["temperature"],
+                max_tokens=request["max_tokens"]
+            )
         except Exception as e:
-            print(f"读取音频信息时出错: {e}")
-            return 2.0
+            print(f"批量生成场景描述时出错: {e}")
+        self.apply_scene_prompt_results(scenes, request, content)
+    
+    def _get_scene_characters(self, scene: Dict) -> Dict:
+        """获取场景可用的角色信息（段落分析结果或全局结果）"""
+        segment_index = scene.get("segment_index")
+        if segment_index is not None and segment_index < len(self.segment_analyses):
+            return self.segment_analyses[segment_index].get("characters", {})
+        return self.core_elements.get("characters", {})
+    
+    def _get_scene_character_descriptions(self, scene: Dict) -> List[str]:
+        """获取场景中出现的角色的英语描述"""
+        characters = self._get_scene_characters(scene)
+        mentioned_characters = self._find_mentioned_characters("\n".join(scene["sentences"]), characters)
+        translated_characters = self._translate_characters(characters)
+        return self._format_character_descriptions({name: translated_characters[name] for name in mentioned_characters})
+    
+    def _get_previous_context(self, scenes: List[Dict], index: int) -> str:
+        """取前一个场景的最后几句作为连续性参考"""
+        if index == 0 or self.scene_context_window <= 0:
+            return ""
+        return "\n".join(scenes[index - 1]["sentences"][-self.scene_context_window:])
+    
+    def _plan_scene_batches(self, scenes: List[Dict]) -> List[List[int]]:
+        """将连续的场景按数量上限和令牌预算分组"""
+        batches = []
+        current = []
+        current_tokens = 0
+        for index, scene in enumerate(scenes):
+            scene_tokens = self.prompt_builder.estimate_scene_tokens(
+                "\n".join(scene["sentences"]),
+                self._get_previous_context(scenes, index),
+                self._get_scene_character_descriptions(scene)
+            ) + SCENE_BATCH_OUTPUT_TOKENS
+            if current and (len(current) >= self.scene_batch_size or
+                            current_tokens + scene_tokens > self.scene_batch_token_budget):
+                batches.append(current)
+                current = []
+                current_tokens = 0
+            current.append(index)
+            current_tokens += scene_tokens
+        if current:
+            batches.append(current)
+        return batches
+    
+    def _build_batch_request(self, scenes: List[Dict], batch: List[int], setting) -> Dict:
+        """构建一组场景的描述请求"""
+        scene_items = [{
+            "scene_id": scenes[index]["scene_id"],
+            "text": "\n".join(scenes[index]["sentences"]),
+            "previous": self._get_previous_context(scenes, index),
+            "characters": self._get_scene_character_descriptions(scenes[index])
+        } for index in batch]
+        
+        return {
+            "scene_indexes": list(batch),
+            "messages": self.prompt_builder.describe_scene_batch(scene_items, setting),
+            "response_format": {"type": "json_object"},
+            "temperature": 0.7,
+            "max_tokens": SCENE_BATCH_OUTPUT_TOKENS * len(batch)
+        }
+    
+    def apply_scene_prompt_results(self, scenes: List[Dict], request: Dict, content: str = None,
+                                   setting=None, character_descriptions: List[List[str]] = None):
+        """将批量请求的响应写回场景提示词，缺失或无效的场景单独重试
+        
+        Args:
+            setting: 翻译后的 (文化, 地点, 时代, 风格)，默认按当前分析结果获取
+            character_descriptions: 各场景（按场景序号）的角色描述，默认按当前分析结果获取
+        """
+        culture, location, era, style = setting or self._translate_setting(*self._get_story_setting())
+        
+        results = {}
+        if content:
+            try:
+                results = json.loads(content).get("scenes", {})
+                if not isinstance(results, dict):
+                    results = {}
+            except Exception as e:
+                print(f"解析批量场景描述时出错: {e}")
+        
+        for index in request["scene_indexes"]:
+            scene = scenes[index]
+            description = results.get(str(scene["scene_id"]))
+            if not isinstance(description, str) or not description.strip() or \
+                    any(phrase in description for phrase in REFUSAL_PHRASES):
+                # 批量结果中缺失或无效的场景单独重试
+                print(f"场景 {scene['scene_id']} 的批量结果无效，单独重试")
+                scene["prompt"] = self._generate_prompt_for_scene(scene)
+                continue
+            if character_descriptions is not None:
+                scene_character_descriptions = character_descriptions[index]
+            else:
+                scene_character_descriptions = self._get_scene_character_descriptions(scene)
+            scene["prompt"] = self._compose_final_prompt(description.strip(), culture, location, era,
+                                                         scene_character_descriptions)
+    
+    def export_prompt_context(self, scenes: List[Dict]) -> Dict:
+        """导出组合场景提示词所需的信息（翻译后的背景、各场景的角色描述和分析结果）
+        
+        离线批处理写回结果时用 restore_prompt_context 恢复，不必重新分析故事。
+        """
+        setting = self._get_story_setting()
+        return {
+            "setting": list(self._translate_setting(*setting)),
+            "character_descriptions": [self._get_scene_character_descriptions(scene) for scene in scenes],
+            "analysis": {
+                "input_file": self.input_file,
+                "story_setting": list(setting),
+                "core_elements": self.core_elements,
+                "segment_analyses": self.segment_analyses,
+                "segment_offsets": self.segment_offsets,
+                "story_era": self.story_era,
+                "story_location": self.story_location,
+                "character_translations": [[name, info, translated] for (name, info), translated
+                                           in self._character_translations.items()]
+            }
+        }
+    
+    def restore_prompt_context(self, context: Dict, story_text: str = None):
+        """恢复 export_prompt_context 导出的分析结果和翻译结果，不发送LLM请求（单独重试的场景仍会请求）"""
+        analysis = context["analysis"]
+        self.input_file = analysis["input_file"]
+        self.story_text = story_text
+        self.core_elements = analysis["core_elements"]
+        self.segment_analyses = analysis["segment_analyses"]
+        self.segment_offsets = analysis["segment_offsets"]
+        self.story_era = analysis["story_era"]
+        self.story_location = analysis["story_location"]
+        self.global_culture, self.global_location, self.global_era, self.global_style = analysis["story_setting"]
+        self._setting_translations = {tuple(analysis["story_setting"]): tuple(context["setting"])}
+        self._character_translations = {(name, info): translated
+                                        for name, info, translated in analysis["character_translations"]}
+        self._mention_indexes = {}
+    
+    def load_audio_timeline(self, audio_files: List[Dict] = None) -> List[float]:
+        """加载音频时长索引，返回按句子位置排列的时长列表（缺失的位置为 None）
+        
+        Args:
+            audio_files: 音频信息列表（audio_info.json 中的 audio_files），默认读取当前故事的音频信息文件
+        """
+        if audio_files is None:
+            if self._audio_timeline is not None:
+                return self._audio_timeline
+            audio_info_file = f"output/audio/{Path(self.input_file).stem}_audio_info.json"
+            try:
+                with open(audio_info_file, 'r', encoding='utf-8') as f:
+                    audio_files = json.load(f)['audio_files']
+            except Exception as e:
+                print(f"读取音频信息时出错: {e}")
+                audio_files = []
+        
+        timeline = []
+        durations_by_sentence = {}
+        for position, audio in enumerate(audio_files):
+            index = audio.get("id", position)
+            duration = audio.get("duration")
+            if index >= len(timeline):
+                timeline.extend([None] * (index + 1 - len(timeline)))
+            timeline[index] = duration
+            if duration is not None:
+                durations_by_sentence.setdefault(audio.get("sentence"), duration)
+        
+        self._audio_timeline = timeline
+        self._durations_by_sentence = durations_by_sentence
+        return timeline
+    
+    def get_sentence_duration(self, sentence: str, index: int = None, durations: List[float] = None) -> float:
+        """获取句子的音频时长，优先按句子位置查找，重复的句子也能得到各自的时长
+        
+        Args:
+            sentence: 句子文本
+            index: 句子位置
+            durations: 按位置排列的时长列表，默认使用已加载的音频时长索引
+        """
+        if durations is None:
+            durations = self.load_audio_timeline()
+        if index is not None and index < len(durations) and durations[index] is not None:
+            return durations[index]
+        
+        # 没有位置信息时按文本查找
+        if self._durations_by_sentence is None:
+            self.load_audio_timeline()
+        duration = self._durations_by_sentence.get(sentence)
+        if duration is not None:
+            return duration
+        
+        print(f"未找到句子的时长信息: {sentence}")
+        return DEFAULT_SENTENCE_DURATION
     
     def _ensure_correct_culture_background(self, prompt: str) -> str:
         """确保提示词中不会出现错误的文化背景"""
@@ -1,23 +1,102 @@
 from pathlib import Path
-from voice_generator import VoiceVoxGenerator
+from voice_generator import VoiceVoxGenerator, DEFAULT_AUDIO_PROFILE, AUDIO_PROFILES
 from pronunciation_dictionary import PronunciationDictionary
+from audio_postprocess import trim_and_normalize_clips, DEFAULT_TRIM_PAD
+from aho_corasick import AhoCorasick
 import json
+import hashlib
 import argparse
 
-def process_voice_generation(input_file: str, output_dir: str, speaker_id: int = 13, use_dict: bool = True):
-    """处理文本到语音的转换"""
+def load_previous_audio_info(info_file: Path):
+    """读取上次生成的音频信息，不存在或无法解析时返回 None"""
+    try:
+        if info_file.exists():
+            with open(info_file, "r", encoding="utf-8") as f:
+                return json.load(f)
+    except Exception as e:
+        print(f"读取已有音频信息时出错: {e}")
+    return None
+
+def clip_filename(story_name: str, index: int, sentence: str) -> str:
+    """音频文件名，包含句子内容的哈希值
+
+    插入或删除句子后沿用的音频保留原来的文件名，新合成的音频不会覆盖内容不同的已有音频。
+    """
+    digest = hashlib.sha1(sentence.encode("utf-8")).hexdigest()[:8]
+    return f"{story_name}/audio_{index:03d}_{digest}.wav"
+
+def find_reusable_audio(sentences, previous, synthesis_settings, dictionary_entries, output_path: Path):
+    """找出可以沿用的已生成音频
+    
+    按句子内容匹配上次的音频（与句子的位置无关，插入或删除句子后其他句子仍可沿用）。
+    合成参数不变时，只有句子中包含发生变化的词典条目时才需要重新合成。
+    
+    Returns:
+        dict: {句子序号: 上次的音频信息}
+    """
+    if not previous or previous.get("synthesis_settings") != synthesis_settings:
+        return {}
+    
+    # 找出读音或重音发生变化（包括新增和删除）的词语
+    old_entries = previous.get("dictionary_entries", {})
+    changed_surfaces = {
+        surface for surface in set(old_entries) | set(dictionary_entries)
+        if old_entries.get(surface) != dictionary_entries.get(surface)
+    }
+    matcher = AhoCorasick(changed_surfaces)
+    
+    # 句子内容 -> 上次的音频信息（相同的句子共用一个音频）
+    previous_by_sentence = {}
+    for entry in previous.get("audio_files", []):
+        if "error" in entry or "audio_file" not in entry or entry.get("sentence") in previous_by_sentence:
+            continue
+        if (output_path / entry["audio_file"]).exists():
+            previous_by_sentence[entry.get("sentence")] = entry
+    
+    reusable = {}
+    for index, sentence in enumerate(sentences):
+        entry = previous_by_sentence.get(sentence)
+        if entry is None:
+            continue
+        if changed_surfaces and matcher.contains_any(sentence):
+            continue
+        reusable[index] = dict(entry, id=index)
+    
+    if changed_surfaces:
+        print(f"发生变化的词典条目: {', '.join(sorted(changed_surfaces))}")
+    return reusable
+
+def remove_unused_audio(output_path: Path, story_name: str, audio_info):
+    """删除故事目录中不再被使用的音频文件"""
+    used = {info["audio_file"] for info in audio_info if "audio_file" in info}
+    for audio_path in (output_path / story_name).glob("*.wav"):
+        if f"{story_name}/{audio_path.name}" not in used:
+            audio_path.unlink()
+
+def process_voice_generation(input_file: str, output_dir: str, speaker_id: int = 13, use_dict: bool = True,
+                             audio_profile: str = DEFAULT_AUDIO_PROFILE, post_process: bool = True,
+                             trim_pad: float = DEFAULT_TRIM_PAD, host: str = "127.0.0.1", port: str = "50021",
+                             incremental: bool = True):
+    """处理文本到语音的转换
+    
+    incremental 为 True 时沿用上次生成且不受词典变化影响的音频，只重新合成受影响的句子。
+    每个故事的音频保存在输出目录下以故事名命名的子目录中，不同故事的音频不会互相覆盖。
+    """
     # 创建输出目录
     output_path = Path(output_dir)
-    output_path.mkdir(parents=True, exist_ok=True)
+    story_name = Path(input_file).stem
+    (output_path / story_name).mkdir(parents=True, exist_ok=True)
     
     # 初始化语音生成器
-    voice_generator = VoiceVoxGenerator()
+    voice_generator = VoiceVoxGenerator(host, port, audio_profile=audio_profile)
     
     # 如果启用词典，初始化并同步词典
+    dictionary_fingerprint = None
     if use_dict:
-        dict_manager = PronunciationDictionary()
+        dict_manager = PronunciationDictionary(host, port)
         dict_manager.sync_with_voicevox()
-        print("已同步发音词典")
+        dictionary_fingerprint = dict_manager.get_fingerprint()
+        print(f"已同步发音词典 (指纹: {dictionary_fingerprint})")
     
     # 列出可用角色
     print("可用角色列表：")
@@ -32,14 +111,38 @@ def process_voice_generation(input_file: str, output_dir: str, speaker_id: int =
     with open(input_file, "r", encoding="utf-8") as f:
         sentences = [line.strip() for line in f if line.strip()]
     
+    # 记录影响合成结果的参数和本故事中出现的词典条目
+    info_file = output_path / f"{story_name}_audio_info.json"
+    synthesis_settings = {
+        "speaker": voice_generator.speaker,
+        "audio_format": voice_generator.get_audio_format(),
+        "post_process": post_process,
+        "trim_pad": trim_pad if post_process else None,
+        "engine_version": dict_manager.engine_version if use_dict else None
+    }
+    dictionary_entries = dict_manager.get_entries_in_texts(sentences) if use_dict else {}
+    
+    # 找出可以沿用的音频
+    reusable = {}
+    if incremental:
+        previous = load_previous_audio_info(info_file)
+        reusable = find_reusable_audio(sentences, previous, synthesis_settings, dictionary_entries, output_path)
+        if reusable:
+            print(f"沿用已有音频 {len(reusable)} 个，需要重新合成 {len(sentences) - len(reusable)} 个")
+    
     # 存储音频信息
     audio_info = []
+    regenerated = []
     
     # 处理每个句子
     for i, sentence in enumerate(sentences):
+        if i in reusable:
+            audio_info.append(reusable[i])
+            continue
+        
         try:
             # 生成音频文件并获取时长
-            audio_file = f"audio_{i:03d}.wav"
+            audio_file = clip_filename(story_name, i, sentence)
             audio_path = output_path / audio_file
             duration = voice_generator.synthesize(sentence, audio_path)
             
@@ -53,6 +156,7 @@ def process_voice_generation(input_file: str, output_dir: str, speaker_id: int =
                 "audio_file": str(audio_file),
                 "duration": duration
             })
+            regenerated.append(audio_info[-1])
             
             print(f"已生成音频 {i+1}/{len(sentences)}: {audio_file} (时长: {duration:.2f}秒)")
             
@@ -64,18 +168,26 @@ def process_voice_generation(input_file: str, output_dir: str, speaker_id: int =
                 "error": str(e)
             })
     
+    # 裁剪首尾静音并统一响度，时长随之更新（沿用的音频已处理过）
+    if post_process and regenerated:
+        trim_and_normalize_clips(regenerated, output_path, pad=trim_pad)
+    
     # 保存音频信息到JSON文件
-    info_file = output_path / f"{Path(input_file).stem}_audio_info.json"
     with open(info_file, "w", encoding="utf-8") as f:
         json.dump({
             "source_file": input_file,
             "total_sentences": len(sentences),
             "total_duration": sum(info.get("duration", 0) for info in audio_info),
+            "audio_format": voice_generator.get_audio_format(),
+            "dictionary_fingerprint": dictionary_fingerprint,
+            "synthesis_settings": synthesis_settings,
+            "dictionary_entries": dictionary_entries,
             "audio_files": audio_info
         }, f, ensure_ascii=False, indent=2)
+    remove_unused_audio(output_path, story_name, audio_info)
     
     print(f"\n处理完成！")
-    print(f"总句子数: {len(sentences)}")
+    print(f"总句子数: {len(sentences)} (重新合成: {len(regenerated)})")
     print(f"音频信息已保存到: {info_file}")
     
     return audio_info
@@ -87,17 +199,31 @@ if __name__ == "__main__":
     parser.add_argument("--output", "-o", default="output/audio", help="输出目录")
     parser.add_argument("--speaker", "-s", type=int, default=8, help="说话人ID")
     parser.add_argument("--no-dict", action="store_true", help="不使用发音词典")
+    parser.add_argument("--audio-profile", choices=list(AUDIO_PROFILES.keys()), default=DEFAULT_AUDIO_PROFILE,
+                        help="音频输出配置（采样率/声道）")
+    parser.add_argument("--no-trim", action="store_true", help="不裁剪静音和统一响度")
+    parser.add_argument("--trim-pad", type=float, default=DEFAULT_TRIM_PAD, help="裁剪后保留的首尾静音（秒）")
     parser.add_argument("--add-word", "-a", nargs=2, metavar=("WORD", "PRONUNCIATION"), help="添加词典条目")
     parser.add_argument("--remove-word", "-r", help="删除词典条目")
     parser.add_argument("--import-dict", help="导入词典文件")
     parser.add_argument("--export-dict", help="导出词典文件")
     parser.add_argument("--add-common", action="store_true", help="添加常见发音纠正")
+    parser.add_argument("--host", default="127.0.0.1", help="VOICEVOX 地址")
+    parser.add_argument("--port", default="50021", help="VOICEVOX 端口")
+    parser.add_argument("--stub", action="store_true", help="使用内置的 VOICEVOX 模拟服务器（无需启动引擎）")
+    parser.add_argument("--full", action="store_true", help="重新合成所有句子（不沿用已有音频）")
     
     args = parser.parse_args()
     
+    host, port = args.host, args.port
+    if args.stub:
+        from voicevox_stub import VoiceVoxStubServer
+        stub_server = VoiceVoxStubServer(host, 0).start()
+        port = str(stub_server.port)
+    
     # 处理词典相关操作
     if args.add_word or args.remove_word or args.import_dict or args.export_dict or args.add_common:
-        dict_manager = PronunciationDictionary()
+        dict_manager = PronunciationDictionary(host, port)
         
         if args.add_word:
             dict_manager.add_word(args.add_word[0], args.add_word[1])
@@ -119,5 +245,11 @@ if __name__ == "__main__":
         args.input, 
         args.output, 
         args.speaker, 
-        not args.no_dict
+        not args.no_dict,
+        args.audio_profile,
+        not args.no_trim,
+        args.trim_pad,
+        host,
+        port,
+        not args.full
     ) 
\ No newline at end of file
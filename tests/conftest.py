@@ -0,0 +1,28 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# 模块都在仓库根目录下
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+@pytest.fixture
+def make_analyzer(tmp_path, monkeypatch):
+    """创建使用模拟后端的 StoryAnalyzer，LLM 缓存保存在临时目录中"""
+    from llm_backend import LLMBackend
+    from story_analyzer import StoryAnalyzer
+
+    monkeypatch.setenv("LLM_CACHE_PATH", str(tmp_path / "llm_cache.sqlite3"))
+
+    def make(client=None, use_cache=False, **kwargs):
+        return StoryAnalyzer(use_cache=use_cache, backend=LLMBackend("stub", client=client), **kwargs)
+
+    return make
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """在临时目录中运行（生成器会在当前目录下创建 output 和 cache），并链接 workflows 目录"""
+    (tmp_path / "workflows").symlink_to(ROOT / "workflows", target_is_directory=True)
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
@@ -0,0 +1,24 @@
+from aho_corasick import AhoCorasick
+
+def test_finds_all_overlapping_matches():
+    matcher = AhoCorasick(["he", "she", "his", "hers"])
+    matches = sorted(matcher.iter_matches("ushers"))
+    assert matches == [(1, 4, "she"), (2, 4, "he"), (2, 6, "hers")]
+
+def test_values_and_ignore_case():
+    matcher = AhoCorasick([("Taro", "taro_id"), ("Hanako", "hanako_id")], ignore_case=True)
+    assert matcher.find_values("TARO met hanako. taro left.") == {"taro_id", "hanako_id"}
+    assert len(matcher) == 2
+
+def test_contains_any_after_adding_patterns():
+    matcher = AhoCorasick(["太郎"])
+    assert matcher.contains_any("太郎は山へ行った")
+    assert not matcher.contains_any("花子は川へ行った")
+    # 添加模式后重新构建失配指针
+    matcher.add("花子")
+    assert matcher.contains_any("花子は川へ行った")
+
+def test_empty_matcher():
+    matcher = AhoCorasick()
+    assert not matcher.contains_any("anything")
+    assert matcher.find_values("anything") == set()
@@ -0,0 +1,56 @@
+import wave
+
+import numpy as np
+
+from audio_postprocess import trim_and_normalize_clips, DEFAULT_TARGET_LOUDNESS_DB
+
+RATE = 24000
+
+def _write_clip(path, silence_before, tone_length, silence_after, amplitude, channels=1):
+    """写入 静音 + 正弦音 + 静音 的 16bit WAV"""
+    tone = amplitude * np.sin(2 * np.pi * 220 * np.arange(int(RATE * tone_length)) / RATE)
+    samples = np.concatenate((np.zeros(int(RATE * silence_before)), tone, np.zeros(int(RATE * silence_after))))
+    samples = np.repeat((samples * 32767).astype("<i2"), channels)
+    with wave.open(str(path), "wb") as wav_file:
+        wav_file.setnchannels(channels)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(RATE)
+        wav_file.writeframes(samples.tobytes())
+
+def _read_clip(path):
+    with wave.open(str(path), "rb") as wav_file:
+        channels = wav_file.getnchannels()
+        frames = wav_file.readframes(wav_file.getnframes())
+    return np.frombuffer(frames, dtype="<i2").reshape(-1, channels) / 32768.0
+
+def _rms_db(samples):
+    return 20 * np.log10(np.sqrt((samples ** 2).mean()))
+
+def test_trims_silence_and_normalizes_loudness(tmp_path):
+    _write_clip(tmp_path / "quiet.wav", 0.5, 1.0, 0.7, amplitude=0.02)
+    _write_clip(tmp_path / "loud.wav", 0.2, 1.0, 0.3, amplitude=0.5, channels=2)
+    audio_info = [{"audio_file": "quiet.wav", "duration": 2.2}, {"audio_file": "loud.wav", "duration": 1.5}]
+
+    trim_and_normalize_clips(audio_info, str(tmp_path), pad=0.05)
+
+    for info in audio_info:
+        # 保留 0.05 秒的首尾静音（正弦音首尾的过零点附近也可能低于阈值）
+        assert 1.0 <= info["duration"] <= 1.11
+        samples = _read_clip(tmp_path / info["audio_file"])
+        assert len(samples) / RATE == info["duration"]
+        voiced = samples[int(RATE * 0.06):-int(RATE * 0.06)]
+        assert abs(_rms_db(voiced) - DEFAULT_TARGET_LOUDNESS_DB) < 0.5
+
+def test_skips_silent_failed_and_missing_clips(tmp_path):
+    _write_clip(tmp_path / "silent.wav", 1.0, 0.0, 0.0, amplitude=0.0)
+    original = (tmp_path / "silent.wav").read_bytes()
+    audio_info = [
+        {"audio_file": "silent.wav", "duration": 1.0},
+        {"audio_file": "failed.wav", "error": "synthesis failed"},
+        {"audio_file": "missing.wav", "duration": 1.0},
+    ]
+    trim_and_normalize_clips(audio_info, str(tmp_path))
+    # 全静音的片段保持原样
+    assert (tmp_path / "silent.wav").read_bytes() == original
+    assert audio_info[0]["duration"] == 1.0
+    assert audio_info[2]["duration"] == 1.0
@@ -0,0 +1,62 @@
+import json
+
+from pronunciation_dictionary import PronunciationDictionary
+from test_voice_generator import find_reusable_audio, process_voice_generation
+from voicevox_stub import VoiceVoxStubServer
+
+SETTINGS = {"speaker": 13, "audio_format": None, "post_process": True, "trim_pad": 0.08, "engine_version": "1"}
+
+def _previous(output_path, sentences, entries=None):
+    audio_files = []
+    for i, sentence in enumerate(sentences):
+        audio_file = f"story/audio_{i:03d}.wav"
+        (output_path / audio_file).parent.mkdir(parents=True, exist_ok=True)
+        (output_path / audio_file).write_bytes(b"wav")
+        audio_files.append({"id": i, "sentence": sentence, "audio_file": audio_file, "duration": 1.0})
+    return {"synthesis_settings": SETTINGS, "dictionary_entries": entries or {}, "audio_files": audio_files}
+
+def test_reuse_follows_sentence_text(tmp_path):
+    previous = _previous(tmp_path, ["一文目。", "二文目。", "三文目。"])
+    sentences = ["新しい文。", "一文目。", "三文目。"]
+    reusable = find_reusable_audio(sentences, previous, SETTINGS, {}, tmp_path)
+    assert {index: entry["audio_file"] for index, entry in reusable.items()} == {
+        1: "story/audio_000.wav", 2: "story/audio_002.wav"}
+    assert [entry["id"] for entry in reusable.values()] == [1, 2]
+
+def test_changed_dictionary_entries_and_settings(tmp_path):
+    entries = {"桃太郎": ["モモタロウ", 3]}
+    previous = _previous(tmp_path, ["桃太郎が来た。", "犬が来た。"], entries)
+    changed = {"桃太郎": ["モモタロー", 3]}
+    assert set(find_reusable_audio(["桃太郎が来た。", "犬が来た。"], previous, SETTINGS, changed, tmp_path)) == {1}
+    assert find_reusable_audio(["犬が来た。"], previous, dict(SETTINGS, speaker=8), entries, tmp_path) == {}
+
+def test_missing_or_failed_clips_are_not_reused(tmp_path):
+    previous = _previous(tmp_path, ["一文目。", "二文目。"])
+    (tmp_path / "story/audio_000.wav").unlink()
+    previous["audio_files"][1]["error"] = "synthesis failed"
+    assert find_reusable_audio(["一文目。", "二文目。"], previous, SETTINGS, {}, tmp_path) == {}
+
+def test_inserting_a_sentence_synthesizes_only_that_sentence(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    story = tmp_path / "story.txt"
+    story.write_text("桃太郎は山へ行った。\n犬が来た。\n猿が来た。\n", encoding="utf-8")
+    with VoiceVoxStubServer() as stub:
+        PronunciationDictionary("127.0.0.1", stub.port).add_words({"桃太郎": ("モモタロウ", 3)})
+        process_voice_generation(str(story), "audio", host="127.0.0.1", port=str(stub.port))
+        assert stub.request_counts["/synthesis"] == 3
+
+        story.write_text("昔々。\n桃太郎は山へ行った。\n犬が来た。\n猿が来た。\n", encoding="utf-8")
+        audio_info = process_voice_generation(str(story), "audio", host="127.0.0.1", port=str(stub.port))
+        assert stub.request_counts["/synthesis"] == 4
+
+        # 词典变化只影响包含该词的句子
+        PronunciationDictionary("127.0.0.1", stub.port).add_words({"桃太郎": ("モモタロー", 3)})
+        process_voice_generation(str(story), "audio", host="127.0.0.1", port=str(stub.port))
+        assert stub.request_counts["/synthesis"] == 5
+
+    assert [info["id"] for info in audio_info] == [0, 1, 2, 3]
+    saved = json.loads((tmp_path / "audio/story_audio_info.json").read_text(encoding="utf-8"))
+    files = {info["audio_file"] for info in saved["audio_files"]}
+    assert all((tmp_path / "audio" / audio_file).exists() for audio_file in files)
+    # 不再使用的音频已删除
+    assert {f"story/{path.name}" for path in (tmp_path / "audio/story").glob("*.wav")} == files
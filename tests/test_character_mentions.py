@@ -0,0 +1,29 @@
+CHARACTERS = {
+    "Taro": {"description": "a young fisherman", "aliases": ["太郎", "たろう", " "]},
+    "Princess Otohime": {"description": "princess of the sea palace", "aliases": ["乙姫", "Otohime"]},
+    "Oni": {"description": "a red demon", "aliases": ["鬼", "O", 3]},
+    "Old man": "just a string"
+}
+
+def test_aliases_match_original_spellings(make_analyzer):
+    analyzer = make_analyzer()
+    assert analyzer._find_mentioned_characters("太郎は海辺で亀を助けた。", CHARACTERS) == ["Taro"]
+    assert analyzer._find_mentioned_characters("乙姫様とたろうが会った。", CHARACTERS) == ["Taro", "Princess Otohime"]
+    # 英文别名不区分大小写
+    assert analyzer._find_mentioned_characters("OTOHIME smiled.", CHARACTERS) == ["Princess Otohime"]
+
+def test_single_kanji_alias_matches_but_single_letter_does_not(make_analyzer):
+    analyzer = make_analyzer()
+    assert analyzer._find_mentioned_characters("鬼が島に行く。", CHARACTERS) == ["Oni"]
+    assert analyzer._find_mentioned_characters("O and o are letters.", CHARACTERS) == []
+
+def test_characters_without_aliases_match_by_name(make_analyzer):
+    analyzer = make_analyzer()
+    assert analyzer._find_mentioned_characters("The old man laughed.", CHARACTERS) == ["Old man"]
+
+def test_mention_index_is_reused_per_character_dict(make_analyzer):
+    analyzer = make_analyzer()
+    index = analyzer._get_mention_index(CHARACTERS)
+    assert analyzer._get_mention_index(CHARACTERS) is index
+    # 内容相同的另一个字典使用新的索引
+    assert analyzer._get_mention_index(dict(CHARACTERS)) is not index
@@ -0,0 +1,38 @@
+import pytest
+
+from comfyui_stub import ComfyUIStubServer
+from comfyui_dispatcher import ComfyUIDispatcher
+
+JOBS = [(f"misty mountain village, scene {i}", f"scene_{i:03d}.png") for i in range(5)]
+
+@pytest.fixture
+def comfyui():
+    with ComfyUIStubServer(render_time=0.01) as stub:
+        yield stub
+
+def test_dispatcher_spreads_jobs_across_nodes(workdir):
+    with ComfyUIStubServer(render_time=0.05) as first, ComfyUIStubServer(render_time=0.05) as second:
+        dispatcher = ComfyUIDispatcher([f"127.0.0.1:{first.port}", f"127.0.0.1:{second.port}"], window=2,
+                                       use_cache=False)
+        results = dispatcher.generate_batch(JOBS)
+    assert all(results[filename] for _, filename in JOBS)
+    assert first.completed > 0 and second.completed > 0
+    assert first.completed + second.completed == len(JOBS)
+
+def test_dispatcher_without_queue_endpoint(workdir, comfyui):
+    dispatcher = ComfyUIDispatcher([f"127.0.0.1:{comfyui.port}"], use_cache=False)
+
+    def unavailable():
+        raise ConnectionError("queue unavailable")
+
+    # 无法获取队列长度时按已分配的场景数分配，不会一直等待
+    dispatcher.nodes[0].generator.get_queue = unavailable
+    results = dispatcher.generate_batch(JOBS)
+    assert all(results[filename] for _, filename in JOBS)
+
+def test_dispatcher_requeues_when_node_is_down(workdir, comfyui):
+    # 第二个节点无法连接，其场景改由第一个节点生成
+    dispatcher = ComfyUIDispatcher([f"127.0.0.1:{comfyui.port}", "127.0.0.1:1"], use_cache=False)
+    results = dispatcher.generate_batch(JOBS)
+    assert all(results[filename] for _, filename in JOBS)
+    assert comfyui.completed == len(JOBS)
@@ -0,0 +1,47 @@
+import os
+
+from image_cache import ImageCache, derive_seed
+
+def test_derive_seed_is_deterministic():
+    assert derive_seed("a misty village") == derive_seed("a misty village")
+    assert derive_seed("a misty village") != derive_seed("a misty village at night")
+    assert all(1 <= derive_seed(f"prompt {i}", max_seed=100) <= 100 for i in range(50))
+
+def test_make_key_covers_recipe():
+    recipe = ("workflow", "prompt", "negative", "lora.safetensors", 42, (1024, 576))
+    key = ImageCache.make_key(*recipe)
+    assert key == ImageCache.make_key(*recipe)
+    for index, changed in enumerate(["other", "other prompt", "other negative", None, 43, (512, 512)]):
+        assert ImageCache.make_key(*recipe[:index], changed, *recipe[index + 1:]) != key
+
+def test_get_and_put(tmp_path):
+    cache = ImageCache(str(tmp_path / "cache"))
+    image = tmp_path / "image.png"
+    image.write_bytes(b"png data")
+    output = tmp_path / "output.png"
+
+    assert not cache.get("key", output)
+    cache.put("key", image)
+    assert cache.get("key", output)
+    assert output.read_bytes() == b"png data"
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    cache.clear()
+    assert not cache.get("key", output)
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = ImageCache(str(tmp_path / "cache"), max_size_mb=0)
+    cache.max_size = 250
+    image = tmp_path / "image.png"
+    image.write_bytes(b"x" * 100)
+    for index, key in enumerate(["key0", "key1", "key2"]):
+        cache.put(key, image)
+        # 明确设置访问时间，避免文件系统时间精度影响顺序
+        os.utime(cache.cache_dir / f"{key}.png", (index, index))
+    assert not (cache.cache_dir / "key0.png").exists()
+
+    # 读取后成为最近访问的图像
+    assert cache.get("key1", tmp_path / "output.png")
+    cache.put("key3", image)
+    assert (cache.cache_dir / "key1.png").exists()
+    assert not (cache.cache_dir / "key2.png").exists()
@@ -0,0 +1,66 @@
+from pathlib import Path
+
+import pytest
+
+from comfyui_stub import ComfyUIStubServer
+from image_generator import ComfyUIGenerator
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+JOBS = [(f"misty mountain village, scene {i}", f"scene_{i:03d}.png") for i in range(5)]
+
+@pytest.fixture
+def comfyui():
+    with ComfyUIStubServer(render_time=0.01) as stub:
+        yield stub
+
+def _generator(stub, **kwargs):
+    return ComfyUIGenerator("127.0.0.1", stub.port, **kwargs)
+
+def test_generate_batch(workdir, comfyui):
+    generator = _generator(comfyui, use_cache=False)
+    results = generator.generate_batch(JOBS, window=3)
+
+    assert set(results) == {filename for _, filename in JOBS}
+    for image_file in results.values():
+        assert Path(image_file).read_bytes().startswith(PNG_SIGNATURE)
+    assert comfyui.request_counts["/prompt"] == len(JOBS)
+
+def test_generate_batch_uses_image_cache(workdir, comfyui):
+    _generator(comfyui).generate_batch(JOBS)
+    first = {filename: (workdir / "output/images" / filename).read_bytes() for _, filename in JOBS}
+
+    results = _generator(comfyui).generate_batch(JOBS)
+    assert comfyui.request_counts["/prompt"] == len(JOBS)
+    assert {filename: Path(image_file).read_bytes() for filename, image_file in results.items()} == first
+
+def test_seed_depends_on_prompt_only(workdir, comfyui):
+    generator = _generator(comfyui)
+    prompt = "a quiet temple garden"
+    assert generator.build_workflow(prompt) == generator.build_workflow(prompt)
+    assert generator.cache_key(prompt) != generator.cache_key("a quiet temple garden at night")
+
+    # 场景重新编号后（输出文件名改变）仍然命中缓存
+    generator.generate_batch([(prompt, "scene_001.png")])
+    results = _generator(comfyui).generate_batch([(prompt, "scene_002.png")])
+    assert comfyui.request_counts["/prompt"] == 1
+    assert Path(results["scene_002.png"]).read_bytes() == (workdir / "output/images/scene_001.png").read_bytes()
+
+def test_failed_prompts_return_none(workdir):
+    with ComfyUIStubServer(render_time=0.01, failure_rate=1.0) as stub:
+        results = _generator(stub, use_cache=False).generate_batch(JOBS[:2])
+    assert results == {"scene_000.png": None, "scene_001.png": None}
+
+def test_websocket_images(workdir, comfyui):
+    generator = _generator(comfyui, use_cache=False, websocket_images=True)
+    results = generator.generate_batch(JOBS, window=3)
+    assert all(Path(image_file).read_bytes().startswith(PNG_SIGNATURE) for image_file in results.values())
+    # 通过 WebSocket 接收图像时不再请求 /history 和 /view
+    assert "/view" not in comfyui.request_counts and "/history" not in comfyui.request_counts
+    assert "SaveImageWebsocket" in [node["class_type"] for node in generator.build_workflow("a river").values()]
+
+def test_websocket_images_single(workdir, comfyui):
+    generator = _generator(comfyui, use_cache=False, websocket_images=True)
+    image_file = generator.generate_image("a misty mountain village", "scene_000.png")
+    assert Path(image_file).read_bytes().startswith(PNG_SIGNATURE)
+    assert "/view" not in comfyui.request_counts
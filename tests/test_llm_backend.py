@@ -0,0 +1,52 @@
+import json
+
+from llm_backend import LLMBackend, extract_json_object
+from llm_stub import LLMStubServer
+
+JSON_PROMPT = [
+    {"role": "system", "content": "You analyze stories."},
+    {"role": "user", "content": 'Summarize the story. Format your response as JSON: {"title": "", "characters": []}'}
+]
+
+def test_extract_json_object():
+    assert extract_json_object('```json\n{"a": 1}\n```') == '{"a": 1}'
+    assert extract_json_object('Sure! {"a": {"b": "}"}} Done.') == '{"a": {"b": "}"}}'
+    # 跳过无法解析的花括号
+    assert extract_json_object('{not json} then {"ok": true}') == '{"ok": true}'
+    assert extract_json_object('{"quote": "say \\"hi\\" {"}') == '{"quote": "say \\"hi\\" {"}'
+    assert extract_json_object("no json here") == "no json here"
+    assert extract_json_object("") == ""
+
+def test_stub_backend_returns_template_json():
+    backend = LLMBackend("stub")
+    content, usage = backend.chat(JSON_PROMPT, {"type": "json_object"})
+    data = json.loads(content)
+    assert set(data) == {"title", "characters"}
+    assert usage.prompt_tokens > 0 and usage.completion_tokens > 0
+    # 相同请求得到相同的内容
+    assert backend.chat(JSON_PROMPT, {"type": "json_object"})[0] == content
+
+def test_local_backend_without_json_mode():
+    with LLMStubServer(json_mode=False) as server:
+        backend = LLMBackend("local", base_url=server.base_url)
+        content, _ = backend.chat(JSON_PROMPT, {"type": "json_object"})
+        assert backend.json_mode is False
+        # 去掉 response_format 后模型返回 markdown 代码块，从中提取 JSON
+        assert set(json.loads(content)) == {"title", "characters"}
+
+def test_local_backend_with_json_mode():
+    with LLMStubServer() as server:
+        backend = LLMBackend("local", base_url=server.base_url)
+        content, _ = backend.chat(JSON_PROMPT, {"type": "json_object"})
+        assert backend.json_mode is True
+        assert set(json.loads(content)) == {"title", "characters"}
+        assert server.request_counts.get("/v1/chat/completions") == 2
+
+def test_model_from_env(monkeypatch):
+    monkeypatch.setenv("LLM_MODEL", "gpt-4o")
+    monkeypatch.setenv("LLM_JSON_MODE", "true")
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    # openai 后端固定使用 gpt-4o-mini，只有本地后端使用 LLM_MODEL
+    assert LLMBackend.from_env("openai").model == "gpt-4o-mini"
+    assert LLMBackend.from_env("local").model == "gpt-4o"
+    assert LLMBackend.from_env("stub").model == "stub-model"
@@ -0,0 +1,59 @@
+import json
+from types import SimpleNamespace
+
+from llm_backend import LLMBackend
+from llm_batch import BatchJobClient
+from llm_stub import LLMStubServer
+
+def _requests(count):
+    return [{
+        "custom_id": f"req{i:02d}",
+        "messages": [{"role": "user", "content": f'Describe scene {i}. Format your response as JSON: {{"scene": ""}}'}],
+        "response_format": {"type": "json_object"},
+        "temperature": 0.3,
+        "max_tokens": 100
+    } for i in range(count)]
+
+def test_write_requests(tmp_path):
+    client = BatchJobClient(LLMBackend("stub"))
+    batch_file = tmp_path / "batch" / "job.jsonl"
+    assert client.write_requests(_requests(3), str(batch_file)) == 3
+    lines = [json.loads(line) for line in batch_file.read_text(encoding="utf-8").splitlines()]
+    assert [line["custom_id"] for line in lines] == ["req00", "req01", "req02"]
+    assert all(line["method"] == "POST" and line["url"] == "/v1/chat/completions" for line in lines)
+    assert lines[0]["body"]["max_tokens"] == 100
+
+def test_submit_wait_and_download(tmp_path):
+    with LLMStubServer(batch_delay=0.2) as server:
+        client = BatchJobClient(LLMBackend("local", base_url=server.base_url), poll_interval=0.05)
+        batch_file = str(tmp_path / "job.jsonl")
+        client.write_requests(_requests(4), batch_file)
+        job = client.submit(batch_file, metadata={"stories": "1"})
+        assert job["batch_id"] in server.batches
+
+        # 任务开始前立即超时
+        assert client.wait(job["batch_id"], timeout=0) is None
+        batch = client.wait(job["batch_id"], timeout=10)
+        assert batch.status == "completed"
+        assert batch.request_counts.completed == 4
+
+        results = client.download_results(batch)
+    assert sorted(results) == ["req00", "req01", "req02", "req03"]
+    for result in results.values():
+        assert "scene" in json.loads(result["content"])
+        assert result["usage"]["completion_tokens"] > 0
+
+def test_download_results_skips_failed_requests():
+    body = {"choices": [{"message": {"content": '```json\n{"scene": "a river"}\n```'}}], "usage": {"prompt_tokens": 5}}
+    lines = [
+        {"custom_id": "ok", "response": {"status_code": 200, "body": body}},
+        {"custom_id": "rate_limited", "response": {"status_code": 429, "body": {}}},
+        {"custom_id": "error", "response": None, "error": {"code": "server_error"}}
+    ]
+    with LLMStubServer() as server:
+        output = server.create_file("output.jsonl", "batch_output",
+                                    "".join(json.dumps(line) + "\n" for line in lines).encode("utf-8"))
+        client = BatchJobClient(LLMBackend("local", base_url=server.base_url))
+        results = client.download_results(SimpleNamespace(output_file_id=output["id"]))
+        assert client.download_results(SimpleNamespace(output_file_id=None)) == {}
+    assert results == {"ok": {"content": '{"scene": "a river"}', "usage": {"prompt_tokens": 5}}}
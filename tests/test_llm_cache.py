@@ -0,0 +1,104 @@
+import json
+import random
+from types import SimpleNamespace
+
+import pytest
+
+from llm_cache import LLMResponseCache
+
+MESSAGES = [{"role": "user", "content": "Describe the scene."}]
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = LLMResponseCache(str(tmp_path / "llm_cache.sqlite3"))
+    yield cache
+    cache.close()
+
+def test_get_and_set(cache):
+    key = LLMResponseCache.make_key("gpt-4o-mini", MESSAGES, temperature=0)
+    assert cache.get(key) is None
+    cache.set(key, {"content": "a misty village", "usage": {"prompt_tokens": 5, "completion_tokens": 3}})
+    assert cache.get(key)["content"] == "a misty village"
+    assert (cache.hits, cache.misses) == (1, 1)
+
+def test_key_covers_request_and_backend():
+    key = LLMResponseCache.make_key("gpt-4o-mini", MESSAGES, temperature=0)
+    assert key == LLMResponseCache.make_key("gpt-4o-mini", [dict(message) for message in MESSAGES], temperature=0)
+    assert key != LLMResponseCache.make_key("gpt-4o", MESSAGES, temperature=0)
+    assert key != LLMResponseCache.make_key("gpt-4o-mini", MESSAGES, temperature=0.7)
+    assert key != LLMResponseCache.make_key("gpt-4o-mini", MESSAGES, {"type": "json_object"}, temperature=0)
+    local = LLMResponseCache.make_key("local-model", MESSAGES, backend="local", base_url="http://127.0.0.1:8080/v1")
+    other = LLMResponseCache.make_key("local-model", MESSAGES, backend="local", base_url="http://127.0.0.1:8081/v1")
+    assert local != other
+
+def test_bypass_nondeterministic(tmp_path):
+    cache = LLMResponseCache(str(tmp_path / "llm_cache.sqlite3"), bypass_nondeterministic=True)
+    assert cache.should_bypass(0.7)
+    assert cache.should_bypass(None)
+    assert not cache.should_bypass(0)
+    cache.close()
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = LLMResponseCache(str(tmp_path / "llm_cache.sqlite3"))
+    # 随机内容几乎无法压缩，上限设为能容纳两个条目
+    cache.set("key0", {"content": random.Random(0).randbytes(1024).hex()})
+    entry_size = cache._conn.execute("SELECT size FROM responses").fetchone()[0]
+    cache.max_size = entry_size * 2 + entry_size // 2
+    cache.set("key1", {"content": random.Random(1).randbytes(1024).hex()})
+    assert cache.get("key0") is not None
+    cache.set("key2", {"content": random.Random(2).randbytes(1024).hex()})
+    # 最久未访问的 key1 被淘汰
+    assert cache.get("key1") is None
+    assert cache.get("key0") is not None
+    assert cache.get("key2") is not None
+    cache.close()
+
+def test_persists_across_instances(tmp_path):
+    db_path = str(tmp_path / "llm_cache.sqlite3")
+    cache = LLMResponseCache(db_path)
+    cache.set("key", {"content": "saved"})
+    cache.close()
+    cache = LLMResponseCache(db_path)
+    assert cache.get("key") == {"content": "saved"}
+    cache.close()
+
+class _ScriptedClient:
+    """依次返回预设响应的 LLM 客户端"""
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, **kwargs):
+        content = self.responses[min(self.calls, len(self.responses) - 1)]
+        self.calls += 1
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+                               usage=SimpleNamespace(prompt_tokens=10, completion_tokens=5))
+
+@pytest.mark.parametrize("bad_response, response_format", [
+    ("", None),
+    ("I'm sorry, I can't help with that.", None),
+    ('{"scene": "truncated', {"type": "json_object"}),
+])
+def test_analyzer_does_not_cache_invalid_responses(make_analyzer, bad_response, response_format):
+    client = _ScriptedClient([bad_response, '{"scene": "misty village"}'])
+    messages = [{"role": "user", "content": "Describe the scene."}]
+    analyzer = make_analyzer(client, use_cache=True)
+    assert analyzer._chat_completion(messages, response_format, temperature=0.7) == bad_response
+
+    # 无效的响应没有写入缓存，再次请求时重新调用 API，有效的响应被缓存
+    analyzer = make_analyzer(client, use_cache=True)
+    assert analyzer._chat_completion(messages, response_format, temperature=0.7) == '{"scene": "misty village"}'
+    assert analyzer._chat_completion(messages, response_format, temperature=0.7) == '{"scene": "misty village"}'
+    assert client.calls == 2
+
+def test_analyzer_validate_callback(make_analyzer):
+    client = _ScriptedClient(['{"other": 1}', '{"scene": "misty village"}'])
+    messages = [{"role": "user", "content": "Describe the scene."}]
+    analyzer = make_analyzer(client, use_cache=True)
+    validate = lambda text: json.loads(text)["scene"]
+    analyzer._chat_completion(messages, {"type": "json_object"}, validate=validate)
+    analyzer._chat_completion(messages, {"type": "json_object"}, validate=validate)
+    analyzer._chat_completion(messages, {"type": "json_object"}, validate=validate)
+    assert client.calls == 2
@@ -0,0 +1,48 @@
+import time
+
+from llm_rate_limiter import TokenRateLimiter, estimate_tokens
+from llm_stub import StubLLMClient
+
+def test_estimate_tokens():
+    assert estimate_tokens("abcdefgh") == 3
+    assert estimate_tokens("桃太郎") == 4
+    assert estimate_tokens([{"role": "user", "content": "abcdefgh"}]) == 7
+
+def test_unlimited_never_waits():
+    limiter = TokenRateLimiter(0)
+    start = time.monotonic()
+    for _ in range(100):
+        limiter.acquire(1_000_000)
+    assert time.monotonic() - start < 0.1
+
+def test_waits_when_bucket_is_empty():
+    limiter = TokenRateLimiter(6000)  # 每秒 100 个令牌
+    start = time.monotonic()
+    limiter.acquire(6000)
+    assert time.monotonic() - start < 0.05
+    limiter.acquire(20)
+    assert time.monotonic() - start >= 0.15
+    # 超过桶容量的请求按容量计算，不会永远等待
+    limiter = TokenRateLimiter(60)
+    limiter._available = 60
+    limiter.acquire(1000)
+
+def _story(paragraph_count):
+    return "\n\n".join(f"第{i}段。" + "村の若者は山へ向かい、古い寺で不思議な老人に出会った。" * 12
+                       for i in range(paragraph_count))
+
+def test_segments_are_analyzed_concurrently_in_order(make_analyzer):
+    story = _story(4)
+    client = StubLLMClient(base_latency=0.3)
+    analyzer = make_analyzer(client, max_concurrency=4, tokens_per_minute=0)
+
+    start = time.monotonic()
+    analyzer.analyze_story_in_segments(story, max_segment_length=400)
+    elapsed = time.monotonic() - start
+
+    assert len(analyzer.segment_analyses) == 4
+    # 串行需要 4 * 0.3 秒以上
+    assert elapsed < 0.9
+    # 各段落的起始位置按原文顺序排列
+    for index, offset in enumerate(analyzer.segment_offsets):
+        assert story[offset:].startswith(f"第{index}段。")
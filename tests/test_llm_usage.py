@@ -0,0 +1,56 @@
+import threading
+
+from llm_usage import LLMUsageTracker
+
+def test_summary_per_stage_and_total():
+    tracker = LLMUsageTracker("gpt-4o-mini")
+    tracker.record("analyze", 1000, 200, latency=1.5)
+    tracker.record("analyze", 3000, 400, latency=2.5, cached_prompt_tokens=1024)
+    tracker.record("describe_scene", 500, 100, latency=0.5)
+    tracker.record("describe_scene", 500, 100, latency=0.01, cache_hit=True)
+
+    summary = tracker.summary()
+    analyze = summary["stages"]["analyze"]
+    assert (analyze["calls"], analyze["prompt_tokens"], analyze["completion_tokens"]) == (2, 4000, 600)
+    assert (analyze["avg_prompt_tokens"], analyze["max_prompt_tokens"]) == (2000, 3000)
+    assert analyze["cached_prompt_tokens"] == 1024
+    assert analyze["latency"] == 4.0
+
+    describe = summary["stages"]["describe_scene"]
+    # 缓存命中不计入消耗，计为节省的令牌
+    assert (describe["calls"], describe["cache_hits"], describe["prompt_tokens"]) == (2, 1, 500)
+    assert describe["saved_tokens"] == 600
+
+    total = summary["total"]
+    assert (total["calls"], total["prompt_tokens"], total["completion_tokens"]) == (4, 4500, 700)
+    assert total["max_prompt_tokens"] == 3000
+    assert total["cost_usd"] == round((4500 * 0.15 + 700 * 0.60) / 1_000_000, 6)
+
+def test_unknown_model_has_no_cost():
+    tracker = LLMUsageTracker("local-model")
+    tracker.record("analyze", 100, 10)
+    assert tracker.summary()["total"]["cost_usd"] is None
+    tracker.print_summary()
+
+def test_record_is_thread_safe():
+    tracker = LLMUsageTracker()
+
+    def work():
+        for _ in range(500):
+            tracker.record("analyze", 1, 1)
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert tracker.summary()["total"]["calls"] == 4000
+
+def test_analyzer_records_every_call(make_analyzer):
+    analyzer = make_analyzer(use_cache=True)
+    messages = [{"role": "user", "content": "Describe a misty village."}]
+    analyzer._chat_completion(messages, temperature=0, stage="describe_scene")
+    analyzer._chat_completion(messages, temperature=0, stage="describe_scene")
+    stats = analyzer.usage_tracker.summary()["stages"]["describe_scene"]
+    assert (stats["calls"], stats["cache_hits"]) == (2, 1)
+    assert stats["prompt_tokens"] > 0 and stats["saved_tokens"] > 0
@@ -0,0 +1,91 @@
+import json
+
+import pytest
+
+from pronunciation_dictionary import PronunciationDictionary
+from voicevox_stub import VoiceVoxStubServer
+
+@pytest.fixture
+def voicevox():
+    with VoiceVoxStubServer() as stub:
+        yield stub
+
+def _dictionary(stub, tmp_path):
+    return PronunciationDictionary("127.0.0.1", stub.port, dict_file=str(tmp_path / "voicevox_dict.json"))
+
+def test_add_words_imports_in_one_request(voicevox, tmp_path):
+    dictionary = _dictionary(voicevox, tmp_path)
+    assert dictionary.add_words({"桃太郎": ("モモタロウ", 3), "鬼ヶ島": ("オニガシマ", 2)}) == 2
+
+    assert voicevox.request_counts.get("/import_user_dict") == 1
+    assert "/user_dict_word" not in voicevox.request_counts
+    engine_words = {word["surface"]: word["pronunciation"] for word in voicevox.user_dict.values()}
+    assert engine_words == {"桃太郎": "モモタロウ", "鬼ヶ島": "オニガシマ"}
+    saved = json.loads((tmp_path / "voicevox_dict.json").read_text(encoding="utf-8"))
+    assert set(saved) == {"桃太郎", "鬼ヶ島"}
+    assert set(voicevox.user_dict) == {entry["uuid"] for entry in saved.values()}
+
+def test_add_words_keeps_existing_uuid(voicevox, tmp_path):
+    dictionary = _dictionary(voicevox, tmp_path)
+    dictionary.add_words({"桃太郎": ("モモタロウ", 3)})
+    word_uuid = dictionary.local_dict["桃太郎"]["uuid"]
+    dictionary.add_words({"桃太郎": ("モモタロー", 3)})
+    assert dictionary.local_dict["桃太郎"]["uuid"] == word_uuid
+    assert len(voicevox.user_dict) == 1
+    assert voicevox.user_dict[word_uuid]["pronunciation"] == "モモタロー"
+
+def test_add_words_falls_back_to_single_words(tmp_path):
+    # 旧版本引擎：批量导入失败时逐条添加
+    with VoiceVoxStubServer(failure_rate=1.0, fail_paths={"/import_user_dict"}) as stub:
+        dictionary = _dictionary(stub, tmp_path)
+        assert dictionary.add_words({"桃太郎": ("モモタロウ", 3), "鬼ヶ島": ("オニガシマ", 2)}) == 2
+        assert stub.request_counts.get("/user_dict_word") == 2
+        assert {word["surface"] for word in stub.user_dict.values()} == {"桃太郎", "鬼ヶ島"}
+        assert set(stub.user_dict) == {entry["uuid"] for entry in dictionary.local_dict.values()}
+
+def test_sync_skips_when_fingerprint_unchanged(voicevox, tmp_path):
+    dictionary = _dictionary(voicevox, tmp_path)
+    dictionary.add_words({"桃太郎": ("モモタロウ", 3)})
+    assert dictionary.sync_with_voicevox()
+    dict_file = tmp_path / "voicevox_dict.json"
+    mtime = dict_file.stat().st_mtime_ns
+
+    # 两侧都没有变化：跳过同步，也不重写本地文件
+    reloaded = _dictionary(voicevox, tmp_path)
+    assert not reloaded.sync_with_voicevox()
+    assert dict_file.stat().st_mtime_ns == mtime
+
+def test_sync_readds_words_missing_from_engine(voicevox, tmp_path):
+    dictionary = _dictionary(voicevox, tmp_path)
+    dictionary.add_words({"桃太郎": ("モモタロウ", 3)})
+    dictionary.sync_with_voicevox()
+
+    # 引擎重启后用户词典被清空，指纹不一致，重新添加
+    voicevox.user_dict.clear()
+    assert dictionary.sync_with_voicevox()
+    assert [word["surface"] for word in voicevox.user_dict.values()] == ["桃太郎"]
+    assert not dictionary.sync_with_voicevox()
+
+def test_sync_does_not_save_fingerprint_when_engine_is_unreachable(tmp_path):
+    with VoiceVoxStubServer() as stub:
+        dictionary = _dictionary(stub, tmp_path)
+        dictionary.add_words({"桃太郎": ("モモタロウ", 3)})
+    # 服务器已停止
+    assert not dictionary.sync_with_voicevox()
+    assert not (tmp_path / "voicevox_dict.fingerprint.json").exists()
+
+def test_sync_does_not_save_fingerprint_when_readding_fails(tmp_path):
+    with VoiceVoxStubServer() as stub:
+        dictionary = _dictionary(stub, tmp_path)
+        dictionary.add_words({"桃太郎": ("モモタロウ", 3)})
+        stub.user_dict.clear()
+        stub.failure_rate = 1.0
+        stub.fail_paths = {"/import_user_dict", "/user_dict_word"}
+        assert dictionary.sync_with_voicevox()
+        assert not (tmp_path / "voicevox_dict.fingerprint.json").exists()
+
+        # 引擎恢复后再次同步，条目被重新添加
+        stub.failure_rate = 0.0
+        assert dictionary.sync_with_voicevox()
+        assert [word["surface"] for word in stub.user_dict.values()] == ["桃太郎"]
+        assert not dictionary.sync_with_voicevox()
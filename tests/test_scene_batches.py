@@ -0,0 +1,45 @@
+import json
+
+from llm_stub import StubLLMClient
+
+STORY = "昔々、ある村に太郎という若い侍が住んでいました。\n太郎は毎朝、山の寺へ向かいました。"
+
+def _scenes(count):
+    return [{"scene_id": i + 1, "sentences": [f"太郎は{i + 1}番目の寺へ向かいました。"]} for i in range(count)]
+
+def _analyzed(make_analyzer, **kwargs):
+    client = StubLLMClient()
+    analyzer = make_analyzer(client, **kwargs)
+    analyzer.analyze_story(STORY, "story.txt")
+    return analyzer, client
+
+def test_plan_respects_batch_size_and_token_budget(make_analyzer):
+    analyzer, _ = _analyzed(make_analyzer, scene_batch_size=3, scene_batch_token_budget=100000)
+    assert analyzer._plan_scene_batches(_scenes(7)) == [[0, 1, 2], [3, 4, 5], [6]]
+    # 预算只够一个场景时每个请求一个场景
+    analyzer.scene_batch_token_budget = 1
+    assert analyzer._plan_scene_batches(_scenes(3)) == [[0], [1], [2]]
+
+def test_batch_generation_uses_fewer_requests(make_analyzer):
+    analyzer, _ = _analyzed(make_analyzer, scene_batch_size=4, scene_batch_token_budget=100000)
+    scenes = _scenes(8)
+    analyzer._generate_scene_prompts(scenes)
+    assert analyzer.usage_tracker.stages["describe_scene_batch"]["calls"] == 2
+    assert all(scene["prompt"] for scene in scenes)
+
+def test_invalid_batch_results_are_retried_per_scene(make_analyzer):
+    analyzer, _ = _analyzed(make_analyzer, scene_batch_size=3)
+    scenes = _scenes(3)
+    retried = []
+    analyzer._generate_prompt_for_scene = lambda scene: retried.append(scene["scene_id"]) or "retried prompt"
+    content = json.dumps({"scenes": {"1": "misty temple at dawn", "2": "I'm sorry, I cannot help with that."}})
+
+    analyzer.apply_scene_prompt_results(scenes, {"scene_indexes": [0, 1, 2]}, content)
+    assert retried == [2, 3]
+    assert "misty temple at dawn" in scenes[0]["prompt"]
+    assert scenes[1]["prompt"] == scenes[2]["prompt"] == "retried prompt"
+
+    # 整个响应无法解析时所有场景都单独重试
+    retried.clear()
+    analyzer.apply_scene_prompt_results(scenes, {"scene_indexes": [0, 1, 2]}, "not json")
+    assert retried == [1, 2, 3]
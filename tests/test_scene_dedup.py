@@ -0,0 +1,31 @@
+from scene_dedup import mark_duplicate_scenes
+
+def _scene(scene_id, prompt):
+    return {"scene_id": scene_id, "prompt": prompt, "image_file": f"scene_{scene_id:03d}.png"}
+
+def test_marks_near_identical_neighbours():
+    scenes = [
+        _scene(1, "misty mountain village at dawn, old farmer carrying firewood along a narrow path"),
+        _scene(2, "misty mountain village at dawn, old farmer carrying firewood along the narrow path"),
+        _scene(3, "stormy sea, samurai ship battling huge waves under lightning"),
+    ]
+    assert mark_duplicate_scenes(scenes) == 1
+    assert scenes[1]["reuse_of"] == 1
+    assert scenes[1]["image_file"] == "scene_001.png"
+    assert "reuse_of" not in scenes[2]
+
+def test_chain_points_to_original_scene():
+    prompt = "quiet temple garden, monk sweeping fallen leaves beside a stone lantern"
+    # 出现在所有场景中的词不参与比较，所以加入一个不同的场景
+    scenes = [_scene(1, prompt), _scene(2, prompt), _scene(3, prompt),
+              _scene(4, "burning castle at night, soldiers fleeing across the bridge")]
+    assert mark_duplicate_scenes(scenes) == 2
+    assert scenes[2]["reuse_of"] == 1
+    assert scenes[2]["image_file"] == "scene_001.png"
+
+def test_only_compares_within_window():
+    prompt = "crowded night market, lanterns glowing above food stalls"
+    scenes = [_scene(1, prompt), _scene(2, "desert caravan crossing dunes under a blazing sun"), _scene(3, prompt)]
+    assert mark_duplicate_scenes(scenes, window=1) == 0
+    assert mark_duplicate_scenes(scenes, window=2) == 1
+    assert scenes[2]["reuse_of"] == 1
@@ -0,0 +1,35 @@
+from llm_stub import StubLLMClient
+
+STORY = "昔々、ある村に太郎という若い侍が住んでいました。\n太郎は毎朝、山の寺へ向かいました。"
+SENTENCES = ["太郎は毎朝、山の寺へ向かいました。"]
+
+def _analyzed(make_analyzer, mode):
+    client = StubLLMClient()
+    analyzer = make_analyzer(client, scene_prompt_mode=mode)
+    analyzer.analyze_story(STORY, "story.txt")
+    return analyzer, client
+
+def test_single_call_skips_context_translation(make_analyzer):
+    two_call, two_call_client = _analyzed(make_analyzer, "two_call")
+    single_call, single_call_client = _analyzed(make_analyzer, "single_call")
+    before = (two_call_client.calls, single_call_client.calls)
+
+    assert two_call.generate_scene_prompt(SENTENCES)
+    assert single_call.generate_scene_prompt(SENTENCES)
+
+    assert "translate_context" in two_call.usage_tracker.stages
+    assert "translate_context" not in single_call.usage_tracker.stages
+    assert single_call.usage_tracker.stages["describe_scene_single_call"]["calls"] == 1
+    assert single_call_client.calls - before[1] == two_call_client.calls - before[0] - 1
+
+def test_single_call_returns_scene_field(make_analyzer):
+    analyzer, _ = _analyzed(make_analyzer, "single_call")
+    setting = ("Japanese", "Edo", "1700s", "realistic")
+    description = analyzer._describe_scene_single_call(SENTENCES[0], setting, ["Taro: role: samurai"])
+    assert description and not description.startswith("{")
+
+def test_single_call_falls_back_to_raw_text(make_analyzer):
+    analyzer, _ = _analyzed(make_analyzer, "single_call")
+    analyzer._chat_completion = lambda **kwargs: " misty temple at dawn "
+    setting = ("Japanese", "Edo", "1700s", "realistic")
+    assert analyzer._describe_scene_single_call(SENTENCES[0], setting, []) == "misty temple at dawn"
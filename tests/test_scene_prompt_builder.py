@@ -0,0 +1,65 @@
+import json
+
+from scene_prompt_builder import (ScenePromptBuilder, TRUNCATION_MARK, DESCRIBE_SCENE_SYSTEM_MESSAGE,
+                                  BATCH_SYSTEM_MESSAGE, count_tokens, truncate_tokens)
+
+SETTING = ("Japanese", "fishing village", "Edo period", "ukiyo-e")
+
+def test_truncate_tokens_keeps_start_or_end():
+    text = " ".join(f"word{i}" for i in range(200))
+    head = truncate_tokens(text, 20)
+    tail = truncate_tokens(text, 20, keep_end=True)
+    assert head.startswith("word0 ") and head.endswith(TRUNCATION_MARK)
+    assert tail.startswith(TRUNCATION_MARK) and tail.endswith("word199")
+    assert count_tokens(head) <= 21 and count_tokens(tail) <= 21
+    # 不超过上限时不截断
+    assert truncate_tokens("short text", 20) == "short text"
+    assert truncate_tokens(text, 0) == text
+
+def test_static_system_message_and_compressed_user_message():
+    builder = ScenePromptBuilder(context_tokens=30, character_tokens=10)
+    context = "海辺の村で漁師が網を引いている。" * 50
+    messages = builder.describe_scene(context, SETTING, ["a young fisherman " * 20])
+    # 系统消息与场景无关，每次请求相同
+    assert messages[0] == builder.describe_scene("別の場面。", SETTING, [])[0]
+    assert messages[0]["content"] == DESCRIBE_SCENE_SYSTEM_MESSAGE
+    user = messages[1]["content"]
+    assert TRUNCATION_MARK in user and "Culture: Japanese" in user
+    assert builder.prompt_size(messages)["user"] < count_tokens(context)
+
+def test_prompt_size():
+    builder = ScenePromptBuilder()
+    messages = [{"role": "system", "content": "You describe scenes."},
+                {"role": "user", "content": "A misty village at dawn."},
+                {"role": "assistant", "content": None}]
+    size = builder.prompt_size(messages)
+    assert size["system"] == count_tokens("You describe scenes.")
+    assert size["user"] == count_tokens("A misty village at dawn.")
+    assert size["total"] == size["system"] + size["user"]
+
+def test_batch_lists_shared_characters_once():
+    builder = ScenePromptBuilder()
+    fisherman = "young fisherman with a straw hat"
+    messages = builder.describe_scene_batch([
+        {"scene_id": 0, "text": "太郎は海へ行った。", "characters": [fisherman]},
+        {"scene_id": 1, "text": "太郎は亀を助けた。", "previous": "太郎は海へ行った。", "characters": [fisherman]}
+    ], SETTING)
+    assert messages[0]["content"] == BATCH_SYSTEM_MESSAGE
+    user = messages[1]["content"]
+    assert user.count(fisherman) == 1
+    scenes = json.loads(user.split("Scenes:\n")[1].split("\n\n")[0])
+    assert [scene["characters"] for scene in scenes] == [["C1"], ["C1"]]
+    assert "previous" not in scenes[0] and scenes[1]["previous"] == "太郎は海へ行った。"
+
+def test_usage_summary_lists_prompt_size_per_call(make_analyzer):
+    analyzer = make_analyzer(use_cache=True)
+    messages = [{"role": "system", "content": "You describe scenes."},
+                {"role": "user", "content": "Describe a misty village."}]
+    analyzer._chat_completion(messages, temperature=0, stage="describe_scene")
+    analyzer._chat_completion(messages, temperature=0, stage="describe_scene")
+    calls = analyzer.usage_tracker.summary()["calls"]
+    expected = analyzer.prompt_builder.prompt_size(messages)
+    assert [call["cache_hit"] for call in calls] == [False, True]
+    for call in calls:
+        assert call["stage"] == "describe_scene"
+        assert (call["system"], call["user"], call["total"]) == (expected["system"], expected["user"], expected["total"])
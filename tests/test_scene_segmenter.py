@@ -0,0 +1,29 @@
+from scene_segmenter import segment_scenes, boundary_costs, PARAGRAPH_CUT_COST
+
+def _assert_covers(segments, n):
+    """场景连续且覆盖所有句子"""
+    assert segments[0][0] == 0 and segments[-1][1] == n
+    for (_, end), (start, _) in zip(segments, segments[1:]):
+        assert end == start
+
+def test_empty_input():
+    assert segment_scenes([]) == []
+
+def test_respects_max_duration():
+    durations = [2.0] * 20
+    segments = segment_scenes(durations, min_duration=3.0, max_duration=8.0)
+    _assert_covers(segments, len(durations))
+    assert all(sum(durations[start:end]) <= 8.0 for start, end in segments)
+
+def test_target_count():
+    durations = [1.5, 2.0, 3.0, 1.0, 2.5, 2.0, 1.0, 3.0, 2.0, 2.0, 1.5, 2.5]
+    segments = segment_scenes(durations, target_count=4)
+    _assert_covers(segments, len(durations))
+    assert len(segments) == 4
+
+def test_prefers_paragraph_breaks():
+    sentences = ["一。", "二。", "三。", "四。", "五。", "六。"]
+    text = "一。二。三。\n四。五。六。"
+    costs = boundary_costs(sentences, text)
+    assert costs[2] == PARAGRAPH_CUT_COST
+    assert segment_scenes([2.0] * 6, costs, target_count=2) == [(0, 3), (3, 6)]
@@ -0,0 +1,65 @@
+import pytest
+
+# 两个段落都以同样的句子开头
+SEGMENTS = ["ある日のこと。太郎は海へ行った。", "ある日のこと。太郎は山へ行った。"]
+STORY = "\n\n".join(SEGMENTS)
+SENTENCES = ["ある日のこと。", "太郎は海へ行った。", "ある日のこと。", "太郎は山へ行った。"]
+
+@pytest.fixture
+def analyzer(make_analyzer):
+    analyzer = make_analyzer()
+    analyzer.story_text = STORY
+    analyzer.segment_analyses = [{"characters": {}}, {"characters": {}}]
+    analyzer.segment_offsets = [0, STORY.index(SEGMENTS[1])]
+    return analyzer
+
+def _offsets(sentences, text):
+    offsets = []
+    cursor = 0
+    for sentence in sentences:
+        start = text.index(sentence, cursor)
+        cursor = start + len(sentence)
+        offsets.append((start, cursor))
+    return offsets
+
+def test_offsets_map_repeated_openings_to_their_segments(analyzer):
+    offsets = _offsets(SENTENCES, STORY)
+    assert analyzer._map_sentences_to_segments(SENTENCES, offsets, len(STORY)) == [0, 0, 1, 1]
+
+def test_search_continues_from_previous_sentence(analyzer):
+    assert analyzer._map_sentences_to_segments(SENTENCES) == [0, 0, 1, 1]
+    # 从上一句的位置继续查找
+    assert analyzer._find_segment_for_sentences(SENTENCES[2:], start=STORY.index("太郎は海")) == 1
+    assert analyzer._find_segment_for_sentences(SENTENCES[2:]) == 0
+
+def test_offsets_from_different_text_are_ignored(analyzer):
+    # 位置来自另一个文本（例如读取后被修改过）时改为按句子内容查找
+    other = "前書き。" + STORY
+    offsets = _offsets(SENTENCES, other)
+    assert analyzer._map_sentences_to_segments(SENTENCES, offsets, len(other)) == [0, 0, 1, 1]
+
+def test_unknown_sentence_keeps_previous_segment(analyzer):
+    sentences = ["太郎は山へ行った。", "存在しない文。"]
+    assert analyzer._map_sentences_to_segments(sentences) == [1, 1]
+
+def test_even_split_without_story_text(analyzer):
+    analyzer.story_text = None
+    assert analyzer._map_sentences_to_segments(SENTENCES) == [0, 0, 1, 1]
+
+def test_identify_key_scenes_uses_sentence_offsets(analyzer):
+    offsets = _offsets(SENTENCES, STORY)
+    scenes = analyzer.identify_key_scenes(SENTENCES, [3.0] * len(SENTENCES), generate_prompts=False,
+                                          sentence_offsets=offsets, source_length=len(STORY))
+    for scene in scenes:
+        assert scene["segment_index"] == (0 if scene["start_index"] < 2 else 1)
+
+def test_text_processor_sentence_offsets():
+    pytest.importorskip("MeCab")
+    from text_processor import TextProcessor
+
+    processor = TextProcessor()
+    sentences = processor.process_japanese_text(STORY)
+    assert processor.source_length == len(STORY)
+    assert len(processor.sentence_offsets) == len(sentences)
+    for sentence, (start, end) in zip(sentences, processor.sentence_offsets):
+        assert STORY[start:end].strip() == sentence
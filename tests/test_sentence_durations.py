@@ -0,0 +1,35 @@
+import json
+
+from story_analyzer import DEFAULT_SENTENCE_DURATION
+
+AUDIO_FILES = [
+    {"id": 0, "sentence": "はい。", "audio_file": "story/a.wav", "duration": 0.6},
+    {"id": 1, "sentence": "太郎は山へ行った。", "audio_file": "story/b.wav", "duration": 2.4},
+    {"id": 2, "sentence": "はい。", "audio_file": "story/c.wav", "duration": 0.9},
+    {"id": 3, "sentence": "失敗した。", "error": "synthesis failed"},
+]
+
+def test_repeated_sentences_use_their_own_duration(make_analyzer, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    info_file = tmp_path / "output/audio/story_audio_info.json"
+    info_file.parent.mkdir(parents=True)
+    info_file.write_text(json.dumps({"audio_files": AUDIO_FILES}, ensure_ascii=False), encoding="utf-8")
+
+    analyzer = make_analyzer()
+    analyzer.input_file = "story.txt"
+    assert analyzer.get_sentence_duration("はい。", 0) == 0.6
+    assert analyzer.get_sentence_duration("はい。", 2) == 0.9
+
+    # 音频信息只读取一次
+    info_file.unlink()
+    assert analyzer.get_sentence_duration("太郎は山へ行った。", 1) == 2.4
+    # 没有位置信息时按文本查找（重复的句子使用第一次出现的时长）
+    assert analyzer.get_sentence_duration("はい。") == 0.6
+    assert analyzer.get_sentence_duration("失敗した。", 3) == DEFAULT_SENTENCE_DURATION
+    assert analyzer.get_sentence_duration("知らない句子。") == DEFAULT_SENTENCE_DURATION
+
+def test_explicit_audio_files(make_analyzer):
+    analyzer = make_analyzer()
+    timeline = analyzer.load_audio_timeline(AUDIO_FILES)
+    assert timeline == [0.6, 2.4, 0.9, None]
+    assert analyzer.get_sentence_duration("はい。", 2, timeline) == 0.9
@@ -0,0 +1,41 @@
+from llm_stub import StubLLMClient
+
+CHARACTERS = {
+    "太郎": {"role": "若い侍", "appearance": "背が高い", "gender": "男性"},
+    "花子": {"role": "村娘", "appearance": "赤い着物", "gender": "女性"},
+}
+
+def test_setting_is_translated_once(make_analyzer):
+    client = StubLLMClient()
+    analyzer = make_analyzer(client)
+    first = analyzer._translate_setting("日本", "江戸", "江戸時代", "写実")
+    assert analyzer._translate_setting("日本", "江戸", "江戸時代", "写実") == first
+    assert client.calls == 1
+    analyzer._translate_setting("日本", "京都", "平安時代", "写実")
+    assert client.calls == 2
+
+def test_characters_are_translated_once(make_analyzer):
+    client = StubLLMClient()
+    analyzer = make_analyzer(client)
+    translated = analyzer._translate_characters(CHARACTERS)
+    assert set(translated) == set(CHARACTERS)
+    assert client.calls == 1
+
+    # 已翻译的角色不再请求，只翻译新增和信息变化的角色
+    analyzer._translate_characters({"花子": CHARACTERS["花子"]})
+    assert client.calls == 1
+    analyzer._translate_characters(dict(CHARACTERS, 次郎={"role": "商人", "appearance": "太った", "gender": "男性"}))
+    assert client.calls == 2
+    changed = dict(CHARACTERS["太郎"], appearance="傷のある顔")
+    analyzer._translate_characters({"太郎": changed})
+    assert client.calls == 3
+
+def test_final_prompt_has_no_field_labels(make_analyzer):
+    analyzer = make_analyzer()
+    prompt = analyzer._compose_final_prompt(
+        "a scene", "Japanese", "Edo", "1700s",
+        ["Taro: role: soldier, appearance: tall, scarred face, gender: male", "Hanako: appearance: red kimono"])
+    assert "soldier with tall, scarred face, male" in prompt
+    assert "red kimono" in prompt
+    for label in ("role:", "appearance:", "gender:"):
+        assert label not in prompt
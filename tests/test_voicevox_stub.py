@@ -0,0 +1,35 @@
+import wave
+
+import requests
+
+from voice_generator import VoiceVoxGenerator
+from voicevox_stub import VoiceVoxStubServer
+
+def _duration(path):
+    with wave.open(str(path), "rb") as wav_file:
+        return wav_file.getnframes() / wav_file.getframerate()
+
+def test_synthesize_is_deterministic(tmp_path):
+    with VoiceVoxStubServer() as stub:
+        generator = VoiceVoxGenerator("127.0.0.1", stub.port)
+        first = generator.synthesize("桃太郎は鬼ヶ島へ行った。", tmp_path / "first.wav")
+        second = generator.synthesize("桃太郎は鬼ヶ島へ行った。", tmp_path / "second.wav")
+        assert first > 0 and first == second
+        assert (tmp_path / "first.wav").read_bytes() == (tmp_path / "second.wav").read_bytes()
+        assert stub.request_counts == {"/audio_query": 2, "/synthesis": 2}
+
+def test_user_dictionary_changes_duration(tmp_path):
+    with VoiceVoxStubServer() as stub:
+        generator = VoiceVoxGenerator("127.0.0.1", stub.port)
+        before = generator.synthesize("桃", tmp_path / "before.wav")
+        requests.post(f"{stub.base_url}/user_dict_word", params={"surface": "桃", "pronunciation": "モモタロウ"})
+        after = generator.synthesize("桃", tmp_path / "after.wav")
+        assert after > before
+        assert _duration(tmp_path / "after.wav") == after
+
+def test_failure_injection(tmp_path):
+    with VoiceVoxStubServer(failure_rate=1.0, fail_paths={"/synthesis"}) as stub:
+        generator = VoiceVoxGenerator("127.0.0.1", stub.port)
+        assert generator.synthesize("桃太郎", tmp_path / "failed.wav") is None
+        response = requests.post(f"{stub.base_url}/audio_query", params={"text": "桃太郎", "speaker": 1})
+        assert response.status_code == 200
@@ -0,0 +1,67 @@
+import copy
+import json
+from pathlib import Path
+
+import pytest
+
+from workflow_template import (WorkflowTemplate, WEBSOCKET_OUTPUT_TYPE, available_workflows, load_workflow_template,
+                               resolve_workflow_path)
+
+WORKFLOWS_DIR = str(Path(__file__).resolve().parent.parent / "workflows")
+
+def test_available_workflows():
+    assert available_workflows(WORKFLOWS_DIR) == ["Base", "waterink"]
+    with pytest.raises(FileNotFoundError):
+        resolve_workflow_path("missing", WORKFLOWS_DIR)
+
+# Base 中的 LoRA 节点没有连接到输出
+@pytest.mark.parametrize("name, has_lora", [("Base", False), ("waterink", True)])
+def test_render_bundled_workflow(name, has_lora):
+    template = load_workflow_template(name, WORKFLOWS_DIR)
+    original = copy.deepcopy(template.workflow)
+    workflow = template.render(1234, "a misty village", "blurry", lora_name="style.safetensors",
+                               width=768, height=512, websocket_output=True)
+
+    assert workflow[template.sampler_id]["inputs"][template.seed_input] == 1234
+    assert workflow[template.positive_id]["inputs"]["text"] == "a misty village"
+    assert workflow[template.negative_id]["inputs"]["text"] == "blurry"
+    assert template.has_lora == has_lora
+    assert all(workflow[node_id]["inputs"]["lora_name"] == "style.safetensors" for node_id in template.lora_ids)
+    latent = workflow[template.latent_id]["inputs"]
+    assert (latent["width"], latent["height"]) == (768, 512)
+    assert latent["batch_size"] == original[template.latent_id]["inputs"]["batch_size"]
+    for node_id in template.output_ids:
+        assert workflow[node_id]["class_type"] == WEBSOCKET_OUTPUT_TYPE
+        assert workflow[node_id]["inputs"]["images"] == original[node_id]["inputs"]["images"]
+
+    # 模板本身不被修改，未修改的节点与模板共用
+    assert template.workflow == original
+    assert workflow["10"] is template.workflow["10"]
+    json.dumps(workflow)
+
+def test_render_keeps_template_settings_by_default():
+    template = load_workflow_template("waterink", WORKFLOWS_DIR)
+    workflow = template.render(1, "a", "b")
+    for node_id in template.lora_ids + [template.latent_id] + template.output_ids:
+        assert workflow[node_id] is template.workflow[node_id]
+
+def test_template_is_loaded_once():
+    assert load_workflow_template("Base", WORKFLOWS_DIR) is load_workflow_template("Base", WORKFLOWS_DIR)
+
+def test_finds_nodes_by_links_without_titles():
+    workflow = {
+        "1": {"class_type": "CheckpointLoaderSimple", "inputs": {}},
+        "2": {"class_type": "CLIPTextEncode", "inputs": {"text": "", "clip": ["1", 1]}},
+        "3": {"class_type": "CLIPTextEncode", "inputs": {"text": "", "clip": ["1", 1]}},
+        "4": {"class_type": "KSamplerAdvanced", "inputs": {"noise_seed": 0, "model": ["1", 0], "positive": ["3", 0],
+                                                           "negative": ["2", 0]}},
+        "5": {"class_type": "SaveImage", "inputs": {"images": ["4", 0]}},
+        # 未连接到输出的 LoRA 节点不修改
+        "6": {"class_type": "LoraLoader", "inputs": {"lora_name": "unused"}}
+    }
+    template = WorkflowTemplate(workflow)
+    assert (template.sampler_id, template.positive_id, template.negative_id) == ("4", "3", "2")
+    assert not template.has_lora and template.size is None
+    workflow = template.render(7, "positive", "negative", lora_name="style.safetensors")
+    assert workflow["4"]["inputs"]["noise_seed"] == 7
+    assert workflow["6"]["inputs"]["lora_name"] == "unused"
@@ -6,6 +6,8 @@ class TextProcessor:
         """初始化 MeCab"""
         self.mecab = MeCab.Tagger()
         self.max_chars_per_line = 35  # 增加字符限制
+        self.sentence_offsets = []  # 最近一次处理的每个句子在原文中的 (起始, 结束) 字符位置
+        self.source_length = 0      # sentence_offsets 对应的原文长度，用于确认与故事分析使用的是同一文本
     
     def _split_long_sentence(self, sentence):
         """使用 MeCab 进行更智能的长句分割"""
@@ -166,13 +168,26 @@ class TextProcessor:
         
         return text
 
+    def _add_sentence(self, sentences, sentence, start, end):
+        """添加句子并记录其在原文中的位置，长句分割后的各部分按长度依次分配位置"""
+        parts = self._split_long_sentence(sentence) if len(sentence) > self.max_chars_per_line else [sentence]
+        for i, part in enumerate(parts):
+            part_end = end if i == len(parts) - 1 else min(start + len(part), end)
+            sentences.append(part)
+            self.sentence_offsets.append((start, part_end))
+            start = part_end
+
     def process_japanese_text(self, text):
-        """使用 MeCab 处理日语文本"""
+        """使用 MeCab 处理日语文本，同时在 sentence_offsets 中记录每个句子在原文中的位置"""
         # 首先用 MeCab 进行分词
         parsed = self.mecab.parse(text)
         sentences = []
+        self.sentence_offsets = []
+        self.source_length = len(text)
         current = ""
         quote_stack = []  # 用于追踪引号
+        cursor = 0        # 原文中已处理到的位置
+        sentence_start = None
         
         # 处理 MeCab 的输出
         for line in parsed.split('\n'):
@@ -183,6 +198,13 @@ class TextProcessor:
             surface = line.split('\t')[0]
             features = line.split('\t')[1].split(',')
             
+            # 在原文中定位当前词（MeCab 会丢弃空白和换行）
+            position = text.find(surface, cursor)
+            if position != -1:
+                if sentence_start is None:
+                    sentence_start = position
+                cursor = position + len(surface)
+            
             # 处理引号
             if surface in ['「', '『']:
                 quote_stack.append(surface)
@@ -208,13 +230,10 @@ class TextProcessor:
                     current = self._fix_quote_position(current.strip())
                     
                     # 如果当前句子太长，进行分割
-                    if len(current) > self.max_chars_per_line:
-                        parts = self._split_long_sentence(current)
-                        sentences.extend(parts)
-                    else:
-                        sentences.append(current)
+                    self._add_sentence(sentences, current, sentence_start if sentence_start is not None else cursor, cursor)
                 current = ""
                 quote_stack = []  # 重置引号栈
+                sentence_start = None
                 
         # 处理最后一个句子
         if current.strip():
@@ -225,11 +244,7 @@ class TextProcessor:
             # 修复引号位置
             current = self._fix_quote_position(current.strip())
             
-            if len(current) > self.max_chars_per_line:
-                parts = self._split_long_sentence(current)
-                sentences.extend(parts)
-            else:
-                sentences.append(current)
+            self._add_sentence(sentences, current, sentence_start if sentence_start is not None else cursor, cursor)
                 
         return sentences 
 
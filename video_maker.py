@@ -158,6 +158,17 @@ def create_merged_audio(audio_info_file: str, output_file: str):
         print(f"清理临时文件时出错: {e}")
         print("继续处理...")
 
+def _audio_format_args(audio_format) -> list:
+    """根据音频信息中的格式生成 FFmpeg 音频参数"""
+    if not audio_format:
+        return []
+    args = []
+    if audio_format.get('sampling_rate'):
+        args.extend(['-ar', str(audio_format['sampling_rate'])])
+    if audio_format.get('channels'):
+        args.extend(['-ac', str(audio_format['channels'])])
+    return args
+
 def create_base_video(audio_info_file: str, output_file: str, resolution=(1920, 1080)):
     """创建基础黑色背景视频"""
     # 确保输出目录存在
@@ -177,16 +188,18 @@ def create_base_video(audio_info_file: str, output_file: str, resolution=(1920,
     
     # 3. 创建带音频的黑色背景视频
     print("创建基础视频...")
-    subprocess.run([
+    cmd = [
         'ffmpeg', '-y',
         '-f', 'lavfi',
         '-i', f'color=c=black:s={width}x{height}:d={duration}',
         '-i', str(merged_audio),  # 使用合并后的音频
         '-c:v', 'libx264',
-        '-c:a', 'aac',
-        '-shortest',
-        output_file
-    ])
+        '-c:a', 'aac'
+    ]
+    # 保持中间音频的采样率和声道数，避免编码时无意义的升采样
+    cmd.extend(_audio_format_args(info.get('audio_format')))
+    cmd.extend(['-shortest', output_file])
+    subprocess.run(cmd)
     
     # 清理临时文件
     merged_audio.unlink()
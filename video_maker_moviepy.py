@@ -20,6 +20,9 @@ def create_video_with_scenes_moviepy(key_scenes_file: str, input_video: str, out
     # 为每个场景设置固定的随机种子，确保效果一致
     random.seed(42)
     
+    # 记录每张图片使用过的效果，共用图片的场景换一种效果
+    used_effects = {}
+    
     for scene in scenes:
         try:
             # 获取场景时间信息
@@ -43,6 +46,9 @@ def create_video_with_scenes_moviepy(key_scenes_file: str, input_video: str, out
             # 随机选择电影效果类型 (简化为只有3种效果)
             # 0=缓慢平移, 1=缓慢放大, 2=缓慢缩小
             effect_type = random.randint(0, 2)
+            if scene.get('reuse_of') and used_effects.get(scene['image_file']) == effect_type:
+                effect_type = (effect_type + 1) % 3
+            used_effects[scene['image_file']] = effect_type
             
             # 加载图片
             img_clip = ImageClip(img_path)
@@ -5,11 +5,31 @@ import time
 from pathlib import Path
 from typing import Dict
 
+# 项目统一的音频输出配置
+# sampling_rate / stereo 为 None 时使用 VOICEVOX 引擎默认值
+# 中间文件最终会被合并并重新编码为 AAC，24kHz 单声道 PCM 已足够，且文件体积最小
+AUDIO_PROFILES = {
+    "intermediate": {"sampling_rate": 24000, "stereo": False},  # 默认：24kHz 单声道
+    "high_quality": {"sampling_rate": 48000, "stereo": True},   # 高质量：48kHz 立体声
+    "engine_default": {"sampling_rate": None, "stereo": None}   # 不修改引擎输出格式
+}
+DEFAULT_AUDIO_PROFILE = "intermediate"
+
 class VoiceVoxGenerator:
-    def __init__(self, host="127.0.0.1", port="50021", speaker=8):  # 默认使用 8 号角色
+    def __init__(self, host="127.0.0.1", port="50021", speaker=8,  # 默认使用 8 号角色
+                 audio_profile=DEFAULT_AUDIO_PROFILE, output_sampling_rate=None, output_stereo=None):
         self.base_url = f"http://{host}:{port}"
         self.speaker = speaker
         
+        # 设置音频输出格式（单独指定的采样率/声道优先于配置）
+        self.output_sampling_rate = None
+        self.output_stereo = None
+        self.set_audio_profile(audio_profile)
+        if output_sampling_rate is not None:
+            self.output_sampling_rate = int(output_sampling_rate)
+        if output_stereo is not None:
+            self.output_stereo = bool(output_stereo)
+        
         # VOICEVOX 角色列表
         self.speakers = {
             1: "四国めたん",
@@ -40,12 +60,42 @@ class VoiceVoxGenerator:
             return True
         return False
     
+    def set_audio_profile(self, profile_name: str):
+        """设置音频输出配置（见 AUDIO_PROFILES）"""
+        if profile_name not in AUDIO_PROFILES:
+            print(f"未知音频配置: {profile_name}，可用配置: {', '.join(AUDIO_PROFILES.keys())}")
+            return False
+        profile = AUDIO_PROFILES[profile_name]
+        self.audio_profile = profile_name
+        self.output_sampling_rate = profile["sampling_rate"]
+        self.output_stereo = profile["stereo"]
+        return True
+    
+    def get_audio_format(self):
+        """获取当前输出格式，未指定时返回 None（使用引擎默认值）"""
+        if self.output_sampling_rate is None and self.output_stereo is None:
+            return None
+        audio_format = {}
+        if self.output_sampling_rate is not None:
+            audio_format["sampling_rate"] = self.output_sampling_rate
+        if self.output_stereo is not None:
+            audio_format["channels"] = 2 if self.output_stereo else 1
+        return audio_format
+    
+    def _apply_output_format(self, query):
+        """将输出采样率和声道设置写入音频查询参数"""
+        if self.output_sampling_rate is not None:
+            query["outputSamplingRate"] = self.output_sampling_rate
+        if self.output_stereo is not None:
+            query["outputStereo"] = self.output_stereo
+        return query
+    
     def get_audio_query(self, text, speaker=None):
         """获取音频查询参数"""
         speaker = speaker or self.speaker
         params = {"text": text, "speaker": speaker}
         response = requests.post(f"{self.base_url}/audio_query", params=params)
-        return response.json()
+        return self._apply_output_format(response.json())
     
     def get_audio_duration(self, text, speaker=1):
         """获取音频时长（秒）"""
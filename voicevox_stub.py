@@ -0,0 +1,382 @@
+import io
+import json
+import re
+import time
+import uuid
+import wave
+import random
+import hashlib
+import threading
+import argparse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+import numpy as np
+
+# 标点符号（不计入音拍，作为短语分隔）
+PUNCTUATION = set("。、，！？「」『』（）()・…―ー.,!?\"' \n\t")
+# 拗音等小字不单独计为音拍
+SMALL_KANA = set("ゃゅょぁぃぅぇぉャュョァィゥェォ")
+
+class VoiceVoxStubServer:
+    """进程内的 VOICEVOX 模拟服务器，用于离线测试和性能测试
+
+    实现 /audio_query、/synthesis、/accent_phrases、/user_dict、/user_dict_word
+    和 /import_user_dict 接口。合成结果是确定性的正弦音，时长按音拍数估算，
+    并可配置响应延迟和失败注入。
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, failure_rate=0.0, fail_paths=None,
+                 seed=0, sampling_rate=24000, mora_length=0.12, pause_length=0.3):
+        """初始化模拟服务器
+
+        Args:
+            host: 监听地址
+            port: 监听端口，0 表示自动分配
+            latency: 每个请求的额外延迟（秒）
+            failure_rate: 请求失败的概率（0-1），失败时返回 500
+            fail_paths: 只对这些路径注入失败（例如 {"/synthesis"}），None 表示所有路径
+            seed: 失败注入使用的随机种子，保证结果可复现
+            sampling_rate: 默认输出采样率
+            mora_length: 每个音拍的时长（秒）
+            pause_length: 标点处停顿的时长（秒）
+        """
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.fail_paths = set(fail_paths) if fail_paths else None
+        self.sampling_rate = sampling_rate
+        self.mora_length = mora_length
+        self.pause_length = pause_length
+
+        self.user_dict = {}
+        self.request_counts = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.port}"
+
+    def start(self):
+        """在后台线程中启动服务器"""
+        stub = self
+
+        class Handler(_StubRequestHandler):
+            server_stub = stub
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        print(f"VOICEVOX 模拟服务器已启动: {self.base_url}")
+        return self
+
+    def stop(self):
+        """停止服务器"""
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def _should_fail(self, path):
+        """根据配置决定本次请求是否注入失败"""
+        if self.failure_rate <= 0:
+            return False
+        if self.fail_paths is not None and path not in self.fail_paths:
+            return False
+        with self._lock:
+            return self._random.random() < self.failure_rate
+
+    def _count(self, path):
+        with self._lock:
+            self.request_counts[path] = self.request_counts.get(path, 0) + 1
+
+    def _apply_user_dict(self, text):
+        """用用户词典中的读音替换文本中的词语，使词典修改能影响合成时长"""
+        with self._lock:
+            words = sorted(self.user_dict.values(), key=lambda w: len(w["surface"]), reverse=True)
+        for word in words:
+            if word["surface"] in text:
+                text = text.replace(word["surface"], word["pronunciation"])
+        return text
+
+    def build_accent_phrases(self, text):
+        """将文本转换为 VOICEVOX 格式的 accent_phrases"""
+        text = self._apply_user_dict(text)
+        phrases = []
+        moras = []
+        for char in text:
+            if char in PUNCTUATION:
+                if moras:
+                    phrases.append(self._make_phrase(moras, pause=True))
+                    moras = []
+                continue
+            if char in SMALL_KANA and moras:
+                moras[-1]["text"] += char
+                continue
+            # 汉字通常对应两个音拍
+            count = 2 if "一" <= char <= "鿿" else 1
+            for _ in range(count):
+                moras.append({
+                    "text": char,
+                    "consonant": None,
+                    "consonant_length": None,
+                    "vowel": "a",
+                    "vowel_length": self.mora_length,
+                    "pitch": 5.5
+                })
+        if moras:
+            phrases.append(self._make_phrase(moras, pause=False))
+        return phrases
+
+    def _make_phrase(self, moras, pause):
+        pause_mora = None
+        if pause:
+            pause_mora = {
+                "text": "、",
+                "consonant": None,
+                "consonant_length": None,
+                "vowel": "pau",
+                "vowel_length": self.pause_length,
+                "pitch": 0.0
+            }
+        return {"moras": moras, "accent": 1, "pause_mora": pause_mora, "is_interrogative": False}
+
+    def build_audio_query(self, text):
+        """生成音频查询参数"""
+        return {
+            "accent_phrases": self.build_accent_phrases(text),
+            "speedScale": 1.0,
+            "pitchScale": 0.0,
+            "intonationScale": 1.0,
+            "volumeScale": 1.0,
+            "prePhonemeLength": 0.1,
+            "postPhonemeLength": 0.1,
+            "outputSamplingRate": self.sampling_rate,
+            "outputStereo": False,
+            "kana": text
+        }
+
+    def synthesize(self, query, speaker=0):
+        """根据查询参数生成确定性的 WAV 数据"""
+        speech_length = 0.0
+        for phrase in query.get("accent_phrases", []):
+            for mora in phrase.get("moras", []):
+                speech_length += (mora.get("consonant_length") or 0) + (mora.get("vowel_length") or 0)
+            if phrase.get("pause_mora"):
+                speech_length += phrase["pause_mora"].get("vowel_length") or 0
+        speech_length /= max(query.get("speedScale", 1.0), 0.1)
+
+        rate = int(query.get("outputSamplingRate") or self.sampling_rate)
+        lead = int(rate * query.get("prePhonemeLength", 0.1))
+        tail = int(rate * query.get("postPhonemeLength", 0.1))
+        body = int(rate * speech_length)
+
+        # 频率由文本和说话人决定，保证相同输入得到相同输出
+        digest = hashlib.md5(f"{speaker}:{query.get('kana', '')}".encode("utf-8")).digest()
+        frequency = 180 + digest[0] % 120
+        amplitude = 0.3 * query.get("volumeScale", 1.0)
+        t = np.arange(body) / rate
+        tone = amplitude * np.sin(2 * np.pi * frequency * t)
+        samples = np.concatenate((np.zeros(lead), tone, np.zeros(tail)))
+        samples = np.clip(samples * 32767, -32768, 32767).astype("<i2")
+        channels = 2 if query.get("outputStereo") else 1
+        if channels == 2:
+            samples = np.repeat(samples, 2)
+
+        buffer = io.BytesIO()
+        with wave.open(buffer, "wb") as wav_file:
+            wav_file.setnchannels(channels)
+            wav_file.setsampwidth(2)
+            wav_file.setframerate(rate)
+            wav_file.writeframes(samples.tobytes())
+        return buffer.getvalue()
+
+    def make_user_dict_word(self, surface, pronunciation, accent_type=0, priority=5):
+        """生成与 VOICEVOX 相同结构的用户词典条目"""
+        mora_count = len([c for c in pronunciation if c not in SMALL_KANA])
+        return {
+            "surface": surface,
+            "priority": int(priority),
+            "context_id": 1348,
+            "part_of_speech": "名詞",
+            "part_of_speech_detail_1": "固有名詞",
+            "part_of_speech_detail_2": "一般",
+            "part_of_speech_detail_3": "*",
+            "inflectional_type": "*",
+            "inflectional_form": "*",
+            "stem": "*",
+            "yomi": pronunciation,
+            "pronunciation": pronunciation,
+            "accent_type": int(accent_type),
+            "mora_count": mora_count,
+            "accent_associative_rule": "*"
+        }
+
+class _StubRequestHandler(BaseHTTPRequestHandler):
+    """模拟服务器的请求处理器"""
+    server_stub = None
+
+    def log_message(self, format, *args):
+        # 不输出访问日志
+        pass
+
+    def _send_json(self, data, status=200):
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_empty(self, status=204):
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _prepare(self):
+        """解析请求并处理延迟和失败注入，返回 (路径, 参数) 或 None"""
+        stub = self.server_stub
+        parsed = urlparse(self.path)
+        path = parsed.path.rstrip("/") or "/"
+        params = {k: v[-1] for k, v in parse_qs(parsed.query).items()}
+        route = re.sub(r"^/user_dict_word/.+$", "/user_dict_word", path)
+        stub._count(route)
+        if stub.latency:
+            time.sleep(stub.latency)
+        if stub._should_fail(route):
+            self._send_json({"detail": "injected failure"}, status=500)
+            return None
+        return path, params
+
+    def do_GET(self):
+        prepared = self._prepare()
+        if prepared is None:
+            return
+        path, params = prepared
+        stub = self.server_stub
+        if path == "/user_dict":
+            with stub._lock:
+                words = dict(stub.user_dict)
+            self._send_json(words)
+        elif path == "/version":
+            self._send_json("0.0.0-stub")
+        elif path == "/speakers":
+            self._send_json([{"name": "stub", "speaker_uuid": "stub", "styles": [{"name": "ノーマル", "id": 0}]}])
+        else:
+            self._send_json({"detail": "Not Found"}, status=404)
+
+    def do_POST(self):
+        prepared = self._prepare()
+        if prepared is None:
+            return
+        path, params = prepared
+        stub = self.server_stub
+        body = self._read_body()
+
+        if path == "/audio_query":
+            self._send_json(stub.build_audio_query(params.get("text", "")))
+        elif path == "/accent_phrases":
+            self._send_json(stub.build_accent_phrases(params.get("text", "")))
+        elif path == "/synthesis":
+            try:
+                query = json.loads(body.decode("utf-8"))
+            except Exception:
+                self._send_json({"detail": "invalid query"}, status=422)
+                return
+            data = stub.synthesize(query, params.get("speaker", 0))
+            self.send_response(200)
+            self.send_header("Content-Type", "audio/wav")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        elif path == "/user_dict_word":
+            if "surface" not in params or "pronunciation" not in params:
+                self._send_json({"detail": "surface and pronunciation are required"}, status=422)
+                return
+            word_uuid = str(uuid.uuid4())
+            word = stub.make_user_dict_word(params["surface"], params["pronunciation"],
+                                            params.get("accent_type", 0), params.get("priority", 5))
+            with stub._lock:
+                stub.user_dict[word_uuid] = word
+            self._send_json(word_uuid)
+        elif path == "/import_user_dict":
+            try:
+                words = json.loads(body.decode("utf-8"))
+            except Exception:
+                self._send_json({"detail": "invalid dictionary"}, status=422)
+                return
+            override = params.get("override", "false").lower() == "true"
+            with stub._lock:
+                for word_uuid, word in words.items():
+                    if override or word_uuid not in stub.user_dict:
+                        stub.user_dict[word_uuid] = word
+            self._send_empty()
+        else:
+            self._send_json({"detail": "Not Found"}, status=404)
+
+    def do_PUT(self):
+        prepared = self._prepare()
+        if prepared is None:
+            return
+        path, params = prepared
+        stub = self.server_stub
+        if path.startswith("/user_dict_word/"):
+            word_uuid = path.split("/")[-1]
+            with stub._lock:
+                if word_uuid not in stub.user_dict:
+                    self._send_json({"detail": "Not Found"}, status=404)
+                    return
+                stub.user_dict[word_uuid] = stub.make_user_dict_word(
+                    params.get("surface", stub.user_dict[word_uuid]["surface"]),
+                    params.get("pronunciation", stub.user_dict[word_uuid]["pronunciation"]),
+                    params.get("accent_type", 0), params.get("priority", 5))
+            self._send_empty()
+        else:
+            self._send_json({"detail": "Not Found"}, status=404)
+
+    def do_DELETE(self):
+        prepared = self._prepare()
+        if prepared is None:
+            return
+        path, params = prepared
+        stub = self.server_stub
+        if path.startswith("/user_dict_word/"):
+            word_uuid = path.split("/")[-1]
+            with stub._lock:
+                removed = stub.user_dict.pop(word_uuid, None)
+            if removed is None:
+                self._send_json({"detail": "Not Found"}, status=404)
+            else:
+                self._send_empty()
+        else:
+            self._send_json({"detail": "Not Found"}, status=404)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="启动 VOICEVOX 模拟服务器")
+    parser.add_argument("--host", default="127.0.0.1", help="监听地址")
+    parser.add_argument("--port", type=int, default=50021, help="监听端口")
+    parser.add_argument("--latency", type=float, default=0.0, help="每个请求的额外延迟（秒）")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="请求失败的概率（0-1）")
+    args = parser.parse_args()
+
+    server = VoiceVoxStubServer(args.host, args.port, latency=args.latency, failure_rate=args.failure_rate).start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.stop()
@@ -0,0 +1,167 @@
+import os
+import json
+import hashlib
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional
+
+WORKFLOWS_DIR = "workflows"
+DEFAULT_WORKFLOW = "waterink"
+
+# 采样器节点类型及其种子输入名
+SAMPLER_SEED_INPUTS = {"KSampler": "seed", "KSamplerAdvanced": "noise_seed"}
+TEXT_ENCODER_TYPES = ("CLIPTextEncode",)
+LATENT_TYPES = ("EmptyLatentImage", "EmptySD3LatentImage")
+LORA_TYPES = ("LoraLoader",)
+OUTPUT_TYPES = ("SaveImage",)
+# 通过 WebSocket 直接发送图像的保存节点（ComfyUI 内置），不写入服务器磁盘，也不出现在生成历史中
+WEBSOCKET_OUTPUT_TYPE = "SaveImageWebsocket"
+
+def _is_link(value) -> bool:
+    """工作流 API 格式中，节点之间的连接表示为 [节点ID, 输出序号]"""
+    return isinstance(value, list) and len(value) == 2 and isinstance(value[0], str)
+
+def available_workflows(workflows_dir: str = WORKFLOWS_DIR) -> List[str]:
+    """列出可用的工作流名称（workflows 目录中的 JSON 文件名）"""
+    return sorted(path.stem for path in Path(workflows_dir).glob("*.json"))
+
+def resolve_workflow_path(name: str = None, workflows_dir: str = WORKFLOWS_DIR) -> Path:
+    """根据名称（例如 "waterink"、"Base"）或文件路径找到工作流文件"""
+    name = name or os.getenv("COMFYUI_WORKFLOW", DEFAULT_WORKFLOW)
+    path = Path(name)
+    if path.suffix == ".json" and path.exists():
+        return path
+    path = Path(workflows_dir) / f"{path.stem}.json"
+    if not path.exists():
+        raise FileNotFoundError(f"找不到工作流: {name}，可用的工作流: {', '.join(available_workflows(workflows_dir))}")
+    return path
+
+class WorkflowTemplate:
+    """ComfyUI 工作流模板
+
+    加载时按节点类型、标题和 KSampler 的连接找出需要修改的节点（种子、正面/负面提示词、LoRA、潜空间尺寸），
+    生成每个场景的工作流时只复制这些节点，其余节点与模板共用（不能修改）。
+    """
+
+    def __init__(self, workflow: Dict, name: str = "workflow"):
+        """初始化模板
+
+        Args:
+            workflow: API 格式的工作流（{节点ID: {"class_type": ..., "inputs": ...}}）
+            name: 工作流名称，用于日志
+        """
+        self.name = name
+        self.workflow = workflow
+        self.hash = hashlib.sha256(json.dumps(workflow, sort_keys=True).encode("utf-8")).hexdigest()
+
+        reachable = self._reachable_nodes()
+        self.sampler_id = self._find_sampler(reachable)
+        sampler = workflow[self.sampler_id]
+        self.seed_input = SAMPLER_SEED_INPUTS[sampler["class_type"]]
+        self.positive_id = self._find_text_node("positive", sampler)
+        self.negative_id = self._find_text_node("negative", sampler)
+        latent = sampler["inputs"].get("latent_image")
+        self.latent_id = latent[0] if _is_link(latent) and workflow[latent[0]]["class_type"] in LATENT_TYPES else None
+        # 只修改实际连接到输出的 LoRA 节点（未连接的节点不影响生成结果）
+        self.lora_ids = [node_id for node_id in reachable if workflow[node_id]["class_type"] in LORA_TYPES]
+        self.output_ids = [node_id for node_id, node in workflow.items() if node["class_type"] in OUTPUT_TYPES]
+
+    @classmethod
+    def load(cls, path) -> "WorkflowTemplate":
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(json.load(f), Path(path).stem)
+
+    def _reachable_nodes(self) -> List[str]:
+        """从输出节点沿连接反向遍历，返回所有会被执行的节点"""
+        stack = [node_id for node_id, node in self.workflow.items() if node["class_type"] in OUTPUT_TYPES]
+        seen = set()
+        while stack:
+            node_id = stack.pop()
+            if node_id in seen or node_id not in self.workflow:
+                continue
+            seen.add(node_id)
+            for value in self.workflow[node_id].get("inputs", {}).values():
+                if _is_link(value):
+                    stack.append(value[0])
+        return [node_id for node_id in self.workflow if node_id in seen]
+
+    def _find_sampler(self, reachable: List[str]) -> str:
+        samplers = [node_id for node_id in reachable if self.workflow[node_id]["class_type"] in SAMPLER_SEED_INPUTS]
+        if not samplers:
+            raise ValueError(f"工作流 {self.name} 中没有采样器节点 ({', '.join(SAMPLER_SEED_INPUTS)})")
+        return samplers[0]
+
+    def _find_text_node(self, role: str, sampler: Dict) -> str:
+        """找到正面或负面提示词节点：优先使用标题中包含 Positive/Negative 的节点，否则沿采样器的连接查找"""
+        for node_id, node in self.workflow.items():
+            title = node.get("_meta", {}).get("title", "").lower()
+            if node["class_type"] in TEXT_ENCODER_TYPES and role in title:
+                return node_id
+        link = sampler["inputs"].get(role)
+        if _is_link(link) and self.workflow[link[0]]["class_type"] in TEXT_ENCODER_TYPES:
+            return link[0]
+        raise ValueError(f"工作流 {self.name} 中找不到{role}提示词节点")
+
+    @property
+    def has_lora(self) -> bool:
+        return bool(self.lora_ids)
+
+    @property
+    def size(self) -> Optional[tuple]:
+        """潜空间图像的默认 (宽, 高)"""
+        if self.latent_id is None:
+            return None
+        inputs = self.workflow[self.latent_id]["inputs"]
+        return inputs.get("width"), inputs.get("height")
+
+    def render(self, seed: int, positive: str, negative: str, lora_name: str = None, width: int = None,
+               height: int = None, batch_size: int = None, websocket_output: bool = False) -> Dict:
+        """生成一个场景的工作流，只复制被修改的节点
+
+        Args:
+            seed: 采样种子
+            positive: 正面提示词
+            negative: 负面提示词
+            lora_name: LoRA 模型文件名，None 表示使用模板中的设置
+            width: 图像宽度，None 表示使用模板中的设置
+            height: 图像高度，None 表示使用模板中的设置
+            batch_size: 每次生成的图像数，None 表示使用模板中的设置
+            websocket_output: 为 True 时将 SaveImage 节点替换为 SaveImageWebsocket（节点 ID 不变）
+        """
+        workflow = dict(self.workflow)
+
+        def patch(node_id: str, **inputs):
+            node = dict(workflow[node_id])
+            node["inputs"] = {**node["inputs"], **{key: value for key, value in inputs.items() if value is not None}}
+            workflow[node_id] = node
+
+        patch(self.sampler_id, **{self.seed_input: seed})
+        patch(self.positive_id, text=positive)
+        patch(self.negative_id, text=negative)
+        if lora_name is not None:
+            for node_id in self.lora_ids:
+                patch(node_id, lora_name=lora_name)
+        if self.latent_id is not None and (width, height, batch_size) != (None, None, None):
+            patch(self.latent_id, width=width, height=height, batch_size=batch_size)
+        if websocket_output:
+            for node_id in self.output_ids:
+                workflow[node_id] = {
+                    "class_type": WEBSOCKET_OUTPUT_TYPE,
+                    "inputs": {"images": workflow[node_id]["inputs"]["images"]},
+                    "_meta": {"title": WEBSOCKET_OUTPUT_TYPE}
+                }
+        return workflow
+
+_templates = {}
+_templates_lock = threading.Lock()
+
+def load_workflow_template(name: str = None, workflows_dir: str = WORKFLOWS_DIR) -> WorkflowTemplate:
+    """加载工作流模板（每个文件只加载一次）"""
+    path = resolve_workflow_path(name, workflows_dir).resolve()
+    with _templates_lock:
+        mtime = path.stat().st_mtime
+        cached = _templates.get(path)
+        if cached is None or cached[0] != mtime:
+            cached = (mtime, WorkflowTemplate.load(path))
+            _templates[path] = cached
+        return cached[1]